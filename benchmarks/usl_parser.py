@@ -0,0 +1,164 @@
+"""
+Benchmark the USL wiki page parser.
+
+No USL wiki pages are committed. By default, the parser is benchmarked over SYNTHETIC pages generated by this script,
+which mimic the format of the USL (entries, headings, blank lines, the odd malformed entry) but not its real-world
+quirks, so treat the results as a rough guide. For realistic results, record the current USL wiki pages into
+benchmarks/fixtures/usl first (run from the repository root):
+    python -m benchmarks.usl_parser --record
+
+Once pages have been recorded, they're used instead of synthetic pages:
+    python -m benchmarks.usl_parser
+"""
+import argparse
+import pathlib
+import random
+import string
+import sys
+import time
+import typing
+import httpx
+
+from harmony_services import usl_parser
+
+_usl_wiki_index_url = "https://api.reddit.com/r/UniversalScammerList/wiki/banlist.json"
+_usl_wiki_paginated_url = "https://api.reddit.com/r/UniversalScammerList/wiki/banlist/$_page_num.json"
+
+_default_fixtures_path = pathlib.Path(__file__).parent / "fixtures" / "usl"
+_user_agent = "python:harmony-bot-benchmarks:v1.0"
+
+_synthetic_tags = ["#scammer", "#troll", "#sketchy", "#permanent", "#chargeback", "#multiple"]
+
+
+def record_fixtures(fixtures_path: pathlib.Path) -> typing.NoReturn:
+    """
+    Download the USL wiki index and every page it links to, and save their markdown content as fixtures.
+    :param fixtures_path: The directory to save the fixtures in.
+    :return: Nothing.
+    """
+    fixtures_path.mkdir(parents=True, exist_ok=True)
+
+    with httpx.Client(headers={"User-Agent": _user_agent}, timeout=30, follow_redirects=True) as client:
+        index_md = client.get(_usl_wiki_index_url).raise_for_status().json()["data"]["content_md"]
+        (fixtures_path / "index.md").write_text(index_md, encoding="utf-8")
+
+        for page_number in usl_parser.parse_page_numbers(index_md):
+            page_url = _usl_wiki_paginated_url.replace("$_page_num", str(page_number))
+            page_md = client.get(page_url).raise_for_status().json()["data"]["content_md"]
+            (fixtures_path / f"page_{page_number}.md").write_text(page_md, encoding="utf-8")
+
+            print(f"Recorded page {page_number} ({len(page_md)} characters).")
+
+
+def generate_synthetic_pages(page_count: int, entries_per_page: int) -> typing.List[str]:
+    """
+    Generate synthetic USL wiki pages in the same format as the real ones.
+    Besides entries, the pages have headings and blank lines between sections, the occasional entry with trailing
+    whitespace or CRLF line endings, and the occasional malformed entry, so that every path through the parser is
+    exercised. They're not a substitute for recorded pages.
+    :param page_count: The number of pages to generate.
+    :param entries_per_page: The number of entries on each page.
+    :return: The markdown content of each page.
+    """
+    generator = random.Random(0)
+    username_characters = string.ascii_letters + string.digits + "_-"
+    pages = []
+
+    for page_number in range(page_count):
+        lines = [f"# Page {page_number + 1}", ""]
+
+        for entry_number in range(entries_per_page):
+            if entry_number % 250 == 0:
+                lines.extend(["", f"## Section {entry_number // 250 + 1}", ""])
+
+            username = "".join(generator.choices(username_characters, k=generator.randint(3, 20)))
+            tags = " ".join(generator.sample(_synthetic_tags, k=generator.randint(1, 3)))
+            roll = generator.random()
+
+            if roll < 0.001:
+                lines.append(f"* /u/ {tags}")
+            elif roll < 0.002:
+                lines.append(f"* u/{username} - {tags}")
+            elif roll < 0.02:
+                lines.append(f"* /u/{username} {tags}  \r")
+            else:
+                lines.append(f"* /u/{username} {tags}")
+
+        pages.append("\n".join(lines))
+
+    return pages
+
+
+def load_fixtures(fixtures_path: pathlib.Path) -> typing.List[str]:
+    """
+    Load the recorded USL wiki pages.
+    :param fixtures_path: The directory the pages were recorded in.
+    :return: The markdown content of each recorded page (not including the index).
+    """
+    return [page_path.read_text(encoding="utf-8") for page_path in sorted(fixtures_path.glob("page_*.md"))]
+
+
+def run_benchmark(pages: typing.List[str], iterations: int) -> typing.NoReturn:
+    """
+    Parse every page repeatedly, and print the parse throughput.
+    :param pages: The markdown content of each page.
+    :param iterations: The number of times to parse every page.
+    :return: Nothing.
+    """
+    total_characters = sum(len(page) for page in pages)
+    timings = []
+    stats = usl_parser.UslParseStats()
+
+    for _ in range(iterations):
+        stats = usl_parser.UslParseStats()
+        started_at = time.perf_counter()
+
+        for page in pages:
+            usl_parser.parse_entries_page(page, stats)
+
+        timings.append(time.perf_counter() - started_at)
+
+    best_seconds = min(timings)
+    mean_seconds = sum(timings) / len(timings)
+
+    print(f"Parsed {len(pages)} pages ({total_characters / 1_000_000:.2f}M characters): {stats}")
+
+    if stats.malformed_examples:
+        print(f"Malformed lines, e.g.: {stats.malformed_examples!r}")
+
+    print(f"Best: {best_seconds * 1000:.1f}ms, mean: {mean_seconds * 1000:.1f}ms over {iterations} iterations")
+    print(f"Throughput: {stats.line_count / best_seconds:,.0f} lines/s, "
+          f"{total_characters / best_seconds / 1_000_000:.1f}M characters/s")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the USL wiki page parser.")
+    parser.add_argument("--fixtures", type=pathlib.Path, default=_default_fixtures_path,
+                        help="The directory recorded USL wiki pages are saved in.")
+    parser.add_argument("--record", action="store_true",
+                        help="Record the current USL wiki pages as fixtures before benchmarking.")
+    parser.add_argument("--iterations", type=int, default=10, help="The number of times to parse every page.")
+    parser.add_argument("--synthetic-pages", type=int, default=20,
+                        help="The number of synthetic pages to generate if no pages have been recorded.")
+    parser.add_argument("--synthetic-entries", type=int, default=5000,
+                        help="The number of entries on each synthetic page.")
+    args = parser.parse_args()
+
+    if args.record:
+        record_fixtures(args.fixtures)
+
+    pages = load_fixtures(args.fixtures) if args.fixtures.is_dir() else []
+
+    if pages:
+        print(f"Using {len(pages)} recorded pages from {args.fixtures}.")
+    else:
+        print("No recorded pages found, using SYNTHETIC pages. Run with --record to record the real USL.")
+        pages = generate_synthetic_pages(args.synthetic_pages, args.synthetic_entries)
+
+    run_benchmark(pages, args.iterations)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
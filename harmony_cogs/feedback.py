@@ -51,4 +51,4 @@ class Feedback(commands.Cog):
             logger.info(f"Deleting feedback data because message with ID {payload.message_id} "
                         f"was deleted from #{self.feedback_channel.name}")
 
-            harmony_services.db.delete_feedback_data(payload.message_id)
\ No newline at end of file
+            await harmony_services.db.delete_feedback_data(payload.message_id)
\ No newline at end of file
@@ -1,10 +1,8 @@
-import datetime
-
 import munch
 import typing
 import discord
-import harmony_services.db
 import harmony_ui.message_rate_limiter
+import harmony_services.message_rate_limiter
 
 from loguru import logger
 from main import HarmonyBot
@@ -30,7 +28,14 @@ class MessageRateLimiter(commands.Cog):
 
         self.validate_config()
 
-        self.limited_channel_ids = [channel.channel_id for channel in self.limited_channels]
+        self.rate_limiter = harmony_services.message_rate_limiter.MessageRateLimitEngine(self.limited_channels)
+
+    async def cog_load(self) -> typing.NoReturn:
+        await self.rate_limiter.load()
+        self.rate_limiter.start()
+
+    async def cog_unload(self) -> typing.NoReturn:
+        await self.rate_limiter.stop()
 
     def validate_config(self):
         for channel in self.limited_channels:
@@ -47,52 +52,46 @@ class MessageRateLimiter(commands.Cog):
         :return: Nothing.
         """
         # If the message isn't in a guild or not in a limited channel, do nothing.
-        if not message.guild or message.channel.id not in self.limited_channel_ids:
+        rate_limit_seconds = self.rate_limiter.get_rate_limit_seconds(message.channel.id)
+
+        if not message.guild or rate_limit_seconds is None:
             return
 
         # If the message was sent by the bot, do nothing.
         if message.author.id == self.bot.user.id:
             return
 
-        # Get any data about rate limiting in this channel for the user that sent the message.
-        rate_limiter_data = harmony_services.db.get_rate_limiter_message_data(message.author.name, message.channel.id)
-        channel_limit = [channel for channel in self.limited_channels if channel.channel_id == message.channel.id][0]
+        # Check the message against the rate limit, recording it if the author isn't currently limited.
+        original_message_timestamp = self.rate_limiter.record_message(
+            message.author.id,
+            message.author.name,
+            message.channel.id
+        )
 
-        if not rate_limiter_data:
-            # If there is no data, then save it and move on.
+        if not original_message_timestamp:
             logger.info(f"Saving rate limiter data for channel ID {message.channel.id}, author {message.author.name}")
-            harmony_services.db.save_rate_limiter_message_data(message.author.name, message.channel.id)
         else:
-            # Is the expiry timestamp after the current time in UTC?
-            original_message_timestamp = rate_limiter_data.message_timestamp
-            expiry_timestamp = original_message_timestamp + datetime.timedelta(seconds=channel_limit.rate_limit_seconds)
-
-            if expiry_timestamp > datetime.datetime.utcnow():
-                # If so, then delete the message and notify the author.
-                logger.info(f"Deleting {message.author.name}'s message in channel ID {message.channel.id}: "
-                            f"their last message (sent at {original_message_timestamp}) is less than "
-                            f"{channel_limit.rate_limit_seconds} old.")
-
-                guild_channel = message.guild.get_channel(message.channel.id)
-
-                await message.delete()
-
-                try:
-                    await message.author.send(
-                        embed=harmony_ui.message_rate_limiter.create_message_limited_embed(
-                            author_name=message.author.name,
-                            guild_name=message.guild.name,
-                            guild_channel_name=guild_channel.name,
-                            guild_channel_url=guild_channel.jump_url,
-                            original_message_timestamp=rate_limiter_data.message_timestamp,
-                            rate_limit_seconds=channel_limit.rate_limit_seconds,
-                            deleted_message_content=message.clean_content
-                        )
+            # The user's last message is still within the rate limit, so delete this one and notify the author.
+            logger.info(f"Deleting {message.author.name}'s message in channel ID {message.channel.id}: "
+                        f"their last message (sent at {original_message_timestamp}) is less than "
+                        f"{rate_limit_seconds} old.")
+
+            guild_channel = message.guild.get_channel(message.channel.id)
+
+            await message.delete()
+
+            try:
+                await message.author.send(
+                    embed=harmony_ui.message_rate_limiter.create_message_limited_embed(
+                        author_name=message.author.name,
+                        guild_name=message.guild.name,
+                        guild_channel_name=guild_channel.name,
+                        guild_channel_url=guild_channel.jump_url,
+                        original_message_timestamp=original_message_timestamp,
+                        rate_limit_seconds=rate_limit_seconds,
+                        deleted_message_content=message.clean_content
                     )
-                except discord.errors.DiscordException as e:
-                    logger.warning(f"Failed to PM user {message.author.name} with message rate-limit, "
-                                   f"got exception: {str(e)}")
-
-            else:
-                # Delete their existing data and move on.
-                rate_limiter_data.delete()
+                )
+            except discord.errors.DiscordException as e:
+                logger.warning(f"Failed to PM user {message.author.name} with message rate-limit, "
+                               f"got exception: {str(e)}")
@@ -3,6 +3,7 @@ import typing
 import discord
 import harmony_ui
 import harmony_ui.verify
+import harmony_services.ban_index
 
 from loguru import logger
 from main import HarmonyBot
@@ -10,7 +11,15 @@ from discord import app_commands
 from discord.ext import commands
 from harmony_config import config
 from harmony_services import db as harmony_db
-from harmony_scheduled.verify import check_reddit_accounts_task, check_discord_roles_task, update_usl_task
+from harmony_services import usl as harmony_usl
+from harmony_services import flair_sync as harmony_flair_sync
+from harmony_services.reddit_outbox import RedditOutboxWorker
+from harmony_scheduled.verify import (
+    check_reddit_accounts_task,
+    check_discord_roles_task,
+    sync_ban_index_task,
+    update_usl_task
+)
 
 configured_verify_role_data = config.get_configuration_key("roles", required=True, expected_type=list)
 subreddit_name = config.get_configuration_key("reddit.subreddit_name", required=True)
@@ -33,6 +42,7 @@ class Verify(commands.Cog):
 
     def __init__(self, bot: HarmonyBot) -> typing.NoReturn:
         self.bot = bot
+        self.reddit_outbox_worker = RedditOutboxWorker()
 
         whois_context_menu = app_commands.ContextMenu(
             name="Whois",
@@ -49,15 +59,28 @@ class Verify(commands.Cog):
         self.bot.tree.add_command(whois_context_menu)
         self.bot.tree.add_command(update_role_context_menu)
 
+        # Make the USL available straight away, the refresh task brings it up to date in the background.
+        harmony_usl.load_usl_snapshot()
+
         check_reddit_accounts_task.start(self.bot)
         check_discord_roles_task.start(self.bot)
-        update_usl_task.start()
+        sync_ban_index_task.start()
+        update_usl_task.start(self.bot)
+
+    async def cog_load(self) -> typing.NoReturn:
+        self.reddit_outbox_worker.start()
+
+        # Verifications are screened against the ban index, so make sure it's loaded before anyone verifies.
+        await harmony_services.ban_index.ensure_ban_index_loaded()
 
-    def cog_unload(self) -> typing.NoReturn:
+    async def cog_unload(self) -> typing.NoReturn:
         check_reddit_accounts_task.cancel()
         check_discord_roles_task.cancel()
+        sync_ban_index_task.cancel()
         update_usl_task.cancel()
 
+        await self.reddit_outbox_worker.stop()
+
     @app_commands.command(
         name='verify',
         description='Link your Reddit and Discord accounts to gain access to member-only benefits.'
@@ -71,14 +94,19 @@ class Verify(commands.Cog):
         :return: Nothing.
         """
         try:
-            if harmony_db.has_verification_data(interaction.user.id):
+            if await harmony_db.has_verification_data(interaction.user.id):
                 await interaction.response.send_message(
                     "Looks like you're already verified. If you can't access the server, **please raise a ticket.**",
                     ephemeral=True)
 
                 return
 
-            if harmony_db.has_pending_verification(interaction.user.id):
+            if await harmony_db.is_pending_verification_held(interaction.user.id):
+                await interaction.response.send_message(
+                    embed=harmony_ui.verify.create_verification_held_embed(),
+                    ephemeral=True
+                )
+            elif await harmony_db.has_pending_verification(interaction.user.id):
                 await interaction.response.send_modal(harmony_ui.verify.EnterVerificationTokenModal())
             else:
                 await interaction.response.send_modal(harmony_ui.verify.EnterRedditUsernameModal())
@@ -93,11 +121,11 @@ class Verify(commands.Cog):
     @app_commands.guilds(discord.Object(guild_id))
     async def display_unverify_dialog(self, interaction: discord.Interaction):
         try:
-            if harmony_db.has_verification_data(interaction.user.id):
+            if await harmony_db.has_verification_data(interaction.user.id):
                 await interaction.response.send_modal(harmony_ui.verify.UnverifyConfirmationModal())
-            elif harmony_db.has_pending_verification(interaction.user.id):
-                pending_verification = harmony_db.get_pending_verification(interaction.user.id)
-                pending_verification.delete()
+            elif await harmony_db.has_pending_verification(interaction.user.id):
+                pending_verification = await harmony_db.get_pending_verification(interaction.user.id)
+                await harmony_db.delete_document(pending_verification)
                 await interaction.response.send_message(
                     "Your pending verification has been cancelled. You can `/verify` again at any time.", ephemeral=True)
             else:
@@ -127,10 +155,16 @@ class Verify(commands.Cog):
 
             if query.startswith("u/"):
                 logger.info(f"/whois: {interaction.user.name} looked up user by Reddit username {query}")
-                result = harmony_db.get_verification_data(reddit_username=query.replace("u/", ""))
+                result = await harmony_db.get_verification_data(
+                    reddit_username=query.replace("u/", ""),
+                    read_preference=harmony_db.lookup_read_preference
+                )
             elif query.isnumeric():
                 logger.info(f"/whois: {interaction.user.name} looked up user by Discord user ID {query}")
-                result = harmony_db.get_verification_data(discord_user_id=int(query))
+                result = await harmony_db.get_verification_data(
+                    discord_user_id=int(query),
+                    read_preference=harmony_db.lookup_read_preference
+                )
             else:
                 logger.info(f"/whois: {interaction.user.name} looked up user by Discord username {query}")
                 guild_member = discord.utils.get(interaction.guild.members, name=query)
@@ -157,7 +191,7 @@ class Verify(commands.Cog):
     @app_commands.checks.has_role(user_management_role_id)
     async def update_role(self, interaction: discord.Interaction, member: discord.Member):
         try:
-            verification_data = harmony_db.get_verification_data(discord_user_id=member.id)
+            verification_data = await harmony_db.get_verification_data(discord_user_id=member.id)
 
             if not verification_data:
                 await interaction.response.send_message(
@@ -173,13 +207,70 @@ class Verify(commands.Cog):
         except Exception as e:
             await harmony_ui.handle_error(interaction, e)
 
+    @commands.command(name="flairsync")
+    @commands.guild_only()
+    @commands.has_role(user_management_role_id)
+    async def sync_flair(
+            self,
+            ctx: commands.Context,
+            mode: typing.Literal["dry-run", "apply"] = "dry-run"
+    ) -> typing.NoReturn:
+        """
+        Command to bring subreddit flair in line with verified users' Discord roles.
+        :param ctx: The command context.
+        :param mode: Either dry-run (the default), to report what would change, or apply, to update the flair.
+        :return: Nothing.
+        """
+        if harmony_flair_sync.is_running():
+            await ctx.send("A flair sync is already running, please wait for it to finish.")
+            return
+
+        dry_run = mode != "apply"
+        logger.info(f"User {ctx.message.author.name} started a flair sync (dry run: {dry_run})")
+
+        progress_message = await ctx.send("Comparing subreddit flair with Discord roles...")
+
+        async def report_progress(updated_count: int, total_count: int) -> typing.NoReturn:
+            await progress_message.edit(content=f"Updating subreddit flair: {updated_count}/{total_count} users...")
+
+        try:
+            result = await harmony_flair_sync.sync_flair(dry_run=dry_run, progress_callback=report_progress)
+        except Exception as e:
+            logger.error(f"Flair sync failed: {type(e).__name__}: {str(e)}")
+            await progress_message.edit(content=f":no_entry_sign: Flair sync failed: `{type(e).__name__}`: {str(e)}")
+            return
+
+        report_message = (f"Checked {result.checked_count} verified users with a configured role, "
+                          f"{len(result.changes)} had outdated flair.\n")
+
+        if dry_run:
+            report_message += ("\n:information_source: No flair has been changed - this is a dry run. "
+                               "Run `$flairsync apply` to update it.")
+        else:
+            report_message += f"\n- :white_check_mark: Updated flair for {result.updated_count} users."
+
+            if result.failed_updates:
+                report_message += (f"\n- :no_entry_sign: Failed to update flair for "
+                                   f"{len(result.failed_updates)} users:\n")
+
+                for failed_update in result.failed_updates[:20]:
+                    report_message += f"  - u/{failed_update['user']}: {failed_update['errors']}\n"
+
+                if len(result.failed_updates) > 20:
+                    report_message += f"  - ...and {len(result.failed_updates) - 20} more, see the bot logs.\n"
+
+                for failed_update in result.failed_updates:
+                    logger.warning(f"Failed to update flair for u/{failed_update['user']}: {failed_update['errors']}")
+
+        await progress_message.edit(content=report_message)
+
     @commands.Cog.listener()
     async def on_member_remove(self, member: discord.Member):
         try:
-            verification_data = harmony_db.get_verification_data(discord_user_id=member.id)
+            verification_data = await harmony_db.get_verification_data(discord_user_id=member.id)
 
             if verification_data:
-                verification_data.delete()
+                await harmony_db.delete_document(verification_data)
         except Exception as e:
             logger.warning(f"Member {member.name} left the Discord server, but failed to remove their data.")
 
@@ -45,7 +45,7 @@ class JsonHarmonyConfigurationProvider(BaseHarmonyConfigurationProvider):
         if required and value is None:
             raise RuntimeError(f"Required key {key} was not found in the configuration.")
 
-        if type(value) is not expected_type:
+        if value is not None and type(value) is not expected_type:
             raise RuntimeError(f"Value at {key} should be of type {expected_type.__name__}, "
                                f"but is a {type(value).__name__}")
 
@@ -15,3 +15,5 @@ class FeedbackItem(mongoengine.Document):
     feedback_description = mongoengine.StringField(required=True, max_length=1500)
     discord_message_id = mongoengine.LongField(required=True, unique=True)
     votes = mongoengine.EmbeddedDocumentListField(FeedbackVote, default=[])
+    upvote_count = mongoengine.IntField(default=0)
+    downvote_count = mongoengine.IntField(default=0)
@@ -3,6 +3,14 @@ import mongoengine
 
 
 class MessageRateLimitItem(mongoengine.Document):
+    author_id = mongoengine.LongField()
     author_username = mongoengine.StringField(required=True)
     guild_channel_id = mongoengine.LongField(required=True)
     message_timestamp = mongoengine.DateTimeField(default=datetime.datetime.utcnow)
+    expires_at = mongoengine.DateTimeField(required=True)
+    meta = {
+        'indexes': [
+            ('author_id', 'guild_channel_id'),
+            {'fields': ['expires_at'], 'expireAfterSeconds': 0}
+        ]
+    }
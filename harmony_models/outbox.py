@@ -0,0 +1,38 @@
+import datetime
+import mongoengine
+
+OUTBOX_STATUS_PENDING = "pending"
+OUTBOX_STATUS_SENT = "sent"
+OUTBOX_STATUS_FAILED = "failed"
+OUTBOX_STATUS_SUPERSEDED = "superseded"
+
+
+class OutboundRedditMessage(mongoengine.Document):
+    recipient_username = mongoengine.StringField(required=True)
+    recipient_username_lower = mongoengine.StringField(required=True)
+    subject = mongoengine.StringField(required=True)
+    body = mongoengine.StringField(required=True)
+    status = mongoengine.StringField(
+        required=True,
+        default=OUTBOX_STATUS_PENDING,
+        choices=[OUTBOX_STATUS_PENDING, OUTBOX_STATUS_SENT, OUTBOX_STATUS_FAILED, OUTBOX_STATUS_SUPERSEDED]
+    )
+    attempts = mongoengine.IntField(default=0)
+    last_error = mongoengine.StringField()
+    created_at = mongoengine.DateTimeField(default=datetime.datetime.utcnow)
+    next_attempt_at = mongoengine.DateTimeField(default=datetime.datetime.utcnow)
+    sent_at = mongoengine.DateTimeField()
+    expires_at = mongoengine.DateTimeField(required=True)
+    meta = {
+        'collection': 'outbound_reddit_messages',
+        'indexes': [
+            ('status', 'next_attempt_at'),
+            # Only one message per recipient may be waiting to be sent at a time.
+            {
+                'fields': ['recipient_username_lower'],
+                'unique': True,
+                'partialFilterExpression': {'status': OUTBOX_STATUS_PENDING}
+            },
+            {'fields': ['expires_at'], 'expireAfterSeconds': 0}
+        ]
+    }
@@ -0,0 +1,46 @@
+import typing
+import datetime
+
+
+class RedditorProfile:
+    def __init__(
+            self,
+            username: str,
+            exists: bool,
+            reddit_user_id: typing.Optional[str] = None,
+            created_utc: typing.Optional[float] = None,
+            is_suspended: bool = False
+    ):
+        """
+        Create a RedditorProfile (the parts of a Redditor's about page that Harmony cares about).
+        :param username: The Redditor's username, not beginning with u/.
+        :param exists: Whether Reddit returned an account for the username (suspended accounts are still returned).
+        :param reddit_user_id: The Redditor's account ID, not available for suspended accounts.
+        :param created_utc: The Redditor's account creation timestamp, not available for suspended accounts.
+        :param is_suspended: Whether the Redditor's account has been suspended.
+        """
+        self.username = username
+        self.exists = exists
+        self.reddit_user_id = reddit_user_id
+        self.created_utc = created_utc
+        self.is_suspended = is_suspended
+
+    @property
+    def is_active(self) -> bool:
+        """
+        Whether the account exists and can be used, i.e. it hasn't been deleted or suspended.
+        """
+        return self.exists and self.reddit_user_id is not None
+
+    @property
+    def account_age_days(self) -> typing.Optional[int]:
+        """
+        The Redditor's account age in days, if known.
+        """
+        if self.created_utc is None:
+            return None
+
+        account_created_timestamp = datetime.datetime.fromtimestamp(self.created_utc, tz=datetime.timezone.utc)
+        now_timestamp = datetime.datetime.now(tz=datetime.timezone.utc)
+
+        return (now_timestamp - account_created_timestamp).days
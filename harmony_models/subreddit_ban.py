@@ -0,0 +1,27 @@
+import datetime
+import mongoengine
+
+
+class SubredditBan(mongoengine.Document):
+    subreddit_name = mongoengine.StringField(required=True)
+    reddit_username = mongoengine.StringField(required=True)
+    reddit_username_lower = mongoengine.StringField(required=True)
+    banned_at = mongoengine.DateTimeField()
+    synced_at = mongoengine.DateTimeField(default=datetime.datetime.utcnow)
+    meta = {
+        'collection': 'subreddit_bans',
+        'indexes': [
+            {'fields': ['subreddit_name', 'reddit_username_lower'], 'unique': True}
+        ]
+    }
+
+
+class SubredditBanSyncState(mongoengine.Document):
+    subreddit_name = mongoengine.StringField(required=True, unique=True)
+    last_ban_action_id = mongoengine.StringField()
+    last_unban_action_id = mongoengine.StringField()
+    last_full_sync_at = mongoengine.DateTimeField()
+    last_sync_at = mongoengine.DateTimeField()
+    meta = {
+        'collection': 'subreddit_ban_sync_state'
+    }
@@ -0,0 +1,26 @@
+import datetime
+import mongoengine
+
+# Bump this whenever the way pages are parsed into entries changes, so that stale snapshots are ignored.
+USL_SNAPSHOT_FORMAT_VERSION = 2
+
+
+class UslSnapshotPage(mongoengine.EmbeddedDocument):
+    page_number = mongoengine.IntField(required=True)
+    etag = mongoengine.StringField()
+    last_modified = mongoengine.StringField()
+    revision_id = mongoengine.StringField()
+    content_md = mongoengine.StringField()
+    # Each entry is a [lowercased username, [tags]] pair, since usernames aren't safe to use as document keys.
+    entries = mongoengine.ListField(mongoengine.ListField())
+
+
+class UslSnapshot(mongoengine.Document):
+    snapshot_id = mongoengine.StringField(primary_key=True, default="usl")
+    format_version = mongoengine.IntField(required=True)
+    saved_at = mongoengine.DateTimeField(default=datetime.datetime.utcnow)
+    page_numbers = mongoengine.ListField(mongoengine.IntField())
+    pages = mongoengine.EmbeddedDocumentListField(UslSnapshotPage)
+    meta = {
+        'collection': 'usl_snapshots'
+    }
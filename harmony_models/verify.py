@@ -10,6 +10,11 @@ class DiscordUser(mongoengine.EmbeddedDocument):
 class RedditUser(mongoengine.EmbeddedDocument):
     reddit_user_id = mongoengine.StringField(required=True, unique=True)
     reddit_username = mongoengine.StringField(required=True)
+    reddit_username_lower = mongoengine.StringField()
+
+    def clean(self):
+        # Reddit usernames are case-insensitive, so keep a normalised copy that can be looked up using an index.
+        self.reddit_username_lower = self.reddit_username.lower() if self.reddit_username else None
 
 
 class UserVerificationData(mongoengine.EmbeddedDocument):
@@ -20,13 +25,28 @@ class UserVerificationData(mongoengine.EmbeddedDocument):
 class PendingVerificationData(mongoengine.EmbeddedDocument):
     requested_verification_at = mongoengine.DateTimeField(default=datetime.datetime.now)
     verification_code = mongoengine.StringField(required=True, unique=True)
+    expires_at = mongoengine.DateTimeField()
+
+
+class ScreeningData(mongoengine.EmbeddedDocument):
+    reasons = mongoengine.ListField(mongoengine.StringField())
+    # Held verifications don't have their code sent until a moderator approves them.
+    is_held = mongoengine.BooleanField(default=False)
+    review_message_id = mongoengine.LongField()
 
 
 class PendingVerification(mongoengine.Document):
     discord_user: DiscordUser = mongoengine.EmbeddedDocumentField(DiscordUser, required=True)
     reddit_user: RedditUser = mongoengine.EmbeddedDocumentField(RedditUser, required=True)
     pending_verification_data: PendingVerificationData = mongoengine.EmbeddedDocumentField(PendingVerificationData, required=True)
-    meta = {'collection': 'pending_verifications'}
+    screening_data: ScreeningData = mongoengine.EmbeddedDocumentField(ScreeningData)
+    meta = {
+        'collection': 'pending_verifications',
+        'indexes': [
+            {'fields': ['pending_verification_data.expires_at'], 'expireAfterSeconds': 0},
+            {'fields': ['screening_data.review_message_id'], 'sparse': True}
+        ]
+    }
 
 
 class VerifiedUser(mongoengine.Document):
@@ -34,4 +54,19 @@ class VerifiedUser(mongoengine.Document):
     reddit_user: RedditUser = mongoengine.EmbeddedDocumentField(RedditUser, required=True)
     user_verification_data: UserVerificationData = mongoengine.EmbeddedDocumentField(UserVerificationData, required=True)
     is_legacy_migration = mongoengine.BooleanField(default=False)
-    meta = {'collection': 'verified_users'}
+    meta = {
+        'collection': 'verified_users',
+        'indexes': [
+            'reddit_user.reddit_username_lower'
+        ]
+    }
+
+
+class VerifiedUserRemoval(mongoengine.Document):
+    discord_user_id = mongoengine.IntField(required=True)
+    discord_member_name = mongoengine.StringField()
+    reddit_username = mongoengine.StringField(required=True)
+    removal_reason = mongoengine.StringField(required=True)
+    user_notified = mongoengine.BooleanField(default=False)
+    removed_at = mongoengine.DateTimeField(default=datetime.datetime.utcnow)
+    meta = {'collection': 'verified_user_removals'}
@@ -0,0 +1,314 @@
+import typing
+import asyncio
+import discord
+import munch
+import harmony_ui.verify
+import asyncprawcore.exceptions
+import harmony_services.ban_index
+
+from loguru import logger
+from harmony_config import config
+from harmony_models.reddit import RedditorProfile
+from harmony_services import db as harmony_db
+from harmony_services import reddit as harmony_reddit
+
+subreddit_name = config.get_configuration_key("reddit.subreddit_name", required=True)
+verified_role = discord.Object(config.get_configuration_key(
+    "discord.verified_role_id",
+    required=True,
+    expected_type=int
+))
+discord_lookup_concurrency = config.get_configuration_key(
+    "schedule.reddit_account_check_discord_concurrency",
+    expected_type=int,
+    or_else=10
+)
+reddit_status_concurrency = config.get_configuration_key(
+    "schedule.reddit_account_check_reddit_concurrency",
+    expected_type=int,
+    or_else=2
+)
+action_concurrency = config.get_configuration_key(
+    "schedule.reddit_account_check_action_concurrency",
+    expected_type=int,
+    or_else=5
+)
+
+# Marks the end of a stage's input.
+_end_of_stage = object()
+
+
+class _MemberBatch:
+    def __init__(self, users: typing.List[munch.Munch], members: typing.Dict[int, discord.Member]):
+        self.users = users
+        self.members = members
+
+
+class _Enforcement:
+    def __init__(
+            self,
+            user: munch.Munch,
+            member: typing.Optional[discord.Member],
+            reddit_profile: typing.Optional[RedditorProfile] = None
+    ):
+        self.user = user
+        self.member = member
+        self.reddit_profile = reddit_profile
+
+
+class RedditAccountCheckPipeline:
+    def __init__(
+            self,
+            guild: discord.Guild,
+            removal_batch: harmony_db.VerifiedUserRemovalBatch,
+            read_batch_size: int,
+            dry_run: bool
+    ):
+        """
+        Create a RedditAccountCheckPipeline (the stages of the Reddit account check job, run concurrently).
+        Batches of verified users flow from the database through three stages, connected by bounded queues:
+        - Discord lookup, which finds each user's guild member in the gateway cache, falling back to fetching members
+          which aren't cached, up to schedule.reddit_account_check_discord_concurrency at a time.
+        - Reddit status, which looks up a batch of users' Reddit accounts at once, working on up to
+          schedule.reddit_account_check_reddit_concurrency batches at a time. Requests are paced by the Reddit request
+          scheduler, so this stays within the API budget however many batches are in flight.
+        - Enforcement, which removes roles, notifies and bans users, up to
+          schedule.reddit_account_check_action_concurrency users at a time.
+        Discord requests are paced by discord.py's own rate limit handling.
+        :param guild: The guild to check the members of, with its members cached.
+        :param removal_batch: The batch to queue verification data removals on.
+        :param read_batch_size: The number of verified users to read from the database at a time.
+        :param dry_run: If True, work out what would be done, but don't do it.
+        """
+        self.guild = guild
+        self.removal_batch = removal_batch
+        self.read_batch_size = read_batch_size
+        self.dry_run = dry_run
+        self.removed_users: typing.List[typing.Dict[str, typing.Any]] = []
+
+        # Enough to keep each stage busy while the one before it works on the next batch.
+        self._user_batches = asyncio.Queue(maxsize=2)
+        self._member_batches = asyncio.Queue(maxsize=reddit_status_concurrency * 2)
+        self._enforcements = asyncio.Queue(maxsize=action_concurrency * 2)
+
+    async def run(self) -> typing.List[typing.Dict[str, typing.Any]]:
+        """
+        Check every verified user, taking action against those whose Reddit accounts are no longer in good standing.
+        If any stage fails, the others are cancelled and the failure is raised.
+        :return: The details of each user that action was taken against.
+        """
+        try:
+            async with asyncio.TaskGroup() as task_group:
+                task_group.create_task(self._read_users())
+                task_group.create_task(self._run_stage(self._lookup_members, self._user_batches, 1,
+                                                       self._member_batches, reddit_status_concurrency))
+                task_group.create_task(self._run_stage(self._check_reddit_accounts, self._member_batches,
+                                                       reddit_status_concurrency, self._enforcements,
+                                                       action_concurrency))
+                task_group.create_task(self._run_stage(self._enforce, self._enforcements, action_concurrency))
+        except ExceptionGroup as e:
+            for error in e.exceptions[1:]:
+                logger.error(f"Reddit account check stage also failed: {type(error).__name__}: {str(error)}")
+
+            raise e.exceptions[0]
+
+        return self.removed_users
+
+    @staticmethod
+    async def _run_stage(
+            process: typing.Callable[[typing.Any], typing.Awaitable[None]],
+            input_queue: asyncio.Queue,
+            worker_count: int,
+            output_queue: asyncio.Queue = None,
+            output_worker_count: int = 0
+    ) -> typing.NoReturn:
+        async def work() -> typing.NoReturn:
+            while True:
+                item = await input_queue.get()
+
+                if item is _end_of_stage:
+                    return
+
+                await process(item)
+
+        await asyncio.gather(*[work() for _ in range(worker_count)])
+
+        # Let the next stage's workers know that nothing else is coming.
+        for _ in range(output_worker_count):
+            await output_queue.put(_end_of_stage)
+
+    async def _read_users(self) -> typing.NoReturn:
+        user_batches = harmony_db.iter_verification_data_batches(
+            "discord_user__discord_user_id",
+            "reddit_user__reddit_user_id",
+            "reddit_user__reddit_username",
+            batch_size=self.read_batch_size,
+            read_preference=harmony_db.scan_read_preference
+        )
+
+        async for users in user_batches:
+            await self._user_batches.put(users)
+
+        await self._user_batches.put(_end_of_stage)
+
+    async def _lookup_members(self, users: typing.List[munch.Munch]) -> typing.NoReturn:
+        semaphore = asyncio.Semaphore(discord_lookup_concurrency)
+
+        async def lookup_member(user: munch.Munch) -> typing.Optional[discord.Member]:
+            discord_user_id = user.discord_user.discord_user_id
+            member = self.guild.get_member(discord_user_id)
+
+            if member:
+                return member
+
+            async with semaphore:
+                try:
+                    return await self.guild.fetch_member(discord_user_id)
+                except discord.errors.NotFound:
+                    return None
+
+        members = await asyncio.gather(*[lookup_member(user) for user in users])
+        users_in_guild = []
+
+        for user, member in zip(users, members):
+            if member:
+                users_in_guild.append(user)
+            else:
+                await self._enforcements.put(_Enforcement(user, None))
+
+        if users_in_guild:
+            await self._member_batches.put(_MemberBatch(
+                users_in_guild,
+                {member.id: member for member in members if member}
+            ))
+
+    async def _check_reddit_accounts(self, member_batch: _MemberBatch) -> typing.NoReturn:
+        # Look up the whole batch's Reddit accounts at once, rather than making requests for each user.
+        try:
+            reddit_profiles = await harmony_reddit.get_redditor_profiles_by_id(
+                {user.reddit_user.reddit_user_id: user.reddit_user.reddit_username for user in member_batch.users},
+                priority=harmony_reddit.Priority.BACKGROUND
+            )
+        except asyncprawcore.exceptions.TooManyRequests:
+            logger.warning(f"Still rate-limited by Reddit after retrying while processing a batch of "
+                           f"{len(member_batch.users)} users, ignoring them for now.")
+            return
+
+        for user in member_batch.users:
+            reddit_profile = reddit_profiles[user.reddit_user.reddit_user_id]
+
+            if reddit_profile.is_active and not reddit_profile.is_suspended and \
+                    not harmony_services.ban_index.is_banned(user.reddit_user.reddit_username):
+                continue
+
+            await self._enforcements.put(_Enforcement(
+                user,
+                member_batch.members[user.discord_user.discord_user_id],
+                reddit_profile
+            ))
+
+    async def _enforce(self, enforcement: _Enforcement) -> typing.NoReturn:
+        user = enforcement.user
+        member = enforcement.member
+        reddit_username = user.reddit_user.reddit_username
+
+        if not member:
+            logger.info(f"Redditor u/{reddit_username} is no longer in the Discord server, cleaning up data.")
+
+            if not self.dry_run:
+                await self.removal_batch.add(user, {
+                    "discord_member_name": None,
+                    "removal_reason": "No longer in the Discord server",
+                    "user_notified": False
+                })
+
+            return
+
+        removal_data = {
+            "reddit_username": reddit_username,
+            "discord_member_name": member.name,
+            "removal_reason": None,
+            "user_notified": True
+        }
+
+        reddit_profile = enforcement.reddit_profile
+
+        if not reddit_profile.is_active:
+            logger.info(f"Member {member.name}'s Reddit account no longer exists: u/{reddit_username}")
+            removal_data["removal_reason"] = "Reddit account no longer exists"
+
+            if not self.dry_run:
+                await member.remove_roles(
+                    verified_role,
+                    reason="User's Reddit account no longer exists."
+                )
+
+                try:
+                    await member.send(
+                        embed=harmony_ui.verify.create_nonexistent_reddit_account_embed(
+                            reddit_username,
+                            self.guild.name
+                        )
+                    )
+                except Exception:
+                    logger.warning(f"Failed to notify {member.name} "
+                                   f"that their Reddit account u/{reddit_username} doesn't exist.")
+                    removal_data["user_notified"] = False
+
+                await self.removal_batch.add(user, removal_data)
+
+            self.removed_users.append(removal_data)
+            return
+
+        if reddit_profile.is_suspended:
+            logger.info(f"Member {member.name}'s Reddit account is suspended: u/{reddit_username}")
+            removal_data["removal_reason"] = "Reddit account is suspended"
+
+            if not self.dry_run:
+                await member.remove_roles(
+                    verified_role,
+                    reason=f"User's Reddit account (u/{reddit_username}) is suspended."
+                )
+
+                try:
+                    await member.send(
+                        embed=harmony_ui.verify.create_suspended_reddit_account_embed(
+                            reddit_username,
+                            self.guild.name
+                        )
+                    )
+                except Exception:
+                    logger.warning(f"Failed to notify {member.name} "
+                                   f"that their Reddit account u/{reddit_username} is suspended.")
+                    removal_data["user_notified"] = False
+
+                await self.removal_batch.add(user, removal_data)
+
+            self.removed_users.append(removal_data)
+            return
+
+        if harmony_services.ban_index.is_banned(reddit_username):
+            logger.info(f"Member {member.name}'s Reddit account (u/{reddit_username}) "
+                        f"is banned from r/{subreddit_name}")
+            removal_data["removal_reason"] = f"Reddit account is banned from r/{subreddit_name}"
+
+            if not self.dry_run:
+                try:
+                    await member.send(
+                        embed=harmony_ui.verify.create_banned_reddit_account_embed(
+                            reddit_username,
+                            self.guild.name,
+                            subreddit_name
+                        )
+                    )
+                except Exception:
+                    logger.warning(f"Failed to notify {member.name} "
+                                   f"that their Reddit account u/{reddit_username} "
+                                   f"is banned from r/{subreddit_name}.")
+                    removal_data["user_notified"] = False
+
+                await member.ban(
+                    reason=f"Linked reddit account u/{reddit_username} is banned from r/{subreddit_name}"
+                )
+
+                await self.removal_batch.add(user, removal_data)
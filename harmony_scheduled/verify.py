@@ -1,19 +1,54 @@
 import discord
 import harmony_ui
 import harmony_ui.verify
-import prawcore.exceptions
 import harmony_services.usl
+import harmony_services.ban_index
 
 from loguru import logger
 from harmony_config import config
 from discord.ext import tasks, commands
 from harmony_services import db as harmony_db
-from harmony_services import reddit as harmony_reddit
+from harmony_scheduled.reddit_account_check import RedditAccountCheckPipeline
 
 
 subreddit_name = config.get_configuration_key("reddit.subreddit_name", required=True)
 verified_role_id = config.get_configuration_key("discord.verified_role_id", required=True, expected_type=int)
 verified_role = discord.Object(verified_role_id)
+guild_id = config.get_configuration_key("discord.guild_id", required=True, expected_type=int)
+
+
+async def get_cached_guild(bot: commands.Bot) -> discord.Guild:
+    """
+    Get the configured guild from the gateway cache, making sure its members have been cached.
+    :param bot: A reference to the bot instance used for Discord operations.
+    :return: The guild.
+    """
+    guild = bot.get_guild(guild_id)
+
+    if not guild:
+        raise Exception(f"Failed to get the guild with ID {guild_id}.")
+
+    # Members are usually cached at startup, but large guilds may not have been chunked yet.
+    if not guild.chunked:
+        logger.info(f"Caching the members of {guild.name}...")
+        await guild.chunk()
+
+    return guild
+
+
+async def get_text_channel(guild: discord.Guild, channel_id: int) -> discord.TextChannel:
+    """
+    Get a text channel in the guild, from the cache if possible.
+    :param guild: The guild the channel belongs to.
+    :param channel_id: The ID of the channel.
+    :return: The channel.
+    """
+    channel = guild.get_channel(channel_id) or await guild.fetch_channel(channel_id)
+
+    if not isinstance(channel, discord.TextChannel):
+        raise Exception(f"Reporting channel is not a TextChannel, ID: {channel_id}.")
+
+    return channel
 
 
 @tasks.loop(seconds=config.get_configuration_key(
@@ -38,7 +73,6 @@ async def check_reddit_accounts_task(bot: commands.Bot):
         return
 
     reporting_channel = None
-    removed_users = []
     dry_run: bool = config.get_configuration_key(
         "schedule.reddit_account_check_dry_run",
         required=True,
@@ -49,146 +83,35 @@ async def check_reddit_accounts_task(bot: commands.Bot):
         required=True,
         expected_type=int
     )
+    read_batch_size: int = config.get_configuration_key(
+        "schedule.reddit_account_check_read_batch_size",
+        expected_type=int,
+        or_else=100
+    )
+    removal_batch = harmony_db.VerifiedUserRemovalBatch(batch_size=config.get_configuration_key(
+        "schedule.reddit_account_check_write_batch_size",
+        expected_type=int,
+        or_else=500
+    ))
 
     try:
-        guild_id = config.get_configuration_key("discord.guild_id", required=True, expected_type=int)
-        guild = await bot.fetch_guild(guild_id)
-
-        if not guild:
-            raise Exception(f"Failed to fetch the guild with ID {guild_id}.")
-
-        reporting_channel_id = config.get_configuration_key(
+        guild = await get_cached_guild(bot)
+        reporting_channel = await get_text_channel(guild, config.get_configuration_key(
             "schedule.reddit_account_check_reporting_channel_id",
             required=True,
             expected_type=int
-        )
-
-        reporting_channel = await guild.fetch_channel(reporting_channel_id)
-
-        if not reporting_channel:
-            raise Exception(f"Failed to fetch the reporting channel with ID "
-                            f"{reporting_channel_id}.")
-
-        if not isinstance(reporting_channel, discord.TextChannel):
-            raise Exception(f"Reporting channel is not a TextChannel, ID: {reporting_channel_id}.")
+        ))
 
         logger.info("Running scheduled job to cleanup banned/missing Reddit users.")
 
-        users = harmony_db.get_all_verification_data()
-
-        logger.info(f"Fetching bans from r/{subreddit_name}, limit={bans_fetch_limit}")
-        subreddit_bans = [redditor.name for redditor in
-                          harmony_reddit.subreddit_bans(subreddit_name, limit=bans_fetch_limit)]
-
-        logger.info(f"Done - got {len(subreddit_bans)} bans.")
+        logger.info(f"Syncing the ban index for r/{subreddit_name}")
+        await harmony_services.ban_index.sync_ban_index(bans_fetch_limit)
 
-        for user in users:
-            reddit_username = user.reddit_user.reddit_username
-            try:
-                member = await guild.fetch_member(user.discord_user.discord_user_id)
-            except discord.errors.NotFound:
-                logger.info(f"Redditor u/{reddit_username} is no longer in the Discord server, cleaning up data.")
-
-                if not dry_run:
-                    user.delete()
-
-                continue
+        logger.info(f"Done - {harmony_services.ban_index.ban_count()} bans indexed.")
 
-            removal_data = {
-                "reddit_username": reddit_username,
-                "discord_member_name": member.name,
-                "removal_reason": None,
-                "user_notified": True
-            }
+        removed_users = await RedditAccountCheckPipeline(guild, removal_batch, read_batch_size, dry_run).run()
 
-            try:
-                reddit_user_exists = harmony_reddit.reddit_user_exists(reddit_username)
-                reddit_account_suspended = harmony_reddit.redditor_suspended(reddit_username)
-                reddit_account_sub_banned = reddit_username in subreddit_bans
-            except prawcore.exceptions.TooManyRequests:
-                logger.warning(f"Hit Reddit rate limit while processing member {member.name}, ignoring for now.")
-                continue
-
-            if not reddit_user_exists:
-                logger.info(f"Member {member.name}'s Reddit account no longer exists: u/{reddit_username}")
-                removal_data["removal_reason"] = "Reddit account no longer exists"
-
-                if not dry_run:
-                    await member.remove_roles(
-                        verified_role,
-                        reason="User's Reddit account no longer exists."
-                    )
-
-                    try:
-                        await member.send(
-                            embed=harmony_ui.verify.create_nonexistent_reddit_account_embed(
-                                reddit_username,
-                                guild.name
-                            )
-                        )
-                    except Exception:
-                        logger.warning(f"Failed to notify {member.name} "
-                                       f"that their Reddit account u/{reddit_username} doesn't exist.")
-                        removal_data["user_notified"] = False
-
-                    user.delete()
-
-                removed_users.append(removal_data)
-                continue
-
-            if reddit_account_suspended:
-                logger.info(f"Member {member.name}'s Reddit account is suspended: u/{reddit_username}")
-                removal_data["removal_reason"] = "Reddit account is suspended"
-
-                if not dry_run:
-                    await member.remove_roles(
-                        verified_role,
-                        reason=f"User's Reddit account (u/{reddit_username}) is suspended."
-                    )
-
-                    try:
-                        await member.send(
-                            embed=harmony_ui.verify.create_suspended_reddit_account_embed(
-                                reddit_username,
-                                guild.name
-                            )
-                        )
-                    except Exception:
-                        logger.warning(f"Failed to notify {member.name} "
-                                       f"that their Reddit account u/{reddit_username} is suspended.")
-                        removal_data["user_notified"] = False
-
-                    user.delete()
-
-                removed_users.append(removal_data)
-                continue
-
-            if reddit_account_sub_banned:
-                logger.info(f"Member {member.name}'s Reddit account (u/{reddit_username}) "
-                            f"is banned from r/{subreddit_name}")
-                removal_data["removal_reason"] = f"Reddit account is banned from r/{subreddit_name}"
-
-                if not dry_run:
-                    try:
-                        await member.send(
-                            embed=harmony_ui.verify.create_banned_reddit_account_embed(
-                                reddit_username,
-                                guild.name,
-                                subreddit_name
-                            )
-                        )
-                    except Exception:
-                        logger.warning(f"Failed to notify {member.name} "
-                                       f"that their Reddit account u/{reddit_username} "
-                                       f"is banned from r/{subreddit_name}.")
-                        removal_data["user_notified"] = False
-
-                    await member.ban(
-                        reason=f"Linked reddit account u/{reddit_username} is banned from r/{subreddit_name}"
-                    )
-
-                    user.delete()
-                continue
+        await removal_batch.flush()
 
         report_message = f"All verified Reddit users checked. "
 
@@ -215,6 +138,9 @@ async def check_reddit_accounts_task(bot: commands.Bot):
     except Exception as e:
         logger.error(f"Something went wrong while running the Reddit accounts ban check job.")
 
+        # Make sure any removals that have already been actioned in Discord are written to the database.
+        await removal_batch.flush()
+
         if reporting_channel and isinstance(reporting_channel, discord.TextChannel):
             await reporting_channel.send(content="## Something went wrong when checking Reddit users!\n\n"
                                                  "Please check the bot logs for more details.")
@@ -222,6 +148,39 @@ async def check_reddit_accounts_task(bot: commands.Bot):
         raise e
 
 
+@tasks.loop(seconds=harmony_services.ban_index.sync_interval_seconds)
+async def sync_ban_index_task():
+    """
+    Keep the subreddit ban index up to date, so that verifications are screened against recent bans whether or not
+    the Reddit account check job is enabled.
+    :return: Nothing.
+    """
+    enabled = config.get_configuration_key(
+        "schedule.ban_index_sync_enabled",
+        expected_type=bool,
+        or_else=True
+    )
+
+    if not enabled:
+        logger.info("Scheduled ban index sync is disabled.")
+        return
+
+    bans_fetch_limit: int = config.get_configuration_key(
+        "schedule.reddit_account_check_ban_fetch_limit",
+        expected_type=int,
+        or_else=10000
+    )
+
+    # A failed sync is retried on the next run, so it mustn't stop the loop.
+    try:
+        logger.info(f"Running scheduled job to sync the ban index for r/{subreddit_name}")
+        await harmony_services.ban_index.sync_ban_index(bans_fetch_limit)
+        logger.info(f"Done - {harmony_services.ban_index.ban_count()} bans indexed.")
+    except Exception as e:
+        logger.error(f"Something went wrong while syncing the ban index for r/{subreddit_name}: "
+                     f"{type(e).__name__}: {str(e)}")
+
+
 @tasks.loop(seconds=config.get_configuration_key(
     "schedule.discord_role_check_interval_seconds",
     required=True,
@@ -254,25 +213,12 @@ async def check_discord_roles_task(bot: commands.Bot):
     )
 
     try:
-        guild_id = config.get_configuration_key("discord.guild_id", required=True, expected_type=int)
-        guild = await bot.fetch_guild(guild_id)
-
-        if not guild:
-            raise Exception(f"Failed to fetch the guild with ID {guild_id}.")
-
-        reporting_channel_id = config.get_configuration_key(
+        guild = await get_cached_guild(bot)
+        reporting_channel = await get_text_channel(guild, config.get_configuration_key(
             "schedule.discord_role_check_reporting_channel_id",
             required=True,
             expected_type=int
-        )
-
-        reporting_channel = await guild.fetch_channel(reporting_channel_id)
-
-        if not reporting_channel:
-            raise Exception(f"Failed to fetch the reporting channel with ID {reporting_channel_id}.")
-
-        if not isinstance(reporting_channel, discord.TextChannel):
-            raise Exception(f"Reporting channel is not a TextChannel, ID: {reporting_channel_id}.")
+        ))
 
         logger.info("Running scheduled job to cleanup Discord users without verification data.")
 
@@ -282,7 +228,7 @@ async def check_discord_roles_task(bot: commands.Bot):
             raise Exception(f"Configured verified role with ID {verified_role_id} could not be found.")
 
         for member in verified_guild_role.members:
-            if not harmony_db.has_verification_data(member.id):
+            if not await harmony_db.has_verification_data(member.id, read_preference=harmony_db.scan_read_preference):
                 removal_data = {
                     "discord_member_name": member.name,
                     "removal_reason": "No linked Reddit account found.",
@@ -339,7 +285,12 @@ async def check_discord_roles_task(bot: commands.Bot):
     required=True,
     expected_type=int
 ))
-async def update_usl_task():
+async def update_usl_task(bot: commands.Bot):
+    """
+    Refresh the Universal Scammer List, then report any verified users who have been added to it.
+    :param bot: A reference to the bot instance used for Discord operations.
+    :return: Nothing.
+    """
     enabled = config.get_configuration_key(
         "schedule.usl_update_enabled",
         required=True,
@@ -351,4 +302,59 @@ async def update_usl_task():
         return
 
     logger.info("Running scheduled job to update the Universal Scammer List.")
-    await harmony_services.usl.update_usl()
+
+    # A failed refresh is retried on the next run, so it mustn't stop the loop.
+    try:
+        usl_diff = await harmony_services.usl.update_usl()
+    except Exception as e:
+        logger.error(f"Something went wrong while refreshing the USL, keeping the previous list: "
+                     f"{type(e).__name__}: {str(e)}")
+        return
+
+    reporting_channel_id = config.get_configuration_key("usl.sweep_reporting_channel_id", expected_type=int)
+
+    if not reporting_channel_id:
+        return
+
+    reporting_channel = None
+
+    # A failed sweep is reported, but mustn't stop the loop, or the USL would never be refreshed again.
+    try:
+        matches = await harmony_services.usl.sweep_verified_users(usl_diff)
+
+        if not matches:
+            return
+
+        reporting_channel = bot.get_channel(reporting_channel_id) or await bot.fetch_channel(reporting_channel_id)
+
+        if not isinstance(reporting_channel, discord.TextChannel):
+            reporting_channel = None
+            raise Exception(f"USL sweep reporting channel is not a TextChannel, ID: {reporting_channel_id}.")
+
+        report_lines = [f"## {len(matches)} verified users have been added to the Universal Scammer List\n"]
+
+        for match in matches:
+            report_lines.append(f"- **u/{match.reddit_username}** / <@{match.discord_user_id}>: "
+                                f"{' '.join(match.tags)}")
+
+        # Discord limits messages to 2000 characters, so long reports are split over several messages.
+        report_message = ""
+
+        for report_line in report_lines:
+            if len(report_message) + len(report_line) + 1 > 2000:
+                await reporting_channel.send(content=report_message, allowed_mentions=discord.AllowedMentions.none())
+                report_message = ""
+
+            report_message += report_line + "\n"
+
+        await reporting_channel.send(content=report_message, allowed_mentions=discord.AllowedMentions.none())
+    except Exception as e:
+        logger.error(f"Something went wrong while sweeping verified users against the USL: "
+                     f"{type(e).__name__}: {str(e)}")
+
+        if reporting_channel:
+            try:
+                await reporting_channel.send(content="## Something went wrong when sweeping verified users against "
+                                                     "the USL!\n\nPlease check the bot logs for more details.")
+            except Exception:
+                logger.warning("Failed to report the USL sweep failure to the reporting channel.")
@@ -0,0 +1,222 @@
+import typing
+import asyncio
+import datetime
+import harmony_models.subreddit_ban as subreddit_ban_models
+
+from loguru import logger
+from harmony_config import config
+from harmony_services import db as harmony_db
+from harmony_services import reddit as harmony_reddit
+
+subreddit_name = config.get_configuration_key("reddit.subreddit_name", required=True)
+full_resync_interval_seconds = config.get_configuration_key(
+    "reddit.ban_index_full_resync_interval_seconds",
+    expected_type=int,
+    or_else=604800
+)
+mod_log_fetch_limit = config.get_configuration_key(
+    "reddit.ban_index_mod_log_fetch_limit",
+    expected_type=int,
+    or_else=500
+)
+sync_interval_seconds = config.get_configuration_key(
+    "schedule.ban_index_sync_interval_seconds",
+    expected_type=int,
+    or_else=3600
+)
+
+# The lowercased usernames of every Redditor banned from the subreddit.
+_banned_usernames: typing.Set[str] = set()
+_is_loaded = False
+_last_sync_at: typing.Optional[datetime.datetime] = None
+_load_lock = asyncio.Lock()
+_sync_lock = asyncio.Lock()
+
+
+def is_banned(reddit_username: str) -> bool:
+    """
+    Check if a Redditor is banned from the subreddit, according to the last synchronisation of the ban index.
+    :param reddit_username: The Redditor's username, not beginning with u/.
+    :return: True if the Redditor is banned, otherwise False.
+    """
+    return reddit_username.lower() in _banned_usernames
+
+
+def is_stale() -> bool:
+    """
+    Check if the ban index has fallen behind the subreddit, i.e. it has never been synced, or it hasn't been synced
+    for more than twice the sync interval (allowing for a sync which is due, or in progress).
+    :return: True if the ban index is stale, otherwise False.
+    """
+    if not _last_sync_at:
+        return True
+
+    return (datetime.datetime.utcnow() - _last_sync_at).total_seconds() > sync_interval_seconds * 2
+
+
+def last_synced_at() -> typing.Optional[datetime.datetime]:
+    """
+    Get when the ban index was last synced with the subreddit.
+    :return: The time of the last sync in UTC, or None if it has never been synced.
+    """
+    return _last_sync_at
+
+
+def ban_count() -> int:
+    """
+    Get the number of bans in the ban index.
+    :return: The number of banned Redditors.
+    """
+    return len(_banned_usernames)
+
+
+async def load_ban_index() -> typing.NoReturn:
+    """
+    Load the persisted ban index into memory.
+    :return: Nothing.
+    """
+    global _banned_usernames, _is_loaded, _last_sync_at
+
+    _banned_usernames = set(await harmony_db.get_subreddit_banned_usernames(subreddit_name))
+    sync_state = await harmony_db.get_subreddit_ban_sync_state(subreddit_name)
+    _last_sync_at = sync_state.last_sync_at if sync_state else None
+    _is_loaded = True
+
+    logger.info(f"Loaded {len(_banned_usernames)} bans from the r/{subreddit_name} ban index.")
+
+
+async def ensure_ban_index_loaded() -> typing.NoReturn:
+    """
+    Load the persisted ban index into memory, if it hasn't been loaded yet.
+    :return: Nothing.
+    """
+    async with _load_lock:
+        if not _is_loaded:
+            await load_ban_index()
+
+
+async def sync_ban_index(
+        ban_fetch_limit: int,
+        priority: harmony_reddit.Priority = harmony_reddit.Priority.BACKGROUND
+) -> typing.NoReturn:
+    """
+    Bring the ban index up to date with the subreddit.
+    Changes are read from the moderation log since the last sync, falling back to fetching the full ban list on the
+    first sync, when the log doesn't reach back far enough, or when the last full sync is too old (temporary bans
+    expire without leaving anything in the log).
+    :param ban_fetch_limit: The maximum number of bans to fetch when fetching the full ban list.
+    :param priority: The priority of the requests to Reddit.
+    :return: Nothing.
+    """
+    global _last_sync_at
+
+    async with _sync_lock:
+        await ensure_ban_index_loaded()
+
+        sync_state = await harmony_db.get_subreddit_ban_sync_state(subreddit_name) or \
+            subreddit_ban_models.SubredditBanSyncState(subreddit_name=subreddit_name)
+        now = datetime.datetime.utcnow()
+
+        needs_full_sync = not sync_state.last_full_sync_at or \
+            (now - sync_state.last_full_sync_at).total_seconds() >= full_resync_interval_seconds
+
+        if not needs_full_sync:
+            needs_full_sync = not await _sync_from_mod_log(sync_state, priority)
+
+        if needs_full_sync:
+            await _sync_full_ban_list(sync_state, ban_fetch_limit, priority)
+            sync_state.last_full_sync_at = now
+
+        sync_state.last_sync_at = now
+        await harmony_db.save_document(sync_state)
+        _last_sync_at = now
+
+
+async def _sync_from_mod_log(
+        sync_state: subreddit_ban_models.SubredditBanSyncState,
+        priority: harmony_reddit.Priority
+) -> bool:
+    ban_actions, has_all_bans = await harmony_reddit.subreddit_mod_actions_since(
+        subreddit_name, "banuser", sync_state.last_ban_action_id, mod_log_fetch_limit, priority
+    )
+    unban_actions, has_all_unbans = await harmony_reddit.subreddit_mod_actions_since(
+        subreddit_name, "unbanuser", sync_state.last_unban_action_id, mod_log_fetch_limit, priority
+    )
+
+    if not has_all_bans or not has_all_unbans:
+        logger.info(f"The r/{subreddit_name} moderation log has more changes than can be fetched incrementally, "
+                    f"falling back to a full sync of the ban index.")
+        return False
+
+    # Replay the changes oldest first, so that only the latest action for each Redditor counts.
+    bans = {}
+    unbanned_usernames = {}
+
+    for mod_action in sorted(ban_actions + unban_actions, key=lambda mod_action: mod_action.created_utc):
+        reddit_username = mod_action.target_author
+        reddit_username_lower = reddit_username.lower()
+
+        if mod_action.action == "banuser":
+            unbanned_usernames.pop(reddit_username_lower, None)
+            bans[reddit_username_lower] = (
+                reddit_username,
+                datetime.datetime.utcfromtimestamp(mod_action.created_utc)
+            )
+        else:
+            bans.pop(reddit_username_lower, None)
+            unbanned_usernames[reddit_username_lower] = reddit_username
+
+    await harmony_db.apply_subreddit_ban_changes(
+        subreddit_name,
+        {reddit_username: banned_at for reddit_username, banned_at in bans.values()},
+        unbanned_usernames.values()
+    )
+
+    _banned_usernames.difference_update(unbanned_usernames)
+    _banned_usernames.update(bans)
+
+    # Log entries are returned newest first.
+    if ban_actions:
+        sync_state.last_ban_action_id = ban_actions[0].id
+
+    if unban_actions:
+        sync_state.last_unban_action_id = unban_actions[0].id
+
+    logger.info(f"Synced the r/{subreddit_name} ban index from the moderation log: "
+                f"{len(bans)} bans, {len(unbanned_usernames)} unbans.")
+
+    return True
+
+
+async def _sync_full_ban_list(
+        sync_state: subreddit_ban_models.SubredditBanSyncState,
+        ban_fetch_limit: int,
+        priority: harmony_reddit.Priority
+) -> typing.NoReturn:
+    global _banned_usernames
+
+    # Mark our place in the moderation log before fetching the ban list, so that the next incremental sync picks up
+    # anything that changes while the list is being fetched.
+    ban_actions, _ = await harmony_reddit.subreddit_mod_actions_since(
+        subreddit_name, "banuser", None, 1, priority
+    )
+    unban_actions, _ = await harmony_reddit.subreddit_mod_actions_since(
+        subreddit_name, "unbanuser", None, 1, priority
+    )
+
+    logger.info(f"Fetching bans from r/{subreddit_name}, limit={ban_fetch_limit}")
+    banned_redditors = await harmony_reddit.subreddit_bans(subreddit_name, limit=ban_fetch_limit, priority=priority)
+
+    bans = {
+        banned_redditor.name: datetime.datetime.utcfromtimestamp(banned_redditor.date)
+        if getattr(banned_redditor, "date", None) else None
+        for banned_redditor in banned_redditors
+    }
+
+    await harmony_db.replace_subreddit_bans(subreddit_name, bans)
+    _banned_usernames = {reddit_username.lower() for reddit_username in bans}
+
+    sync_state.last_ban_action_id = ban_actions[0].id if ban_actions else None
+    sync_state.last_unban_action_id = unban_actions[0].id if unban_actions else None
+
+    logger.info(f"Synced the full r/{subreddit_name} ban list into the ban index: {len(bans)} bans.")
@@ -1,11 +1,25 @@
+import time
+import munch
 import typing
+import asyncio
+import datetime
+import functools
+import pymongo
 import mongoengine
+import pymongo.errors
+import concurrent.futures
+import pymongo.read_preferences
+import harmony_services.db_instrumentation as db_instrumentation
 import harmony_models.verify as verify_models
 import harmony_models.feedback as feedback_models
 import harmony_models.message_rate_limiter as message_rate_limiter_models
+import harmony_models.subreddit_ban as subreddit_ban_models
+import harmony_models.outbox as outbox_models
+import harmony_models.usl as usl_models
 
 from loguru import logger
 from harmony_config import config
+from harmony_services.verified_user_cache import VerifiedUserCache
 
 db_name = config.get_configuration_key("db.db_name", required=True)
 db_host = config.get_configuration_key("db.hostname", required=True)
@@ -13,6 +27,37 @@ db_port = config.get_configuration_key("db.port", required=True, expected_type=i
 db_username = config.get_configuration_key("db.username")
 db_password = config.get_configuration_key("db.password")
 db_replica_set = config.get_configuration_key("db.replica_set_name")
+db_executor_max_workers = config.get_configuration_key("db.executor_max_workers", expected_type=int, or_else=8)
+db_max_pool_size = config.get_configuration_key("db.max_pool_size", expected_type=int)
+db_min_pool_size = config.get_configuration_key("db.min_pool_size", expected_type=int)
+db_max_idle_time_ms = config.get_configuration_key("db.max_idle_time_ms", expected_type=int)
+db_wait_queue_timeout_ms = config.get_configuration_key("db.wait_queue_timeout_ms", expected_type=int)
+db_connect_timeout_ms = config.get_configuration_key("db.connect_timeout_ms", expected_type=int)
+db_server_selection_timeout_ms = config.get_configuration_key("db.server_selection_timeout_ms", expected_type=int)
+db_socket_timeout_ms = config.get_configuration_key("db.socket_timeout_ms", expected_type=int)
+db_compressors = config.get_configuration_key("db.compressors", expected_type=list)
+db_lookup_read_preference = config.get_configuration_key("db.lookup_read_preference", or_else="primary")
+db_scan_read_preference = config.get_configuration_key("db.scan_read_preference", or_else="primary")
+db_slow_operation_threshold_ms = config.get_configuration_key(
+    "db.slow_operation_threshold_ms",
+    expected_type=int,
+    or_else=250
+)
+db_verified_user_cache_enabled = config.get_configuration_key(
+    "db.verified_user_cache_enabled",
+    expected_type=bool,
+    or_else=True
+)
+db_verified_user_cache_max_size = config.get_configuration_key(
+    "db.verified_user_cache_max_size",
+    expected_type=int,
+    or_else=10000
+)
+pending_verification_expiry_seconds = config.get_configuration_key(
+    "verify.pending_verification_expiry_seconds",
+    expected_type=int,
+    or_else=86400
+)
 
 _mongodb_connection_string_credentials = f"{db_username}:{db_password}@" if db_username and db_password else ""
 
@@ -21,105 +66,968 @@ _mongodb_connection_string = f"mongodb://{_mongodb_connection_string_credentials
 if db_replica_set:
     _mongodb_connection_string += f"?replicaSet={db_replica_set}"
 
+# Only pass through the pool options that have been configured, so that pymongo's defaults apply otherwise.
+_mongodb_client_options = {
+    option_name: option_value
+    for option_name, option_value in {
+        "maxPoolSize": db_max_pool_size,
+        "minPoolSize": db_min_pool_size,
+        "maxIdleTimeMS": db_max_idle_time_ms,
+        "waitQueueTimeoutMS": db_wait_queue_timeout_ms,
+        "connectTimeoutMS": db_connect_timeout_ms,
+        "serverSelectionTimeoutMS": db_server_selection_timeout_ms,
+        "socketTimeoutMS": db_socket_timeout_ms,
+        "compressors": ",".join(db_compressors) if db_compressors else None
+    }.items()
+    if option_value is not None
+}
+
 connection = mongoengine.connect(
-    host=_mongodb_connection_string
+    host=_mongodb_connection_string,
+    event_listeners=[db_instrumentation.CommandLatencyListener(), db_instrumentation.PoolWaitListener()],
+    **_mongodb_client_options
+)
+
+# Reads which don't feed into a write can be routed away from the primary, if configured.
+# Lookups are interactive reads such as /whois, and scans are the bulk reads made by scheduled jobs.
+lookup_read_preference = pymongo.read_preferences.make_read_preference(
+    pymongo.read_preferences.read_pref_mode_from_name(db_lookup_read_preference),
+    None
+)
+scan_read_preference = pymongo.read_preferences.make_read_preference(
+    pymongo.read_preferences.read_pref_mode_from_name(db_scan_read_preference),
+    None
 )
 
+# mongoengine and pymongo are blocking, so all database work is handed off to a dedicated pool of threads.
+# This keeps the Discord gateway event loop free while a query is in flight.
+_db_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=db_executor_max_workers,
+    thread_name_prefix="harmony-db"
+)
+
+# Change streams are only available on replica sets, so the cache can't be kept coherent without one.
+verified_user_cache: typing.Optional[VerifiedUserCache] = None
+
+if db_verified_user_cache_enabled and db_replica_set:
+    verified_user_cache = VerifiedUserCache(max_size=db_verified_user_cache_max_size)
+    verified_user_cache.start_watching()
+elif db_verified_user_cache_enabled:
+    logger.warning("The verified user cache requires a replica set, so it has been disabled.")
+
+T = typing.TypeVar("T")
+
+
+def _run_in_executor(func: typing.Callable[..., T]) -> typing.Callable[..., typing.Awaitable[T]]:
+    """
+    Decorator which turns a blocking database function into a coroutine function that runs on the database executor.
+    :param func: The blocking function to wrap.
+    :return: A coroutine function with the same signature as the wrapped function.
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            _db_executor,
+            functools.partial(_run_instrumented, func, time.perf_counter(), *args, **kwargs)
+        )
+
+    return wrapper
+
+
+def _run_instrumented(func: typing.Callable[..., T], submitted_at: float, *args, **kwargs) -> T:
+    started_at = time.perf_counter()
+    stats = db_instrumentation.begin_operation()
+
+    try:
+        return func(*args, **kwargs)
+    finally:
+        finished_at = time.perf_counter()
+        db_instrumentation.end_operation()
+
+        total_ms = (finished_at - submitted_at) * 1000
+        message = (f"db.{func.__name__} took {total_ms:.1f}ms "
+                   f"(executor wait {(started_at - submitted_at) * 1000:.1f}ms, "
+                   f"pool wait {stats.pool_wait_micros / 1000:.1f}ms, "
+                   f"{stats.command_count} commands in {stats.command_micros / 1000:.1f}ms)")
+
+        if total_ms >= db_slow_operation_threshold_ms:
+            logger.warning(f"Slow database operation: {message}")
+        else:
+            logger.debug(message)
+
+
+@_run_in_executor
+def save_document(document: mongoengine.Document) -> mongoengine.Document:
+    """
+    Save a document to the database.
+    :param document: The document to save.
+    :return: The saved document.
+    """
+    document = document.save()
+    _invalidate_cached_verification_data(document)
+
+    return document
+
+
+@_run_in_executor
+def delete_document(document: mongoengine.Document) -> typing.NoReturn:
+    """
+    Delete a document from the database.
+    :param document: The document to delete.
+    :return: Nothing.
+    """
+    document.delete()
+    _invalidate_cached_verification_data(document)
+
+
+def _invalidate_cached_verification_data(document: mongoengine.Document) -> typing.NoReturn:
+    # The change stream will catch up with our own writes, but there's no reason to serve them stale until it does.
+    if verified_user_cache and isinstance(document, verify_models.VerifiedUser):
+        verified_user_cache.invalidate(document.id)
 
+
+@_run_in_executor
 def get_pending_verification(discord_user_id: int) -> typing.Optional[verify_models.PendingVerification]:
     """
     Fetch a pending verification from the database.
     :param discord_user_id: The Discord user to fetch the pending verification for.
     :return: The pending verification, if found, otherwise None.
     """
-    return verify_models.PendingVerification.objects(discord_user__discord_user_id=discord_user_id).first()
+    return _get_pending_verification(discord_user_id)
+
+
+def _get_pending_verification(discord_user_id: int) -> typing.Optional[verify_models.PendingVerification]:
+    # Expired documents are purged by a TTL index, but the TTL monitor only runs once a minute.
+    return verify_models.PendingVerification.objects(
+        discord_user__discord_user_id=discord_user_id,
+        pending_verification_data__expires_at__gt=datetime.datetime.utcnow()
+    ).first()
 
 
+@_run_in_executor
 def has_pending_verification(discord_user_id: int) -> bool:
     """
     Check if a Discord user has a pending verification.
     :param discord_user_id: The user ID to check.
     :return: True if the user has a pending verification, otherwise False.
     """
-    return get_pending_verification(discord_user_id) is not None
+    return verify_models.PendingVerification._get_collection().find_one(
+        {
+            "discord_user.discord_user_id": discord_user_id,
+            "pending_verification_data.expires_at": {"$gt": datetime.datetime.utcnow()}
+        },
+        projection={"_id": 1}
+    ) is not None
+
+
+@_run_in_executor
+def is_pending_verification_held(discord_user_id: int) -> bool:
+    """
+    Check if a Discord user's pending verification is being held for moderator review.
+    :param discord_user_id: The user ID to check.
+    :return: True if the user has a pending verification which is being held, otherwise False.
+    """
+    return verify_models.PendingVerification._get_collection().find_one(
+        {
+            "discord_user.discord_user_id": discord_user_id,
+            "pending_verification_data.expires_at": {"$gt": datetime.datetime.utcnow()},
+            "screening_data.is_held": True
+        },
+        projection={"_id": 1}
+    ) is not None
+
+
+@_run_in_executor
+def release_held_pending_verification(review_message_id: int) -> typing.Optional[verify_models.PendingVerification]:
+    """
+    Release a pending verification which is being held for moderator review, restarting its expiry.
+    :param review_message_id: The ID of the Discord message the verification is being reviewed in.
+    :return: The released pending verification, or None if it's no longer being held (e.g. it's already been
+    reviewed, or it has expired).
+    """
+    now = datetime.datetime.utcnow()
+
+    return verify_models.PendingVerification.objects(
+        screening_data__review_message_id=review_message_id,
+        screening_data__is_held=True,
+        pending_verification_data__expires_at__gt=now
+    ).modify(
+        new=True,
+        set__screening_data__is_held=False,
+        set__pending_verification_data__expires_at=now + datetime.timedelta(seconds=pending_verification_expiry_seconds)
+    )
+
+
+@_run_in_executor
+def delete_held_pending_verification(review_message_id: int) -> typing.Optional[verify_models.PendingVerification]:
+    """
+    Delete a pending verification which is being held for moderator review.
+    :param review_message_id: The ID of the Discord message the verification is being reviewed in.
+    :return: The deleted pending verification, or None if it's no longer being held.
+    """
+    return verify_models.PendingVerification.objects(
+        screening_data__review_message_id=review_message_id,
+        screening_data__is_held=True,
+        pending_verification_data__expires_at__gt=datetime.datetime.utcnow()
+    ).modify(remove=True)
 
 
+@_run_in_executor
+def set_pending_verification_review_message(
+        pending_verification: verify_models.PendingVerification,
+        review_message_id: int
+) -> bool:
+    """
+    Attach the Discord message a held pending verification is being reviewed in to it.
+    :param pending_verification: The saved pending verification which is being held.
+    :param review_message_id: The ID of the Discord message the verification is being reviewed in.
+    :return: True if the message was attached, or False if the pending verification no longer exists (e.g. it was
+    replaced by the user starting another verification).
+    """
+    updated_count = verify_models.PendingVerification.objects(
+        id=pending_verification.id,
+        screening_data__is_held=True
+    ).update(set__screening_data__review_message_id=review_message_id)
+
+    pending_verification.screening_data.review_message_id = review_message_id
+
+    return updated_count > 0
+
+
+@_run_in_executor
+def save_pending_verification(pending_verification: verify_models.PendingVerification) \
+        -> verify_models.PendingVerification:
+    """
+    Save a new pending verification, which will expire after the configured number of seconds.
+    Any previous pending verification for the same Discord user is replaced.
+    :param pending_verification: The pending verification to save.
+    :return: The saved pending verification.
+    """
+    pending_verification.pending_verification_data.expires_at = (
+            datetime.datetime.utcnow() + datetime.timedelta(seconds=pending_verification_expiry_seconds)
+    )
+
+    # An expired pending verification may not have been purged yet, and would otherwise violate the unique index.
+    verify_models.PendingVerification.objects(
+        discord_user__discord_user_id=pending_verification.discord_user.discord_user_id
+    ).delete()
+
+    return pending_verification.save()
+
+
+@_run_in_executor
+def complete_pending_verification(pending_verification: verify_models.PendingVerification) \
+        -> verify_models.VerifiedUser:
+    """
+    Convert a pending verification into verification data, removing the pending verification.
+    :param pending_verification: The pending verification to complete.
+    :return: The newly saved verification data.
+    """
+    verified_user_data = verify_models.VerifiedUser(
+        discord_user=pending_verification.discord_user,
+        reddit_user=pending_verification.reddit_user,
+        user_verification_data=verify_models.UserVerificationData(
+            requested_verification_at=pending_verification.pending_verification_data.requested_verification_at
+        )
+    )
+
+    verified_user_data.save()
+    pending_verification.delete()
+
+    return verified_user_data
+
+
+# Any of pymongo's read preferences, e.g. pymongo.ReadPreference.SECONDARY_PREFERRED.
+ReadPreference = typing.Union[
+    pymongo.read_preferences.Primary,
+    pymongo.read_preferences.PrimaryPreferred,
+    pymongo.read_preferences.Secondary,
+    pymongo.read_preferences.SecondaryPreferred,
+    pymongo.read_preferences.Nearest
+]
+
+
+def _get_verification_data(discord_user_id: int = None,
+                           reddit_username: str = None,
+                           read_preference: ReadPreference = None) -> typing.Optional[verify_models.VerifiedUser]:
+    if not discord_user_id and not reddit_username:
+        return None
+
+    if verified_user_cache:
+        cached_verification_data = verified_user_cache.get(
+            discord_user_id=discord_user_id,
+            reddit_username=reddit_username
+        )
+
+        if cached_verification_data:
+            return cached_verification_data
+
+        cache_generation = verified_user_cache.generation
+
+    if discord_user_id:
+        queryset = verify_models.VerifiedUser.objects(discord_user__discord_user_id=discord_user_id)
+    else:
+        queryset = verify_models.VerifiedUser.objects(reddit_user__reddit_username_lower=reddit_username.lower())
+
+    if read_preference:
+        queryset = queryset.read_preference(read_preference)
+
+    verification_data = queryset.first()
+
+    # A secondary may lag behind the change stream, so only cache what was read from the primary.
+    is_primary_read = not read_preference or read_preference == pymongo.ReadPreference.PRIMARY
+
+    if verified_user_cache and verification_data and is_primary_read:
+        verified_user_cache.put(verification_data, cache_generation)
+
+    return verification_data
+
+
+@_run_in_executor
 def get_verification_data(discord_user_id: int = None,
-                          reddit_username: str = None) -> typing.Optional[verify_models.VerifiedUser]:
+                          reddit_username: str = None,
+                          read_preference: ReadPreference = None) -> typing.Optional[verify_models.VerifiedUser]:
     """
     Fetch a Discord user's verification data from the database.
     :param discord_user_id: The Discord user ID to fetch the verification for.
     :param reddit_username: The Reddit username to fetch the verification for.
+    :param read_preference: The read preference to use, e.g. lookup_read_preference. Defaults to the primary,
+                            which should be used whenever the verification data might be modified and saved.
     :return: The verification data, if found, otherwise None.
     """
-    if discord_user_id:
-        return verify_models.VerifiedUser.objects(discord_user__discord_user_id=discord_user_id).first()
-    if reddit_username:
-        return verify_models.VerifiedUser.objects(reddit_user__reddit_username__iexact=reddit_username).first()
+    return _get_verification_data(
+        discord_user_id=discord_user_id,
+        reddit_username=reddit_username,
+        read_preference=read_preference
+    )
 
-    return None
 
-
-def get_all_verification_data() -> typing.List[verify_models.VerifiedUser]:
+@_run_in_executor
+def get_all_verification_data(*fields: str, read_preference: ReadPreference = None) -> typing.List[munch.Munch]:
     """
-    Fetch all verified users.
+    Fetch all verified users as raw documents, skipping the cost of constructing mongoengine documents.
+    :param fields: The fields to fetch, using mongoengine's double-underscore notation. If none are specified,
+                   all fields are fetched. The document ID is always included, as _id.
+    :param read_preference: The read preference to use, e.g. scan_read_preference. Defaults to the primary.
     :return: A list of all verified users.
     """
-    return verify_models.VerifiedUser.objects()
+    queryset = verify_models.VerifiedUser.objects()
+
+    if read_preference:
+        queryset = queryset.read_preference(read_preference)
 
+    if fields:
+        queryset = queryset.only(*fields)
 
-def has_verification_data(discord_user_id: int) -> bool:
+    return [munch.munchify(verified_user) for verified_user in queryset.as_pymongo()]
+
+
+@_run_in_executor
+def get_verified_reddit_usernames(read_preference: ReadPreference = None) -> typing.Dict[str, typing.Tuple[str, int]]:
+    """
+    Fetch the Reddit username and Discord user ID of every verified user, using a single projected query.
+    :param read_preference: The read preference to use, e.g. scan_read_preference. Defaults to the primary.
+    :return: The (Reddit username, Discord user ID) of each verified user, keyed by lowercased Reddit username.
+    """
+    queryset = verify_models.VerifiedUser.objects().only(
+        "reddit_user__reddit_username",
+        "discord_user__discord_user_id"
+    )
+
+    if read_preference:
+        queryset = queryset.read_preference(read_preference)
+
+    verified_usernames = {}
+
+    for verified_user in queryset.as_pymongo():
+        reddit_username = verified_user["reddit_user"]["reddit_username"]
+        discord_user_id = verified_user["discord_user"]["discord_user_id"]
+        verified_usernames[reddit_username.lower()] = (reddit_username, discord_user_id)
+
+    return verified_usernames
+
+
+@_run_in_executor
+def _get_verification_data_page(
+        after_id: typing.Any,
+        page_size: int,
+        fields: typing.Tuple[str, ...],
+        read_preference: ReadPreference
+) -> typing.List[munch.Munch]:
+    queryset = verify_models.VerifiedUser.objects(id__gt=after_id) if after_id else verify_models.VerifiedUser.objects()
+    queryset = queryset.order_by("id").limit(page_size)
+
+    if read_preference:
+        queryset = queryset.read_preference(read_preference)
+
+    if fields:
+        queryset = queryset.only(*fields)
+
+    return [munch.munchify(verified_user) for verified_user in queryset.as_pymongo()]
+
+
+async def iter_verification_data_batches(
+        *fields: str,
+        batch_size: int = 100,
+        max_retries: int = 5,
+        read_preference: ReadPreference = None
+) -> typing.AsyncIterator[typing.List[munch.Munch]]:
+    """
+    Stream all verified users as raw documents, in fixed-size batches ordered by document ID.
+    Each batch is fetched with its own short query that resumes from the last ID seen, so no cursor is held open
+    while the caller works through a batch, and a lost connection only costs a retry of the current batch.
+    :param fields: The fields to fetch, as with get_all_verification_data.
+    :param batch_size: The number of verified users in each batch.
+    :param max_retries: The number of times to retry fetching a batch before giving up.
+    :param read_preference: The read preference to use, e.g. scan_read_preference. Defaults to the primary.
+    :return: An async iterator of batches of verified users.
+    """
+    last_id = None
+
+    while True:
+        for attempt in range(max_retries + 1):
+            try:
+                batch = await _get_verification_data_page(last_id, batch_size, fields, read_preference)
+                break
+            except (pymongo.errors.AutoReconnect, pymongo.errors.CursorNotFound) as e:
+                if attempt == max_retries:
+                    raise
+
+                logger.warning(f"Lost the database connection while streaming verified users after ID {last_id}, "
+                               f"retrying: {type(e).__name__}: {str(e)}")
+                await asyncio.sleep(2 ** attempt)
+
+        if not batch:
+            return
+
+        last_id = batch[-1]._id
+
+        yield batch
+
+        if len(batch) < batch_size:
+            return
+
+
+@_run_in_executor
+def delete_verification_data_by_ids(verified_user_ids: typing.List[typing.Any]) -> int:
+    """
+    Delete many verified users in a single round trip.
+    :param verified_user_ids: The document IDs of the verified users to delete.
+    :return: The number of verified users deleted.
+    """
+    deleted_count = verify_models.VerifiedUser.objects(id__in=verified_user_ids).delete()
+
+    if verified_user_cache:
+        for verified_user_id in verified_user_ids:
+            verified_user_cache.invalidate(verified_user_id)
+
+    return deleted_count
+
+
+@_run_in_executor
+def save_verified_user_removals(removals: typing.List[verify_models.VerifiedUserRemoval]) -> typing.NoReturn:
+    """
+    Save many verified user removal audit records in a single round trip.
+    :param removals: The removal audit records to save.
+    :return: Nothing.
+    """
+    verify_models.VerifiedUserRemoval.objects.insert(removals, load_bulk=False)
+
+
+class VerifiedUserRemovalBatch:
+    def __init__(self, batch_size: int):
+        """
+        Accumulate verified user deletions and their audit records, writing them to the database in bulk.
+        :param batch_size: The number of removals to accumulate before they're flushed automatically.
+        """
+        self.batch_size = batch_size
+        self.removed_count = 0
+
+        self._verified_user_ids = []
+        self._removals = []
+
+    async def add(self, verified_user: munch.Munch, removal_data: dict) -> typing.NoReturn:
+        """
+        Queue a verified user for deletion, flushing the batch if it's full.
+        :param verified_user: The raw verified user to delete, as returned by get_all_verification_data.
+        :param removal_data: The details of the removal, used to create its audit record.
+        :return: Nothing.
+        """
+        self._verified_user_ids.append(verified_user._id)
+        self._removals.append(verify_models.VerifiedUserRemoval(
+            discord_user_id=verified_user.discord_user.discord_user_id,
+            discord_member_name=removal_data.get("discord_member_name"),
+            reddit_username=verified_user.reddit_user.reddit_username,
+            removal_reason=removal_data["removal_reason"],
+            user_notified=removal_data.get("user_notified", False)
+        ))
+
+        if len(self._verified_user_ids) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self) -> typing.NoReturn:
+        """
+        Write any queued deletions and audit records to the database.
+        :return: Nothing.
+        """
+        verified_user_ids, self._verified_user_ids = self._verified_user_ids, []
+        removals, self._removals = self._removals, []
+
+        if verified_user_ids:
+            self.removed_count += await delete_verification_data_by_ids(verified_user_ids)
+
+        if removals:
+            await save_verified_user_removals(removals)
+
+
+@_run_in_executor
+def has_verification_data(discord_user_id: int, read_preference: ReadPreference = None) -> bool:
     """
     Check if a Discord user has verification data.
     :param discord_user_id: The user ID to check.
+    :param read_preference: The read preference to use, e.g. lookup_read_preference. Defaults to the primary.
     :return: True if the user has verification data, otherwise False.
     """
-    return get_verification_data(discord_user_id=discord_user_id) is not None
+    if verified_user_cache and verified_user_cache.get(discord_user_id=discord_user_id):
+        return True
+
+    collection = verify_models.VerifiedUser._get_collection()
+
+    if read_preference:
+        collection = collection.with_options(read_preference=read_preference)
+
+    # This is covered by the unique index on the Discord user ID, so no documents need to be read.
+    return collection.find_one(
+        {"discord_user.discord_user_id": discord_user_id},
+        projection={"_id": 0, "discord_user.discord_user_id": 1}
+    ) is not None
 
 
+def _get_feedback_data(message_id: int) -> typing.Optional[feedback_models.FeedbackItem]:
+    return feedback_models.FeedbackItem.objects(discord_message_id=message_id).first()
+
+
+@_run_in_executor
 def get_feedback_data(message_id: int) -> typing.Optional[feedback_models.FeedbackItem]:
     """
     Fetch feedback data by the message ID containing its voting view.
     :param message_id: The message ID to fetch.
     :return: The feedback item, if it exists.
     """
-    return feedback_models.FeedbackItem.objects(discord_message_id=message_id).first()
+    return _get_feedback_data(message_id)
 
 
+@_run_in_executor
 def delete_feedback_data(message_id: int) -> typing.NoReturn:
     """
     Delete feedback data by the message ID containing its voting view.
     :param message_id: The feedback data to delete, by the Discord message ID containing its voting view.
     :return: Nothing.
     """
-    feedback_data = get_feedback_data(message_id)
+    feedback_data = _get_feedback_data(message_id)
 
     if feedback_data:
         feedback_data.delete()
 
 
-def save_rate_limiter_message_data(message_author: str, guild_channel_id: int) -> typing.NoReturn:
+@_run_in_executor
+def cast_feedback_vote(message_id: int, discord_username: str, vote_weight: int) \
+        -> typing.Optional[feedback_models.FeedbackItem]:
     """
-    Create a message rate limiter data object.
-    :param message_author: The username of the message author.
-    :param guild_channel_id: The channel ID that the message was sent in.
+    Atomically cast a new vote on a feedback item, as long as the user didn't author it and hasn't already voted.
+    :param message_id: The message ID containing the feedback item's voting view.
+    :param discord_username: The Discord username of the user voting.
+    :param vote_weight: The weight of the vote (1 for an upvote, -1 for a downvote).
+    :return: The feedback item (without its votes) after the vote was cast, or None if the vote wasn't allowed.
+    """
+    vote = feedback_models.FeedbackVote(discord_username=discord_username, vote_weight=vote_weight).to_mongo()
+
+    return _update_feedback_votes(
+        {
+            "discord_message_id": message_id,
+            "author_username": {"$ne": discord_username},
+            "votes.discord_username": {"$ne": discord_username}
+        },
+        {"$concatArrays": [{"$ifNull": ["$votes", []]}, {"$literal": [vote]}]},
+        upvote_change=1 if vote_weight > 0 else 0,
+        downvote_change=1 if vote_weight < 0 else 0
+    )
+
+
+@_run_in_executor
+def flip_feedback_vote(message_id: int, discord_username: str, vote_weight: int) \
+        -> typing.Optional[feedback_models.FeedbackItem]:
+    """
+    Atomically change a user's existing vote on a feedback item to point the other way.
+    :param message_id: The message ID containing the feedback item's voting view.
+    :param discord_username: The Discord username of the user voting.
+    :param vote_weight: The new weight of the vote (1 for an upvote, -1 for a downvote).
+    :return: The feedback item (without its votes) after the vote was changed,
+             or None if the user doesn't have a vote in the opposite direction.
+    """
+    return _update_feedback_votes(
+        {
+            "discord_message_id": message_id,
+            "votes": {"$elemMatch": {"discord_username": discord_username, "vote_weight": -vote_weight}}
+        },
+        {"$map": {"input": "$votes", "in": {"$cond": [
+            {"$eq": ["$$this.discord_username", {"$literal": discord_username}]},
+            {
+                "discord_username": "$$this.discord_username",
+                "vote_weight": {"$literal": vote_weight},
+                "vote_timestamp": {"$literal": datetime.datetime.utcnow()}
+            },
+            "$$this"
+        ]}}},
+        upvote_change=vote_weight,
+        downvote_change=-vote_weight
+    )
+
+
+def _count_feedback_votes(vote_weight: int) -> dict:
+    return {"$size": {"$filter": {
+        "input": {"$ifNull": ["$votes", []]},
+        "cond": {"$eq": ["$$this.vote_weight", vote_weight]}
+    }}}
+
+
+def _update_feedback_votes(
+        query: dict,
+        votes: dict,
+        upvote_change: int,
+        downvote_change: int
+) -> typing.Optional[feedback_models.FeedbackItem]:
+    # The votes and counters are updated in a single write. Counters which are missing (the item hasn't been migrated
+    # yet) are counted from the votes before the change, rather than starting from zero.
+    feedback_item = feedback_models.FeedbackItem._get_collection().find_one_and_update(
+        query,
+        [{"$set": {
+            "votes": votes,
+            "upvote_count": {"$add": [{"$ifNull": ["$upvote_count", _count_feedback_votes(1)]}, upvote_change]},
+            "downvote_count": {
+                "$add": [{"$ifNull": ["$downvote_count", _count_feedback_votes(-1)]}, downvote_change]
+            }
+        }}],
+        projection={"votes": 0},
+        return_document=pymongo.ReturnDocument.AFTER
+    )
+
+    return feedback_models.FeedbackItem._from_son(feedback_item) if feedback_item else None
+
+
+@_run_in_executor
+def save_rate_limiter_message_data(
+        rate_limit_items: typing.List[message_rate_limiter_models.MessageRateLimitItem]
+) -> typing.NoReturn:
+    """
+    Create or replace many message rate limiter data objects in a single round trip.
+    :param rate_limit_items: The rate limiter data objects to save, each of which replaces any existing data object
+                             for the same author and channel.
     :return: Nothing.
     """
-    message_rate_limiter_models.MessageRateLimitItem(
-        author_username=message_author,
-        guild_channel_id=guild_channel_id
-    ).save()
+    if not rate_limit_items:
+        return
+
+    message_rate_limiter_models.MessageRateLimitItem._get_collection().bulk_write([
+        pymongo.UpdateOne(
+            {"author_id": rate_limit_item.author_id, "guild_channel_id": rate_limit_item.guild_channel_id},
+            {"$set": rate_limit_item.to_mongo().to_dict()},
+            upsert=True
+        )
+        for rate_limit_item in rate_limit_items
+    ], ordered=False)
 
 
-def get_rate_limiter_message_data(message_author: str, guild_channel_id: int) \
-        -> typing.Optional[message_rate_limiter_models.MessageRateLimitItem]:
+@_run_in_executor
+def get_active_rate_limiter_message_data() -> typing.List[munch.Munch]:
     """
-    Get a message rate limiter data object.
-    :param message_author: The username of the message author.
-    :param guild_channel_id: The channel ID that the message was sent in.
-    :return: The rate limiter data object if found, otherwise None.
+    Get all message rate limiter data objects which haven't expired yet, as raw documents.
+    :return: The unexpired rate limiter data objects.
     """
-    return message_rate_limiter_models.MessageRateLimitItem.objects(
-        author_username=message_author,
-        guild_channel_id=guild_channel_id
-    ).first()
+    # Data saved before author IDs were recorded can't be keyed, so it's left for the TTL index to purge.
+    rate_limit_items = message_rate_limiter_models.MessageRateLimitItem.objects(
+        author_id__exists=True,
+        expires_at__gt=datetime.datetime.utcnow()
+    ).as_pymongo()
+
+    return [munch.munchify(rate_limit_item) for rate_limit_item in rate_limit_items]
+
+
+@_run_in_executor
+def get_subreddit_banned_usernames(subreddit_name: str) -> typing.List[str]:
+    """
+    Get the lowercased usernames of every Redditor in the ban index for a subreddit.
+    :param subreddit_name: The subreddit to get the banned usernames for.
+    :return: The lowercased usernames of the banned Redditors.
+    """
+    bans = subreddit_ban_models.SubredditBan._get_collection().find(
+        {"subreddit_name": subreddit_name},
+        {"_id": 0, "reddit_username_lower": 1}
+    )
+
+    return [ban["reddit_username_lower"] for ban in bans]
+
+
+@_run_in_executor
+def get_subreddit_ban_sync_state(subreddit_name: str) -> typing.Optional[subreddit_ban_models.SubredditBanSyncState]:
+    """
+    Get the state of the ban index synchronisation for a subreddit.
+    :param subreddit_name: The subreddit to get the synchronisation state for.
+    :return: The synchronisation state, or None if the ban index has never been synchronised.
+    """
+    return subreddit_ban_models.SubredditBanSyncState.objects(subreddit_name=subreddit_name).first()
+
+
+def _subreddit_ban_upsert(
+        subreddit_name: str,
+        reddit_username: str,
+        banned_at: typing.Optional[datetime.datetime],
+        synced_at: datetime.datetime
+) -> pymongo.UpdateOne:
+    return pymongo.UpdateOne(
+        {"subreddit_name": subreddit_name, "reddit_username_lower": reddit_username.lower()},
+        {"$set": {"reddit_username": reddit_username, "banned_at": banned_at, "synced_at": synced_at}},
+        upsert=True
+    )
+
+
+@_run_in_executor
+def apply_subreddit_ban_changes(
+        subreddit_name: str,
+        bans: typing.Dict[str, typing.Optional[datetime.datetime]],
+        unbanned_usernames: typing.Iterable[str]
+) -> typing.NoReturn:
+    """
+    Apply incremental changes to the ban index for a subreddit in a single round trip.
+    :param subreddit_name: The subreddit whose ban index should be changed.
+    :param bans: The timestamps of new bans, keyed by the banned Redditor's username.
+    :param unbanned_usernames: The usernames of Redditors who have been unbanned.
+    :return: Nothing.
+    """
+    now = datetime.datetime.utcnow()
+    operations = [
+        _subreddit_ban_upsert(subreddit_name, reddit_username, banned_at, now)
+        for reddit_username, banned_at in bans.items()
+    ] + [
+        pymongo.DeleteOne({"subreddit_name": subreddit_name, "reddit_username_lower": reddit_username.lower()})
+        for reddit_username in unbanned_usernames
+    ]
+
+    if operations:
+        subreddit_ban_models.SubredditBan._get_collection().bulk_write(operations, ordered=False)
+
+
+@_run_in_executor
+def replace_subreddit_bans(
+        subreddit_name: str,
+        bans: typing.Dict[str, typing.Optional[datetime.datetime]]
+) -> typing.NoReturn:
+    """
+    Replace the ban index for a subreddit with a complete list of its bans.
+    :param subreddit_name: The subreddit whose ban index should be replaced.
+    :param bans: The timestamps of every ban, keyed by the banned Redditor's username.
+    :return: Nothing.
+    """
+    collection = subreddit_ban_models.SubredditBan._get_collection()
+    now = datetime.datetime.utcnow()
+
+    if bans:
+        collection.bulk_write([
+            _subreddit_ban_upsert(subreddit_name, reddit_username, banned_at, now)
+            for reddit_username, banned_at in bans.items()
+        ], ordered=False)
+
+    # Anything that wasn't touched by this sync is no longer banned.
+    collection.delete_many({"subreddit_name": subreddit_name, "synced_at": {"$lt": now}})
+
+
+# How many times to try queueing a message when it races with another message to the same recipient.
+_enqueue_max_attempts = 3
+
+
+@_run_in_executor
+def enqueue_outbound_reddit_message(message: outbox_models.OutboundRedditMessage) -> typing.NoReturn:
+    """
+    Add a Reddit private message to the outbox, superseding any message still waiting to be sent to the recipient.
+    :param message: The message to send.
+    :return: Nothing.
+    """
+    message.recipient_username_lower = message.recipient_username.lower()
+
+    for attempt in range(1, _enqueue_max_attempts + 1):
+        outbox_models.OutboundRedditMessage.objects(
+            recipient_username_lower=message.recipient_username_lower,
+            status=outbox_models.OUTBOX_STATUS_PENDING
+        ).update(set__status=outbox_models.OUTBOX_STATUS_SUPERSEDED)
+
+        try:
+            message.save(force_insert=True)
+            return
+        except mongoengine.errors.NotUniqueError:
+            # Another message to the recipient was queued in between, so supersede that one too and try again.
+            if attempt == _enqueue_max_attempts:
+                raise
+
+
+@_run_in_executor
+def claim_outbound_reddit_message(lease_seconds: int) -> typing.Optional[outbox_models.OutboundRedditMessage]:
+    """
+    Claim the next Reddit private message which is due to be sent.
+    The message's next attempt is pushed back by the lease, so that it's retried if the claimant never reports back.
+    :param lease_seconds: How long the claimant has to send the message before it can be claimed again.
+    :return: The claimed message, or None if no messages are due.
+    """
+    now = datetime.datetime.utcnow()
+
+    return outbox_models.OutboundRedditMessage.objects(
+        status=outbox_models.OUTBOX_STATUS_PENDING,
+        next_attempt_at__lte=now,
+        expires_at__gt=now
+    ).order_by("next_attempt_at").modify(
+        set__next_attempt_at=now + datetime.timedelta(seconds=lease_seconds),
+        inc__attempts=1,
+        new=True
+    )
+
+
+@_run_in_executor
+def complete_outbound_reddit_message(
+        message: outbox_models.OutboundRedditMessage,
+        status: str,
+        error: str = None,
+        next_attempt_at: datetime.datetime = None,
+        refund_attempt: bool = False
+) -> typing.NoReturn:
+    """
+    Record the outcome of an attempt to send a Reddit private message.
+    :param message: The message which was sent.
+    :param status: The new status of the message. Pending messages are retried at next_attempt_at.
+    :param error: A description of why the attempt failed, if it did.
+    :param next_attempt_at: When to retry the message, if it's still pending.
+    :param refund_attempt: If True, the attempt isn't counted, e.g. because the message was never sent to Reddit.
+    :return: Nothing.
+    """
+    updates = {"set__status": status, "set__last_error": error}
+
+    if refund_attempt:
+        updates["dec__attempts"] = 1
+
+    if status == outbox_models.OUTBOX_STATUS_SENT:
+        updates["set__sent_at"] = datetime.datetime.utcnow()
+
+    if next_attempt_at:
+        updates["set__next_attempt_at"] = next_attempt_at
+
+    # Only the current claim on the message may record its outcome. A message which was superseded while it was
+    # being sent keeps its state, as does one which was claimed again after this claim's lease ran out.
+    outbox_models.OutboundRedditMessage.objects(
+        id=message.id,
+        status=outbox_models.OUTBOX_STATUS_PENDING,
+        attempts=message.attempts,
+        next_attempt_at=message.next_attempt_at
+    ).update(**updates)
+
+
+def get_usl_snapshot_blocking() -> typing.Optional[usl_models.UslSnapshot]:
+    """
+    Get the saved snapshot of the Universal Scammer List.
+    Unlike everything else here, this blocks the calling thread - it's only meant to be used while starting up, so that
+    the USL is available before the bot starts handling commands.
+    :return: The snapshot, or None if one hasn't been saved.
+    """
+    return usl_models.UslSnapshot.objects(snapshot_id="usl").first()
+
+
+@_run_in_executor
+def save_usl_snapshot(snapshot: usl_models.UslSnapshot) -> typing.NoReturn:
+    """
+    Save a snapshot of the Universal Scammer List, replacing the previous one.
+    :param snapshot: The snapshot to save.
+    :return: Nothing.
+    """
+    snapshot.save()
+
+
+@_run_in_executor
+def backfill_reddit_username_lower() -> typing.NoReturn:
+    """
+    Populate the normalised Reddit username of any verified users and pending verifications saved before it existed.
+    This is idempotent, so it's safe to run on every startup.
+    :return: Nothing.
+    """
+    for document_class in (verify_models.VerifiedUser, verify_models.PendingVerification):
+        result = document_class._get_collection().update_many(
+            {"reddit_user.reddit_username_lower": {"$exists": False}},
+            [{"$set": {"reddit_user.reddit_username_lower": {"$toLower": "$reddit_user.reddit_username"}}}]
+        )
+
+        if result.modified_count:
+            logger.info(f"Backfilled normalised Reddit usernames for {result.modified_count} documents "
+                        f"in {document_class._get_collection_name()}.")
+
+
+@_run_in_executor
+def backfill_expiry_timestamps() -> typing.NoReturn:
+    """
+    Populate the expiry timestamp of any pending verifications and rate limiter data saved before it existed,
+    so that their TTL indexes can purge them.
+    :return: Nothing.
+    """
+    pending_verification_result = verify_models.PendingVerification._get_collection().update_many(
+        {"pending_verification_data.expires_at": {"$exists": False}},
+        [{"$set": {"pending_verification_data.expires_at": {"$add": [
+            "$pending_verification_data.requested_verification_at",
+            pending_verification_expiry_seconds * 1000
+        ]}}}]
+    )
+
+    rate_limiter_collection = message_rate_limiter_models.MessageRateLimitItem._get_collection()
+    rate_limiter_modified_count = 0
+    limited_channels = config.get_configuration_key(
+        "message_rate_limiter.limited_channels",
+        expected_type=list,
+        or_else=[]
+    )
+
+    for channel in limited_channels:
+        rate_limiter_modified_count += rate_limiter_collection.update_many(
+            {"guild_channel_id": channel.channel_id, "expires_at": {"$exists": False}},
+            [{"$set": {"expires_at": {"$add": ["$message_timestamp", channel.rate_limit_seconds * 1000]}}}]
+        ).modified_count
+
+    # Anything left over belongs to a channel which is no longer rate-limited.
+    rate_limiter_deleted_count = rate_limiter_collection.delete_many(
+        {"expires_at": {"$exists": False}}
+    ).deleted_count
+
+    if pending_verification_result.modified_count or rate_limiter_modified_count or rate_limiter_deleted_count:
+        logger.info(f"Backfilled expiry timestamps for {pending_verification_result.modified_count} pending "
+                    f"verifications and {rate_limiter_modified_count} rate limiter items, and removed "
+                    f"{rate_limiter_deleted_count} rate limiter items for channels which are no longer limited.")
+
+
+@_run_in_executor
+def backfill_feedback_vote_counts() -> typing.NoReturn:
+    """
+    Populate the vote counters of any feedback items saved before they existed.
+    :return: Nothing.
+    """
+    result = feedback_models.FeedbackItem._get_collection().update_many(
+        {"upvote_count": {"$exists": False}},
+        [{"$set": {"upvote_count": _count_feedback_votes(1), "downvote_count": _count_feedback_votes(-1)}}]
+    )
+
+    if result.modified_count:
+        logger.info(f"Backfilled vote counts for {result.modified_count} feedback items.")
+
+
+async def run_migrations() -> typing.NoReturn:
+    """
+    Run the one-shot data migrations needed by the current models.
+    Failures are raised to the caller, which is responsible for reporting them.
+    :return: Nothing.
+    """
+    await backfill_reddit_username_lower()
+    await backfill_expiry_timestamps()
+    await backfill_feedback_vote_counts()
@@ -0,0 +1,113 @@
+import time
+import typing
+import threading
+import pymongo.monitoring
+
+# Database work always runs on the executor thread that called into pymongo, and pymongo publishes its events
+# on that same thread, so per-operation statistics can be gathered without any locking.
+_operation_stats = threading.local()
+
+
+class OperationStats:
+    def __init__(self):
+        """
+        Statistics gathered while running a single database operation, which may issue several commands.
+        """
+        self.command_count = 0
+        self.command_micros = 0
+        self.pool_wait_micros = 0
+
+
+def begin_operation() -> OperationStats:
+    """
+    Start gathering statistics for a database operation on the current thread.
+    :return: The statistics for the operation, which are updated as pymongo publishes events.
+    """
+    _operation_stats.current = OperationStats()
+    _operation_stats.check_out_started_at = None
+
+    return _operation_stats.current
+
+
+def end_operation() -> typing.NoReturn:
+    """
+    Stop gathering statistics for the database operation on the current thread.
+    :return: Nothing.
+    """
+    _operation_stats.current = None
+
+
+def _current_operation_stats() -> typing.Optional[OperationStats]:
+    return getattr(_operation_stats, "current", None)
+
+
+class CommandLatencyListener(pymongo.monitoring.CommandListener):
+    """
+    Adds the server round trip time of each command to the statistics of the operation that issued it.
+    """
+
+    def started(self, event: pymongo.monitoring.CommandStartedEvent) -> None:
+        pass
+
+    def succeeded(self, event: pymongo.monitoring.CommandSucceededEvent) -> None:
+        self._record(event.duration_micros)
+
+    def failed(self, event: pymongo.monitoring.CommandFailedEvent) -> None:
+        self._record(event.duration_micros)
+
+    @staticmethod
+    def _record(duration_micros: int) -> typing.NoReturn:
+        stats = _current_operation_stats()
+
+        if stats:
+            stats.command_count += 1
+            stats.command_micros += duration_micros
+
+
+class PoolWaitListener(pymongo.monitoring.ConnectionPoolListener):
+    """
+    Adds the time spent waiting to check a connection out of the pool to the statistics of the operation.
+    """
+
+    def connection_check_out_started(self, event: pymongo.monitoring.ConnectionCheckOutStartedEvent) -> None:
+        _operation_stats.check_out_started_at = time.perf_counter()
+
+    def connection_checked_out(self, event: pymongo.monitoring.ConnectionCheckedOutEvent) -> None:
+        self._record()
+
+    def connection_check_out_failed(self, event: pymongo.monitoring.ConnectionCheckOutFailedEvent) -> None:
+        self._record()
+
+    @staticmethod
+    def _record() -> typing.NoReturn:
+        stats = _current_operation_stats()
+        check_out_started_at = getattr(_operation_stats, "check_out_started_at", None)
+
+        if stats and check_out_started_at is not None:
+            stats.pool_wait_micros += int((time.perf_counter() - check_out_started_at) * 1_000_000)
+
+        _operation_stats.check_out_started_at = None
+
+    def pool_created(self, event: pymongo.monitoring.PoolCreatedEvent) -> None:
+        pass
+
+    def pool_ready(self, event: pymongo.monitoring.PoolReadyEvent) -> None:
+        pass
+
+    def pool_cleared(self, event: pymongo.monitoring.PoolClearedEvent) -> None:
+        pass
+
+    def pool_closed(self, event: pymongo.monitoring.PoolClosedEvent) -> None:
+        pass
+
+    def connection_created(self, event: pymongo.monitoring.ConnectionCreatedEvent) -> None:
+        pass
+
+    def connection_ready(self, event: pymongo.monitoring.ConnectionReadyEvent) -> None:
+        pass
+
+    def connection_closed(self, event: pymongo.monitoring.ConnectionClosedEvent) -> None:
+        pass
+
+    def connection_checked_in(self, event: pymongo.monitoring.ConnectionCheckedInEvent) -> None:
+        pass
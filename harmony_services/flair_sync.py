@@ -0,0 +1,118 @@
+import typing
+import asyncio
+
+from loguru import logger
+from harmony_config import config
+from harmony_services import db as harmony_db
+from harmony_services import reddit as harmony_reddit
+
+configured_verify_role_data = config.get_configuration_key("roles", required=True, expected_type=list)
+
+# Reddit's batch flair endpoint accepts at most 100 users per request.
+flair_update_chunk_size = 100
+
+ProgressCallback = typing.Callable[[int, int], typing.Awaitable[None]]
+
+_sync_lock = asyncio.Lock()
+
+
+class FlairSyncResult:
+    def __init__(self, checked_count: int, changes: typing.List[typing.Dict[str, str]]):
+        """
+        Create a FlairSyncResult (the outcome of synchronising subreddit flair with verified users' Discord roles).
+        :param checked_count: The number of verified users with a configured role that were checked.
+        :param changes: The flair updates which were needed to bring the subreddit in line with Discord.
+        """
+        self.checked_count = checked_count
+        self.changes = changes
+        self.updated_count = 0
+        self.failed_updates: typing.List[typing.Dict[str, typing.Any]] = []
+
+
+def is_running() -> bool:
+    """
+    Check if a flair sync is in progress.
+    :return: True if a flair sync is in progress, otherwise False.
+    """
+    return _sync_lock.locked()
+
+
+def get_desired_flair(guild_roles: typing.List[int]) -> typing.Optional[typing.Tuple[str, str]]:
+    """
+    Get the flair a verified user should have, based on their Discord roles.
+    :param guild_roles: The IDs of the user's Discord roles.
+    :return: The (flair text, flair CSS class) of the first configured role the user has, or None if they have none.
+    """
+    for role in configured_verify_role_data:
+        if role["discord_role_id"] in guild_roles:
+            return role["reddit_flair_text"], role["reddit_flair_css_class"]
+
+    return None
+
+
+async def sync_flair(
+        dry_run: bool = True,
+        progress_callback: ProgressCallback = None,
+        priority: harmony_reddit.Priority = harmony_reddit.Priority.BACKGROUND
+) -> FlairSyncResult:
+    """
+    Bring subreddit flair in line with verified users' Discord roles.
+    The desired flair is diffed against the subreddit's flair list, so only users whose flair has drifted are updated,
+    100 users per request. Users without a configured role are left alone.
+    :param dry_run: If True, work out the changes but don't apply them.
+    :param progress_callback: Called with (users updated so far, total updates) after each batch is applied.
+    :param priority: The priority of the requests to Reddit.
+    :return: The outcome of the sync.
+    """
+    async with _sync_lock:
+        verified_users = await harmony_db.get_all_verification_data(
+            "reddit_user__reddit_username",
+            "discord_user__guild_roles",
+            read_preference=harmony_db.scan_read_preference
+        )
+
+        current_flairs = await harmony_reddit.get_user_flairs(expected_count=len(verified_users), priority=priority)
+
+        checked_count = 0
+        changes = []
+
+        for verified_user in verified_users:
+            desired_flair = get_desired_flair(verified_user.discord_user.get("guild_roles", []))
+
+            if not desired_flair:
+                continue
+
+            checked_count += 1
+            reddit_username = verified_user.reddit_user.reddit_username
+
+            if current_flairs.get(reddit_username.lower()) != desired_flair:
+                changes.append({
+                    "user": reddit_username,
+                    "flair_text": desired_flair[0],
+                    "flair_css_class": desired_flair[1]
+                })
+
+        result = FlairSyncResult(checked_count, changes)
+
+        logger.info(f"Flair sync found {len(changes)} of {checked_count} users with outdated flair"
+                    f"{' (dry run)' if dry_run else ''}.")
+
+        if dry_run:
+            return result
+
+        for chunk_start in range(0, len(changes), flair_update_chunk_size):
+            chunk = changes[chunk_start:chunk_start + flair_update_chunk_size]
+            outcomes = await harmony_reddit.update_user_flairs(chunk, priority=priority)
+
+            for flair_update, outcome in zip(chunk, outcomes):
+                if outcome.get("ok"):
+                    result.updated_count += 1
+                else:
+                    result.failed_updates.append({"user": flair_update["user"], "errors": outcome.get("errors")})
+
+            if progress_callback:
+                await progress_callback(chunk_start + len(chunk), len(changes))
+
+        logger.info(f"Flair sync updated {result.updated_count} users, {len(result.failed_updates)} failed.")
+
+        return result
@@ -0,0 +1,167 @@
+import heapq
+import munch
+import typing
+import asyncio
+import datetime
+import harmony_services.db
+import harmony_models.message_rate_limiter as message_rate_limiter_models
+
+from loguru import logger
+
+RateLimitKey = typing.Tuple[int, int]
+
+# Marks the end of the pending writes, so that the writer stops once everything queued before it has been written.
+_end_of_writes = object()
+
+
+class MessageRateLimitEngine:
+    def __init__(self, limited_channels: typing.List[munch.Munch]):
+        """
+        Create an in-memory message rate limiter, which persists its state to the database in the background.
+        :param limited_channels: The configured channels to rate-limit, each with a channel_id and rate_limit_seconds.
+        """
+        self.channel_rate_limits: typing.Dict[int, int] = {
+            channel.channel_id: channel.rate_limit_seconds for channel in limited_channels
+        }
+
+        # The timestamp of the last allowed message for each (author ID, channel ID).
+        self._last_message_timestamps: typing.Dict[RateLimitKey, datetime.datetime] = {}
+
+        # A min-heap of (expiry timestamp, key), used to forget rate limits once they've expired.
+        self._expiry_heap: typing.List[typing.Tuple[datetime.datetime, RateLimitKey]] = []
+
+        self._pending_writes: asyncio.Queue = asyncio.Queue()
+        self._writer_task: typing.Optional[asyncio.Task] = None
+
+    def get_rate_limit_seconds(self, channel_id: int) -> typing.Optional[int]:
+        """
+        Get the rate limit for a channel.
+        :param channel_id: The channel ID to get the rate limit for.
+        :return: The rate limit in seconds, or None if the channel isn't rate-limited.
+        """
+        return self.channel_rate_limits.get(channel_id)
+
+    def record_message(
+            self,
+            author_id: int,
+            author_name: str,
+            channel_id: int
+    ) -> typing.Optional[datetime.datetime]:
+        """
+        Check a new message against the rate limit, recording it if it's allowed.
+        :param author_id: The Discord user ID of the message author.
+        :param author_name: The Discord username of the message author.
+        :param channel_id: The channel ID that the message was sent in.
+        :return: The timestamp of the author's previous message if this message breaks the rate limit, otherwise None.
+        """
+        now = datetime.datetime.utcnow()
+        self._forget_expired(now)
+
+        key = (author_id, channel_id)
+        last_message_timestamp = self._last_message_timestamps.get(key)
+
+        if last_message_timestamp:
+            return last_message_timestamp
+
+        expiry_timestamp = self._remember(key, now)
+
+        self._pending_writes.put_nowait(message_rate_limiter_models.MessageRateLimitItem(
+            author_id=author_id,
+            author_username=author_name,
+            guild_channel_id=channel_id,
+            message_timestamp=now,
+            expires_at=expiry_timestamp
+        ))
+
+        return None
+
+    def _remember(self, key: RateLimitKey, message_timestamp: datetime.datetime) -> datetime.datetime:
+        expiry_timestamp = message_timestamp + datetime.timedelta(seconds=self.channel_rate_limits[key[1]])
+
+        self._last_message_timestamps[key] = message_timestamp
+        heapq.heappush(self._expiry_heap, (expiry_timestamp, key))
+
+        return expiry_timestamp
+
+    def _forget_expired(self, now: datetime.datetime) -> typing.NoReturn:
+        while self._expiry_heap and self._expiry_heap[0][0] <= now:
+            expiry_timestamp, key = heapq.heappop(self._expiry_heap)
+            last_message_timestamp = self._last_message_timestamps.get(key)
+
+            # Only forget the key if this heap entry belongs to the message we're still tracking.
+            if last_message_timestamp and \
+                    last_message_timestamp + datetime.timedelta(seconds=self.channel_rate_limits[key[1]]) <= now:
+                del self._last_message_timestamps[key]
+
+    async def load(self) -> typing.NoReturn:
+        """
+        Warm the rate limiter with any unexpired rate limits from the database.
+        :return: Nothing.
+        """
+        rate_limit_items = await harmony_services.db.get_active_rate_limiter_message_data()
+
+        for rate_limit_item in rate_limit_items:
+            # Skip channels which are no longer limited, and honour any change to a channel's rate limit.
+            if rate_limit_item.guild_channel_id not in self.channel_rate_limits:
+                continue
+
+            key = (rate_limit_item.author_id, rate_limit_item.guild_channel_id)
+
+            if key not in self._last_message_timestamps:
+                self._remember(key, rate_limit_item.message_timestamp)
+
+        self._forget_expired(datetime.datetime.utcnow())
+
+        logger.info(f"Loaded {len(self._last_message_timestamps)} active message rate limits.")
+
+    def start(self) -> typing.NoReturn:
+        """
+        Start persisting recorded messages to the database in the background.
+        :return: Nothing.
+        """
+        if not self._writer_task:
+            self._writer_task = asyncio.get_running_loop().create_task(self._write_behind())
+
+    async def stop(self) -> typing.NoReturn:
+        """
+        Stop the background writer, persisting anything it hasn't written yet.
+        Rather than being cancelled part way through a write, the writer is left to drain the queue and finish.
+        :return: Nothing.
+        """
+        if self._writer_task:
+            self._pending_writes.put_nowait(_end_of_writes)
+
+            await self._writer_task
+            self._writer_task = None
+        else:
+            await self._flush(self._take_pending_writes())
+
+    async def _write_behind(self) -> typing.NoReturn:
+        while True:
+            # Wait for at least one write, then write everything that's queued up behind it in one go.
+            rate_limit_items = [await self._pending_writes.get()] + self._take_pending_writes()
+
+            await self._flush([
+                rate_limit_item for rate_limit_item in rate_limit_items if rate_limit_item is not _end_of_writes
+            ])
+
+            if any(rate_limit_item is _end_of_writes for rate_limit_item in rate_limit_items):
+                return
+
+    def _take_pending_writes(self) -> typing.List[message_rate_limiter_models.MessageRateLimitItem]:
+        rate_limit_items = []
+
+        while not self._pending_writes.empty():
+            rate_limit_items.append(self._pending_writes.get_nowait())
+
+        return rate_limit_items
+
+    async def _flush(
+            self,
+            rate_limit_items: typing.List[message_rate_limiter_models.MessageRateLimitItem]
+    ) -> typing.NoReturn:
+        try:
+            await harmony_services.db.save_rate_limiter_message_data(rate_limit_items)
+        except Exception as e:
+            logger.warning(f"Failed to persist {len(rate_limit_items)} message rate limits, "
+                           f"got exception: {type(e).__name__}: {str(e)}")
@@ -1,24 +1,102 @@
+import math
+import time
 import typing
-import datetime
-import praw.models
-import prawcore.exceptions
+import asyncio
+import asyncpraw
+import asyncpraw.models
+import asyncprawcore.exceptions
+import harmony_models.reddit as reddit_models
 
 from harmony_config import config
 from loguru import logger
+from harmony_services.reddit_scheduler import Priority, RedditRequestScheduler
+
+reddit_client_id = config.get_configuration_key("reddit.client_id", required=True)
+reddit_client_secret = config.get_configuration_key("reddit.client_secret", required=True)
+reddit_username = config.get_configuration_key("reddit.username", required=True)
+reddit_password = config.get_configuration_key("reddit.password", required=True)
+reddit_user_agent = config.get_configuration_key("reddit.user_agent", required=True)
+
+profile_cache_ttl_seconds = config.get_configuration_key(
+    "reddit.profile_cache_ttl_seconds",
+    expected_type=int,
+    or_else=300
+)
+profile_cache_negative_ttl_seconds = config.get_configuration_key(
+    "reddit.profile_cache_negative_ttl_seconds",
+    expected_type=int,
+    or_else=60
+)
+profile_cache_max_size = config.get_configuration_key(
+    "reddit.profile_cache_max_size",
+    expected_type=int,
+    or_else=10000
+)
 
-reddit = praw.Reddit(
-    client_id=config.get_configuration_key("reddit.client_id", required=True),
-    client_secret=config.get_configuration_key("reddit.client_secret", required=True),
-    username=config.get_configuration_key("reddit.username", required=True),
-    password=config.get_configuration_key("reddit.password", required=True),
-    user_agent=config.get_configuration_key("reddit.user_agent", required=True),
-    check_for_async=False
+_reddit: typing.Optional[asyncpraw.Reddit] = None
+
+# Redditor profiles keyed by lowercased username, along with the monotonic time that each one expires at.
+_profile_cache: typing.Dict[str, typing.Tuple[float, reddit_models.RedditorProfile]] = {}
+
+# Profile fetches which are currently in flight, so that concurrent lookups of the same name share one request.
+# Interactive lookups don't wait on background fetches, which may be held back to pace the background work.
+_profile_fetches: typing.Dict[typing.Tuple[str, Priority], asyncio.Task] = {}
+
+request_scheduler = RedditRequestScheduler(
+    get_limits=lambda: get_reddit().auth.limits,
+    interactive_reserve=config.get_configuration_key(
+        "reddit.request_scheduler_interactive_reserve",
+        expected_type=int,
+        or_else=10
+    ),
+    background_max_retries=config.get_configuration_key(
+        "reddit.request_scheduler_background_max_retries",
+        expected_type=int,
+        or_else=5
+    ),
+    interactive_max_wait_seconds=config.get_configuration_key(
+        "reddit.request_scheduler_max_wait_seconds",
+        expected_type=int,
+        or_else=5
+    )
 )
 
 verification_message_template = None
 subreddit_name = config.get_configuration_key("reddit.subreddit_name", required=True)
 
 
+def get_reddit() -> asyncpraw.Reddit:
+    """
+    Get the Reddit client, creating it if necessary.
+    The client owns an aiohttp session, so it's created lazily to make sure it's bound to the running event loop.
+    :return: The Reddit client.
+    """
+    global _reddit
+
+    if _reddit is None:
+        _reddit = asyncpraw.Reddit(
+            client_id=reddit_client_id,
+            client_secret=reddit_client_secret,
+            username=reddit_username,
+            password=reddit_password,
+            user_agent=reddit_user_agent
+        )
+
+    return _reddit
+
+
+async def close() -> typing.NoReturn:
+    """
+    Close the Reddit client's HTTP session, if it has been created.
+    :return: Nothing.
+    """
+    global _reddit
+
+    if _reddit is not None:
+        await _reddit.close()
+        _reddit = None
+
+
 def load_verification_message_template() -> typing.NoReturn:
     """
     Load the verification message template as markdown, and verify that it has the correct template variables.
@@ -64,115 +142,254 @@ def create_verification_message(
             )
 
 
-def reddit_user_exists(username: str) -> bool:
+async def get_redditor_profile(
+        username: str,
+        priority: Priority = Priority.INTERACTIVE
+) -> reddit_models.RedditorProfile:
+    """
+    Get a Redditor's profile, from the cache if possible.
+    Concurrent lookups of the same Redditor share a single request to Reddit.
+    :param username: The Redditor's username, not beginning with u/.
+    :param priority: The priority of the request to Reddit, if one is needed.
+    :return: The Redditor's profile, which may describe an account that doesn't exist.
+    """
+    cache_key = username.lower()
+    cached_profile = _profile_cache.get(cache_key)
+
+    if cached_profile and cached_profile[0] > time.monotonic():
+        return cached_profile[1]
+
+    fetch_task = _profile_fetches.get((cache_key, priority))
+
+    if not fetch_task:
+        fetch_task = asyncio.get_running_loop().create_task(_fetch_redditor_profile(username, priority))
+        _profile_fetches[(cache_key, priority)] = fetch_task
+
+    # Shield the fetch so that one cancelled caller doesn't cancel it for everyone else waiting on it.
+    return await asyncio.shield(fetch_task)
+
+
+async def _fetch_redditor_profile(username: str, priority: Priority) -> reddit_models.RedditorProfile:
+    try:
+        try:
+            redditor = await request_scheduler.run(lambda: get_reddit().redditor(username, fetch=True), priority)
+        except asyncprawcore.exceptions.NotFound:
+            profile = reddit_models.RedditorProfile(username=username, exists=False)
+        else:
+            profile = reddit_models.RedditorProfile(
+                username=username,
+                exists=True,
+                reddit_user_id=getattr(redditor, "id", None),
+                created_utc=getattr(redditor, "created_utc", None),
+                is_suspended=getattr(redditor, "is_suspended", False)
+            )
+
+        ttl_seconds = profile_cache_ttl_seconds if profile.is_active else profile_cache_negative_ttl_seconds
+        _cache_redditor_profile(profile, ttl_seconds)
+
+        return profile
+    finally:
+        _profile_fetches.pop((username.lower(), priority), None)
+
+
+def _cache_redditor_profile(profile: reddit_models.RedditorProfile, ttl_seconds: int) -> typing.NoReturn:
+    now = time.monotonic()
+    cache_key = profile.username.lower()
+
+    # Re-insert the entry so that the dict stays ordered from the oldest to the newest entry.
+    _profile_cache.pop(cache_key, None)
+    _profile_cache[cache_key] = (now + ttl_seconds, profile)
+
+    if len(_profile_cache) > profile_cache_max_size:
+        for expired_key in [key for key, (expires_at, _) in _profile_cache.items() if expires_at <= now]:
+            del _profile_cache[expired_key]
+
+        while len(_profile_cache) > profile_cache_max_size:
+            del _profile_cache[next(iter(_profile_cache))]
+
+
+async def get_redditor_profiles_by_id(
+        reddit_usernames_by_id: typing.Dict[str, str],
+        priority: Priority = Priority.INTERACTIVE
+) -> typing.Dict[str, reddit_models.RedditorProfile]:
+    """
+    Get the profiles of many Redditors at once, looking them up by account ID 100 accounts per request.
+    Accounts missing from the bulk response (e.g. deleted accounts) are looked up individually by username.
+    :param reddit_usernames_by_id: The Redditors' usernames, keyed by their account IDs.
+    :param priority: The priority of the requests to Reddit.
+    :return: The Redditors' profiles, keyed by the account IDs that were passed in.
+    """
+    profiles = {}
+    account_ids = list(reddit_usernames_by_id)
+
+    for chunk_start in range(0, len(account_ids), 100):
+        account_ids_by_fullname = {
+            _to_redditor_fullname(account_id): account_id
+            for account_id in account_ids[chunk_start:chunk_start + 100]
+        }
+
+        async def fetch_partial_redditors() -> typing.List[asyncpraw.models.redditors.PartialRedditor]:
+            return [
+                partial_redditor async for partial_redditor in
+                get_reddit().redditors.partial_redditors(account_ids_by_fullname)
+            ]
+
+        for partial_redditor in await request_scheduler.run(fetch_partial_redditors, priority):
+            account_id = account_ids_by_fullname.get(partial_redditor.fullname)
+
+            if account_id is None:
+                continue
+
+            is_suspended = getattr(partial_redditor, "is_suspended", False)
+            profile = reddit_models.RedditorProfile(
+                username=getattr(partial_redditor, "name", reddit_usernames_by_id[account_id]),
+                exists=True,
+                # Match individual lookups, which don't return an ID for suspended accounts.
+                reddit_user_id=None if is_suspended else partial_redditor.fullname[3:],
+                created_utc=getattr(partial_redditor, "created_utc", None),
+                is_suspended=is_suspended
+            )
+
+            profiles[account_id] = profile
+            _cache_redditor_profile(
+                profile,
+                profile_cache_ttl_seconds if profile.is_active else profile_cache_negative_ttl_seconds
+            )
+
+    for account_id in account_ids:
+        if account_id not in profiles:
+            profiles[account_id] = await get_redditor_profile(reddit_usernames_by_id[account_id], priority)
+
+    return profiles
+
+
+def _to_redditor_fullname(account_id: str) -> str:
+    return account_id if account_id.startswith("t2_") else f"t2_{account_id}"
+
+
+async def reddit_user_exists(username: str, priority: Priority = Priority.INTERACTIVE) -> bool:
     """
     Check if a Reddit user exists.
     :param username: The username, not beginning with u/, of the Reddit user to check.
+    :param priority: The priority of the request to Reddit, if one is needed.
     :return: True if the Redditor exists, False otherwise.
     """
-    try:
-        reddit.redditor(username).id
-    except (prawcore.exceptions.NotFound, AttributeError):
-        return False
-
-    return True
+    # Suspended accounts can still be fetched, but don't have an ID.
+    return (await get_redditor_profile(username, priority)).is_active
 
 
-def redditor_suspended(username: str) -> bool:
+async def redditor_suspended(username: str, priority: Priority = Priority.INTERACTIVE) -> bool:
     """
     Check if a Reddit account is suspended.
     :param username: The username to check.
+    :param priority: The priority of the request to Reddit, if one is needed.
     :return: True if the Redditor has been suspended, otherwise False.
     """
-    try:
-        redditor = reddit.redditor(username)
-        return hasattr(redditor, 'is_suspended') and redditor.is_suspended
-    except prawcore.exceptions.NotFound:
-        return False
+    return (await get_redditor_profile(username, priority)).is_suspended
 
 
-def subreddit_bans(subreddit: str, limit: int = 10000) -> typing.List[praw.models.Redditor]:
+async def subreddit_bans(
+        subreddit: str,
+        limit: int = 10000,
+        priority: Priority = Priority.INTERACTIVE
+) -> typing.List[asyncpraw.models.Redditor]:
     """
     Get a list of banned accounts from the subreddit.
     :param limit: The maximum number of bans to fetch.
     :param subreddit: The subreddit to check.
+    :param priority: The priority of the requests to Reddit.
     :return: A list of up to {limit} banned accounts from the specified subreddit.
     """
-    return get_subreddit(subreddit).banned(limit=limit)
+    subreddit = await get_subreddit(subreddit)
+
+    async def fetch_bans() -> typing.List[asyncpraw.models.Redditor]:
+        return [redditor async for redditor in subreddit.banned(limit=limit)]
 
+    # Listings are fetched 100 items per request.
+    return await request_scheduler.run(fetch_bans, priority, cost=max(math.ceil(limit / 100), 1))
 
-def get_redditor(username: str) -> typing.Optional[praw.models.Redditor]:
+
+async def subreddit_mod_actions_since(
+        subreddit: str,
+        action: str,
+        last_action_id: typing.Optional[str],
+        limit: int,
+        priority: Priority = Priority.INTERACTIVE
+) -> typing.Tuple[typing.List[asyncpraw.models.ModAction], bool]:
     """
-    Get a specified Redditor.
-    :param username: The Redditor's username, not beginning with u/.
-    :return: The Redditor, if it exists, otherwise None.
+    Get the moderation log entries for an action which are newer than the last one seen.
+    :param subreddit: The subreddit to check.
+    :param action: The moderation action to get log entries for, e.g. banuser.
+    :param last_action_id: The ID of the newest log entry already seen, or None to fetch up to the limit.
+    :param limit: The maximum number of log entries to fetch.
+    :param priority: The priority of the requests to Reddit.
+    :return: The new log entries, newest first, and whether they're known to cover everything since the last one seen.
     """
-    try:
-        return reddit.redditor(username)
-    except prawcore.exceptions.NotFound:
-        return None
+    subreddit = await get_subreddit(subreddit)
+
+    async def fetch_mod_actions() -> typing.Tuple[typing.List[asyncpraw.models.ModAction], bool]:
+        mod_actions = []
+
+        async for mod_action in subreddit.mod.log(action=action, limit=limit):
+            if mod_action.id == last_action_id:
+                return mod_actions, True
+
+            mod_actions.append(mod_action)
+
+        # If the log ran out before the limit did, then there's nothing older that we could have missed.
+        return mod_actions, len(mod_actions) < limit
+
+    return await request_scheduler.run(fetch_mod_actions, priority, cost=max(math.ceil(limit / 100), 1))
 
 
-def get_account_age_days(username: str) -> int:
+async def get_account_age_days(username: str, priority: Priority = Priority.INTERACTIVE) -> int:
     """
     Get the specified Redditor's account age, in days.
     :param username: The Redditor's username, not beginning with u/.
+    :param priority: The priority of the request to Reddit, if one is needed.
     :return: The Redditor's account age, in days.
     """
-    redditor = get_redditor(username)
+    account_age_days = (await get_redditor_profile(username, priority)).account_age_days
 
-    if redditor and hasattr(redditor, "created_utc"):
-        account_created_timestamp = datetime.datetime.fromtimestamp(redditor.created_utc, tz=datetime.timezone.utc)
-        now_timestamp = datetime.datetime.now(tz=datetime.timezone.utc)
-
-        return (now_timestamp - account_created_timestamp).days
-    else:
+    if account_age_days is None:
         raise RuntimeError(f"Failed to fetch data for redditor u/{username}")
 
+    return account_age_days
+
 
-def get_subreddit(subreddit: str) -> typing.Optional[praw.models.Subreddit]:
+async def get_subreddit(subreddit: str) -> typing.Optional[asyncpraw.models.Subreddit]:
     """
     Get a specified subreddit.
     :param subreddit: The subreddit's name, not beginning with r/.
     :return: The subreddit, if it exists, otherwise None.
     """
     try:
-        return reddit.subreddit(subreddit)
-    except prawcore.exceptions.NotFound:
+        return await get_reddit().subreddit(subreddit)
+    except asyncprawcore.exceptions.NotFound:
         return None
 
 
-def send_verification_message(
+async def send_private_message(
         username: str,
-        verification_code: str,
-        subreddit_name: str,
-        guild_name: str
+        subject: str,
+        message: str,
+        priority: Priority = Priority.INTERACTIVE
 ) -> typing.NoReturn:
     """
-    Send a message to the user with their verification code in it.
-    :param username: The user to send the message to.
-    :param verification_code: The verification code to include in the message.
-    :param subreddit_name: The name of the subreddit to include in the message.
-    :param guild_name: The name of the guild to include in the message.
+    Send a private message to a Redditor.
+    :param username: The username, not beginning with u/, of the Redditor to send the message to.
+    :param subject: The subject of the message.
+    :param message: The markdown body of the message.
+    :param priority: The priority of the request to Reddit.
     :return: Nothing.
     """
+    # Messaging doesn't need the Redditor's data, so there's no need to fetch it.
+    redditor = await get_reddit().redditor(username)
 
-    if not reddit_user_exists(username):
-        raise RuntimeError("The specified Reddit user doesn't exist.")
-
-    redditor = get_redditor(username)
-
-    message_contents = create_verification_message(
-        username,
-        verification_code,
-        subreddit_name,
-        guild_name
-    )
-
-    redditor.message(subject="Your /r/HardwareSwapUK Discord verification code", message=message_contents)
+    await request_scheduler.run(lambda: redditor.message(subject=subject, message=message), priority)
 
 
-def update_user_flair(username: str, flair_text: str, css_class_name: str) -> typing.NoReturn:
+async def update_user_flair(username: str, flair_text: str, css_class_name: str) -> typing.NoReturn:
     """
     Update a user's flair.
     :param username: The username of the user whose flair should be updated.
@@ -180,12 +397,50 @@ def update_user_flair(username: str, flair_text: str, css_class_name: str) -> ty
     :param css_class_name: The CSS class name to apply to the new flair.
     :return: Nothing.
     """
+    # Only verified users are flaired, and their accounts were checked when they verified, so there's no need to
+    # spend a request checking the account again - Reddit rejects the update if the account is gone.
+    subreddit = await get_subreddit(subreddit_name)
+    await request_scheduler.run(lambda: subreddit.flair.set(username, text=flair_text, css_class=css_class_name))
+
+
+async def get_user_flairs(
+        expected_count: int = 0,
+        priority: Priority = Priority.INTERACTIVE
+) -> typing.Dict[str, typing.Tuple[str, str]]:
+    """
+    Get the flair of every user with flair on the subreddit.
+    :param expected_count: Roughly how many users are expected to have flair, used to budget the requests.
+    :param priority: The priority of the requests to Reddit.
+    :return: The (flair text, flair CSS class) of each user, keyed by lowercased username.
+    """
+    subreddit = await get_subreddit(subreddit_name)
+
+    async def fetch_user_flairs() -> typing.Dict[str, typing.Tuple[str, str]]:
+        return {
+            str(flair["user"]).lower(): (flair["flair_text"] or "", flair["flair_css_class"] or "")
+            async for flair in subreddit.flair(limit=None)
+        }
+
+    # The flair list is fetched 1024 users per request.
+    return await request_scheduler.run(fetch_user_flairs, priority, cost=max(math.ceil(expected_count / 1024), 1))
+
+
+async def update_user_flairs(
+        flair_updates: typing.List[typing.Dict[str, str]],
+        priority: Priority = Priority.INTERACTIVE
+) -> typing.List[typing.Dict[str, typing.Any]]:
+    """
+    Update many users' flair with a single request.
+    :param flair_updates: Up to 100 updates, each with a user, flair_text and flair_css_class.
+    :param priority: The priority of the request to Reddit.
+    :return: The outcome of each update, with an ok flag and any errors.
+    """
+    if len(flair_updates) > 100:
+        raise ValueError("Reddit accepts at most 100 flair updates per request.")
 
-    if not reddit_user_exists(username):
-        raise RuntimeError("The specified Reddit user doesn't exist.")
+    subreddit = await get_subreddit(subreddit_name)
 
-    subreddit = get_subreddit(subreddit_name)
-    subreddit.flair.set(username, flair_text, css_class=css_class_name)
+    return await request_scheduler.run(lambda: subreddit.flair.update(flair_updates), priority)
 
 
 load_verification_message_template()
@@ -0,0 +1,178 @@
+import math
+import typing
+import asyncio
+import datetime
+import asyncpraw.exceptions
+import asyncprawcore.exceptions
+import harmony_models.outbox as outbox_models
+
+from loguru import logger
+from harmony_config import config
+from harmony_services import db as harmony_db
+from harmony_services import reddit as harmony_reddit
+from harmony_services.reddit_scheduler import RedditBusyError
+
+max_attempts = config.get_configuration_key("reddit.outbox_max_attempts", expected_type=int, or_else=5)
+retry_base_seconds = config.get_configuration_key("reddit.outbox_retry_base_seconds", expected_type=int, or_else=30)
+poll_interval_seconds = config.get_configuration_key(
+    "reddit.outbox_poll_interval_seconds",
+    expected_type=int,
+    or_else=10
+)
+pending_verification_expiry_seconds = config.get_configuration_key(
+    "verify.pending_verification_expiry_seconds",
+    expected_type=int,
+    or_else=86400
+)
+
+# How long a claimed message is held for while it's being sent, before another attempt may be made.
+_claim_lease_seconds = 300
+
+# Set whenever a message is queued, so that the worker sends it straight away rather than on its next poll.
+_message_queued = asyncio.Event()
+
+
+async def enqueue_verification_message(
+        username: str,
+        verification_code: str,
+        subreddit_name: str,
+        guild_name: str
+) -> typing.NoReturn:
+    """
+    Queue a message to the user with their verification code in it.
+    Any verification message still waiting to be sent to the user is superseded, since its code is no longer valid.
+    :param username: The user to send the message to.
+    :param verification_code: The verification code to include in the message.
+    :param subreddit_name: The name of the subreddit to include in the message.
+    :param guild_name: The name of the guild to include in the message.
+    :return: Nothing.
+    """
+    now = datetime.datetime.utcnow()
+
+    await harmony_db.enqueue_outbound_reddit_message(outbox_models.OutboundRedditMessage(
+        recipient_username=username,
+        subject="Your /r/HardwareSwapUK Discord verification code",
+        body=harmony_reddit.create_verification_message(username, verification_code, subreddit_name, guild_name),
+        created_at=now,
+        next_attempt_at=now,
+        # The code is useless once the pending verification has expired.
+        expires_at=now + datetime.timedelta(seconds=pending_verification_expiry_seconds)
+    ))
+
+    _message_queued.set()
+
+
+class RedditOutboxWorker:
+    def __init__(self):
+        """
+        Create a worker which sends the Reddit private messages queued in the outbox, retrying failures with backoff.
+        Messages are sent one at a time through the Reddit request scheduler, which paces them within the API budget.
+        """
+        self._worker_task: typing.Optional[asyncio.Task] = None
+        self._is_stopping = False
+
+    def start(self) -> typing.NoReturn:
+        """
+        Start sending queued messages in the background.
+        :return: Nothing.
+        """
+        if not self._worker_task:
+            self._is_stopping = False
+            self._worker_task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> typing.NoReturn:
+        """
+        Stop sending queued messages. Anything left in the outbox is sent when the worker is next started.
+        Rather than being cancelled, the worker is left to finish the message it's sending and record the outcome, so
+        that a message Reddit has already accepted isn't sent again once its lease runs out.
+        :return: Nothing.
+        """
+        if not self._worker_task:
+            return
+
+        self._is_stopping = True
+        _message_queued.set()
+
+        await self._worker_task
+        self._worker_task = None
+
+    async def _run(self) -> typing.NoReturn:
+        while not self._is_stopping:
+            try:
+                message = await harmony_db.claim_outbound_reddit_message(_claim_lease_seconds)
+
+                if message:
+                    await self._send(message)
+                    continue
+            except Exception as e:
+                # A claimed message whose outcome couldn't be recorded is retried once its lease runs out.
+                logger.warning(f"Failed to process the Reddit message outbox, got exception: "
+                               f"{type(e).__name__}: {str(e)}")
+
+            # Nothing is due, so wait for something to be queued (or for a retry to come due).
+            _message_queued.clear()
+
+            if self._is_stopping:
+                return
+
+            try:
+                await asyncio.wait_for(_message_queued.wait(), timeout=poll_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    @staticmethod
+    async def _send(message: outbox_models.OutboundRedditMessage) -> typing.NoReturn:
+        try:
+            await harmony_reddit.send_private_message(message.recipient_username, message.subject, message.body)
+        except RedditBusyError as e:
+            # Nothing was sent, so the message waits for the budget to come back without using up an attempt.
+            logger.info(f"Reddit is busy, holding back a message to u/{message.recipient_username} for "
+                        f"{math.ceil(e.wait_seconds)}s.")
+            await harmony_db.complete_outbound_reddit_message(
+                message,
+                outbox_models.OUTBOX_STATUS_PENDING,
+                next_attempt_at=datetime.datetime.utcnow() + datetime.timedelta(seconds=e.wait_seconds),
+                refund_attempt=True
+            )
+        except (asyncpraw.exceptions.RedditAPIException, asyncprawcore.exceptions.NotFound) as e:
+            is_rate_limited = isinstance(e, asyncpraw.exceptions.RedditAPIException) and \
+                any(item.error_type == "RATELIMIT" for item in e.items)
+
+            # Anything other than a rate limit (e.g. the user doesn't accept messages) won't succeed on a retry.
+            if not is_rate_limited:
+                logger.warning(f"Reddit rejected a message to u/{message.recipient_username}: {str(e)}")
+                await harmony_db.complete_outbound_reddit_message(
+                    message, outbox_models.OUTBOX_STATUS_FAILED, error=str(e)
+                )
+                return
+
+            await RedditOutboxWorker._retry_later(message, e)
+        except Exception as e:
+            await RedditOutboxWorker._retry_later(message, e)
+        else:
+            logger.info(f"Sent a Reddit message to u/{message.recipient_username}.")
+            await harmony_db.complete_outbound_reddit_message(message, outbox_models.OUTBOX_STATUS_SENT)
+
+    @staticmethod
+    async def _retry_later(message: outbox_models.OutboundRedditMessage, error: Exception) -> typing.NoReturn:
+        error_description = f"{type(error).__name__}: {str(error)}"
+
+        if message.attempts >= max_attempts:
+            logger.error(f"Giving up on a Reddit message to u/{message.recipient_username} after "
+                         f"{message.attempts} attempts, last got exception: {error_description}")
+            await harmony_db.complete_outbound_reddit_message(
+                message, outbox_models.OUTBOX_STATUS_FAILED, error=error_description
+            )
+            return
+
+        retry_delay_seconds = retry_base_seconds * 2 ** (message.attempts - 1)
+        logger.warning(f"Failed to send a Reddit message to u/{message.recipient_username} "
+                       f"(attempt {message.attempts}/{max_attempts}), retrying in {retry_delay_seconds}s: "
+                       f"{error_description}")
+
+        await harmony_db.complete_outbound_reddit_message(
+            message,
+            outbox_models.OUTBOX_STATUS_PENDING,
+            error=error_description,
+            next_attempt_at=datetime.datetime.utcnow() + datetime.timedelta(seconds=retry_delay_seconds)
+        )
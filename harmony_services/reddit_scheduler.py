@@ -0,0 +1,192 @@
+import enum
+import time
+import math
+import typing
+import asyncio
+import asyncprawcore.exceptions
+
+from loguru import logger
+
+T = typing.TypeVar("T")
+
+
+class Priority(enum.IntEnum):
+    # Requests made on behalf of a user who is waiting for a response, e.g. verification and flair updates.
+    INTERACTIVE = 0
+
+    # Requests made by scheduled jobs, which are paced to fit into whatever budget interactive requests leave over.
+    BACKGROUND = 1
+
+
+class RedditBusyError(Exception):
+    def __init__(self, wait_seconds: float):
+        """
+        Create a RedditBusyError (raised instead of making an interactive request wait too long for budget).
+        :param wait_seconds: How long the request would have had to wait, in seconds.
+        """
+        super().__init__(f"Reddit request budget unavailable for {math.ceil(wait_seconds)}s.")
+        self.wait_seconds = wait_seconds
+
+
+class RedditRequestScheduler:
+    def __init__(
+            self,
+            get_limits: typing.Callable[[], typing.Dict[str, typing.Optional[typing.Union[int, float]]]],
+            interactive_reserve: int,
+            background_max_retries: int,
+            interactive_max_wait_seconds: float
+    ):
+        """
+        Create a scheduler which shares Reddit's per-client request budget between interactive and background work.
+        The budget is tracked as a token bucket which is refilled from the X-Ratelimit-* headers of each response.
+        :param get_limits: A callable returning the latest rate limit info, in the format of asyncpraw's auth.limits.
+        :param interactive_reserve: The number of requests in each window that background work may not use.
+        :param background_max_retries: The number of times to retry a background request that was rate-limited.
+        :param interactive_max_wait_seconds: The longest an interactive request may wait for budget. If it would have
+        to wait any longer, RedditBusyError is raised straight away, so that the user can be told to try again.
+        """
+        self.get_limits = get_limits
+        self.interactive_reserve = interactive_reserve
+        self.background_max_retries = background_max_retries
+        self.interactive_max_wait_seconds = interactive_max_wait_seconds
+
+        # Our estimate of the budget, which is refreshed from Reddit's headers after every request.
+        self._remaining: typing.Optional[float] = None
+        self._reset_timestamp: typing.Optional[float] = None
+        self._window_budget: typing.Optional[float] = None
+
+        # Set when Reddit tells us to back off, until which no requests are made at all.
+        self._blocked_until = 0.0
+
+        self._interactive_waiters = 0
+        self._background_lock = asyncio.Lock()
+        self._next_background_request_at = 0.0
+
+    async def run(
+            self,
+            request: typing.Callable[[], typing.Awaitable[T]],
+            priority: Priority = Priority.INTERACTIVE,
+            cost: int = 1
+    ) -> T:
+        """
+        Run a Reddit request once there's enough budget for it.
+        Background requests which are rate-limited are retried after backing off, interactive requests are not.
+        Interactive requests which would wait longer than the configured maximum for budget raise RedditBusyError.
+        :param request: A callable returning the awaitable which makes the request.
+        :param priority: The priority of the request.
+        :param cost: The number of HTTP requests the call is expected to make, e.g. for paginated listings.
+        :return: The result of the request.
+        """
+        attempt = 0
+
+        while True:
+            await self._acquire(priority, cost)
+
+            try:
+                return await request()
+            except asyncprawcore.exceptions.TooManyRequests as e:
+                self._back_off(e.retry_after)
+
+                if priority is Priority.INTERACTIVE or attempt >= self.background_max_retries:
+                    raise
+
+                attempt += 1
+                logger.warning(f"Background Reddit request was rate-limited, retrying "
+                               f"(attempt {attempt}/{self.background_max_retries}).")
+            finally:
+                self._refresh()
+
+    async def _acquire(self, priority: Priority, cost: int) -> typing.NoReturn:
+        if priority is Priority.INTERACTIVE:
+            self._interactive_waiters += 1
+
+            try:
+                deadline = time.time() + self.interactive_max_wait_seconds
+                delay = self._seconds_until_available(cost, reserve=0)
+
+                while delay > 0:
+                    # Someone is waiting on this request, so it's better to fail now than after a long wait.
+                    if time.time() + delay > deadline:
+                        raise RedditBusyError(delay)
+
+                    await asyncio.sleep(delay)
+                    delay = self._seconds_until_available(cost, reserve=0)
+            finally:
+                self._interactive_waiters -= 1
+        else:
+            # Background requests go one at a time, so that they can be spaced out evenly across the window.
+            async with self._background_lock:
+                while True:
+                    delay = max(
+                        self._seconds_until_available(cost, reserve=self.interactive_reserve),
+                        self._next_background_request_at - time.time()
+                    )
+
+                    # Interactive requests that are waiting for budget get to go first.
+                    if self._interactive_waiters:
+                        delay = max(delay, 0.5)
+
+                    if delay <= 0:
+                        break
+
+                    await asyncio.sleep(delay)
+
+                self._next_background_request_at = time.time() + self._background_spacing_seconds() * cost
+
+        if self._remaining is not None:
+            self._remaining -= cost
+
+    def _seconds_until_available(self, cost: int, reserve: int) -> float:
+        now = time.time()
+
+        if self._blocked_until > now:
+            return self._blocked_until - now
+
+        # A call costing more than a whole window's budget can never fit, so it just waits for a fresh window.
+        if self._window_budget is not None:
+            cost = min(cost, self._window_budget - reserve)
+
+        if self._remaining is None or self._remaining - reserve >= cost:
+            return 0
+
+        # Out of budget for this window, so wait for it to reset.
+        if self._reset_timestamp and self._reset_timestamp > now:
+            return self._reset_timestamp - now
+
+        # The window has already reset, but we won't know the new budget until the next response.
+        self._remaining = None
+        return 0
+
+    def _background_spacing_seconds(self) -> float:
+        if self._remaining is None or self._reset_timestamp is None:
+            return 0
+
+        usable_requests = self._remaining - self.interactive_reserve
+
+        if usable_requests <= 0:
+            return 0
+
+        return max(self._reset_timestamp - time.time(), 0) / usable_requests
+
+    def _back_off(self, retry_after: typing.Optional[str]) -> typing.NoReturn:
+        if retry_after:
+            backoff_seconds = float(retry_after)
+        elif self._reset_timestamp:
+            backoff_seconds = max(self._reset_timestamp - time.time(), 1)
+        else:
+            backoff_seconds = 60
+
+        logger.warning(f"Reddit request budget exhausted, pausing Reddit requests for {math.ceil(backoff_seconds)}s.")
+        self._blocked_until = max(self._blocked_until, time.time() + backoff_seconds)
+
+    def _refresh(self) -> typing.NoReturn:
+        try:
+            limits = self.get_limits()
+        except Exception as e:
+            logger.debug(f"Couldn't read Reddit rate limits: {type(e).__name__}: {str(e)}")
+            return
+
+        if limits.get("remaining") is not None:
+            self._remaining = limits["remaining"]
+            self._reset_timestamp = limits["reset_timestamp"]
+            self._window_budget = limits["remaining"] + (limits.get("used") or 0)
@@ -0,0 +1,65 @@
+import typing
+import harmony_services.usl
+import harmony_services.ban_index
+
+from loguru import logger
+from harmony_config import config
+
+SCREENING_ACTION_REJECT = "reject"
+SCREENING_ACTION_FLAG = "flag"
+SCREENING_ACTION_HOLD = "hold"
+
+subreddit_name = config.get_configuration_key("reddit.subreddit_name", required=True)
+screening_action = config.get_configuration_key("verify.screening_action", or_else=SCREENING_ACTION_FLAG)
+screening_channel_id = config.get_configuration_key("verify.screening_channel_id", expected_type=int)
+
+if screening_action not in (SCREENING_ACTION_REJECT, SCREENING_ACTION_FLAG, SCREENING_ACTION_HOLD):
+    raise RuntimeError(f"Unknown verify.screening_action {screening_action!r}, expected one of "
+                       f"{SCREENING_ACTION_REJECT}, {SCREENING_ACTION_FLAG} or {SCREENING_ACTION_HOLD}.")
+
+
+class ScreeningResult:
+    def __init__(self, usl_tags: typing.Optional[typing.List[str]], is_subreddit_banned: bool):
+        """
+        Create a ScreeningResult (what was found when screening a Reddit account during verification).
+        :param usl_tags: The account's USL tags, or None if it isn't on the USL.
+        :param is_subreddit_banned: Whether the account is banned from the subreddit.
+        """
+        self.usl_tags = usl_tags
+        self.is_subreddit_banned = is_subreddit_banned
+
+    @property
+    def is_flagged(self) -> bool:
+        return bool(self.usl_tags) or self.is_subreddit_banned
+
+    @property
+    def reasons(self) -> typing.List[str]:
+        reasons = []
+
+        if self.usl_tags:
+            reasons.append(f"Listed on the USL ({', '.join(self.usl_tags)})")
+
+        if self.is_subreddit_banned:
+            reasons.append(f"Banned from r/{subreddit_name}")
+
+        return reasons
+
+
+def screen_reddit_account(reddit_username: str) -> ScreeningResult:
+    """
+    Screen a Reddit account against the in-memory USL index and subreddit ban index.
+    This doesn't make any requests, so it's cheap enough to run before anything is sent or saved.
+    :param reddit_username: The Reddit username to screen, not beginning with u/.
+    :return: What was found.
+    """
+    # The index is synced in the background, so a stale one means bans since the last sync are being missed.
+    if harmony_services.ban_index.is_stale():
+        last_synced_at = harmony_services.ban_index.last_synced_at()
+
+        logger.warning(f"Screening u/{reddit_username} against a stale r/{subreddit_name} ban index, last synced: "
+                       f"{last_synced_at.isoformat() + ' UTC' if last_synced_at else 'never'}.")
+
+    return ScreeningResult(
+        usl_tags=harmony_services.usl.lookup_usl(reddit_username),
+        is_subreddit_banned=harmony_services.ban_index.is_banned(reddit_username)
+    )
@@ -1,80 +1,376 @@
 import asyncio
-import re
+import time
 import httpx
-import munch
 import typing
+import harmony_models.usl as usl_models
 
 from loguru import logger
+from harmony_config import config
+from harmony_services import db as harmony_db
+from harmony_services import usl_parser
 
-_usl_cache: typing.Dict[str, typing.List[str]] = {}
 _usl_wiki_index_url = "https://api.reddit.com/r/UniversalScammerList/wiki/banlist.json"
 _usl_wiki_paginated_url = "https://api.reddit.com/r/UniversalScammerList/wiki/banlist/$_page_num.json"
 
-_url_extract_regex = r'^\*\s+\[[^][]+]\((https?:\/\/[^()]+)\)$'
-_page_number_extract_regex = r'^https?:\/\/www.reddit.com\/r\/universalscammerlist\/wiki\/banlist\/(\d+)$'
-_data_extract_regex = r'^\*\s(\/u\/\S*)\s(#.*)$'
+# Held while refreshing, so that only one refresh runs at a time. Lookups never take it.
+_usl_refresh_lock = asyncio.Lock()
 
-_usl_init_lock = asyncio.Lock()
+fetch_concurrency = config.get_configuration_key("usl.fetch_concurrency", expected_type=int, or_else=4)
+request_timeout_seconds = config.get_configuration_key("usl.request_timeout_seconds", expected_type=int, or_else=30)
 
+# Shared between refreshes, so that connections to Reddit are pooled and kept alive.
+_http_client: typing.Optional[httpx.AsyncClient] = None
 
-async def update_usl():
+
+class UslPage:
+    def __init__(self, page_number: int):
+        """
+        Create a UslPage (the last fetched copy of a USL wiki page, along with what's needed to re-fetch it cheaply).
+        :param page_number: The page number of the wiki page, or 0 for the index page.
+        """
+        self.page_number = page_number
+        self.etag: typing.Optional[str] = None
+        self.last_modified: typing.Optional[str] = None
+        self.revision_id: typing.Optional[str] = None
+        self.content_md: typing.Optional[str] = None
+        self.entries: typing.Dict[str, typing.List[str]] = {}
+
+
+class UslIndex:
+    def __init__(self, entries: typing.Dict[str, typing.List[str]], is_loaded: bool = True):
+        """
+        Create a UslIndex (an immutable snapshot of the Universal Scammer List).
+        An index is never modified once it's been published, so it can be read without locking.
+        :param entries: The USL tags of each listed user, keyed by lowercased Reddit username.
+        :param is_loaded: Whether the index holds a loaded copy of the USL, rather than being an empty placeholder.
+        """
+        self.entries = entries
+        self.is_loaded = is_loaded
+
+
+class UslSweepMatch:
+    def __init__(self, reddit_username: str, discord_user_id: int, tags: typing.List[str]):
+        """
+        Create a UslSweepMatch (a verified user who has been found on the Universal Scammer List).
+        :param reddit_username: The verified user's Reddit username.
+        :param discord_user_id: The verified user's Discord user ID.
+        :param tags: The user's USL tags.
+        """
+        self.reddit_username = reddit_username
+        self.discord_user_id = discord_user_id
+        self.tags = tags
+
+
+class UslDiff:
+    def __init__(
+            self,
+            added: typing.Dict[str, typing.List[str]],
+            removed: typing.Dict[str, typing.List[str]]
+    ):
+        """
+        Create a UslDiff (the changes between two USL indexes).
+        :param added: The USL tags of each newly listed user, keyed by lowercased Reddit username.
+        :param removed: The previous USL tags of each user who is no longer listed, keyed by lowercased Reddit username.
+        """
+        self.added = added
+        self.removed = removed
+
+
+# The last fetched copy of each wiki page, keyed by page number, and the order the wiki index lists them in.
+_usl_pages: typing.Dict[int, UslPage] = {}
+_usl_page_numbers: typing.List[int] = []
+
+# The published USL index, which a refresh replaces with a single assignment once the new index is complete.
+_usl_index = UslIndex({}, is_loaded=False)
+
+# The changes made by the last refresh.
+last_usl_diff: typing.Optional[UslDiff] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Get the HTTP client used to fetch the USL, creating it if necessary.
+    :return: The HTTP client.
+    """
+    global _http_client
+
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            timeout=request_timeout_seconds,
+            limits=httpx.Limits(max_connections=fetch_concurrency, max_keepalive_connections=fetch_concurrency)
+        )
+
+    return _http_client
+
+
+async def close() -> typing.NoReturn:
     """
-    Fetch the latest Universal Scammer List and update the cache.
+    Close the HTTP client used to fetch the USL, if it has been created.
     :return: Nothing.
     """
-    async with httpx.AsyncClient() as http_client:
+    global _http_client
+
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+async def _fetch_page(page_number: int, url: str) -> typing.Optional[UslPage]:
+    """
+    Fetch a USL wiki page, skipping the download if the server says it hasn't changed since we last fetched it.
+    :param page_number: The page number of the wiki page, or 0 for the index page.
+    :param url: The API URL of the wiki page.
+    :return: A new copy of the page, or None if it hasn't changed since it was last fetched.
+    """
+    previous_page = _usl_pages.get(page_number)
+    headers = {}
+
+    if previous_page and previous_page.etag:
+        headers["If-None-Match"] = previous_page.etag
+
+    if previous_page and previous_page.last_modified:
+        headers["If-Modified-Since"] = previous_page.last_modified
+
+    started_at = time.perf_counter()
+    response = await get_http_client().get(url, headers=headers)
+    elapsed_ms = (time.perf_counter() - started_at) * 1000
+
+    if response.status_code == httpx.codes.NOT_MODIFIED:
+        logger.info(f"USL page {page_number}: not modified ({elapsed_ms:.0f}ms)")
+        return None
+
+    response.raise_for_status()
+
+    page_data = response.json()["data"]
+    revision_id = page_data.get("revision_id")
+
+    # Reddit doesn't always honour conditional requests, so fall back to comparing wiki revisions.
+    if previous_page and revision_id and revision_id == previous_page.revision_id:
+        logger.info(f"USL page {page_number}: revision {revision_id} unchanged ({elapsed_ms:.0f}ms)")
+        return None
+
+    page = UslPage(page_number)
+    page.etag = response.headers.get("ETag")
+    page.last_modified = response.headers.get("Last-Modified")
+    page.revision_id = revision_id
+    page.content_md = page_data["content_md"]
+
+    logger.info(f"USL page {page_number}: {len(response.content)} bytes, revision {revision_id} "
+                f"({elapsed_ms:.0f}ms)")
+
+    return page
+
+
+async def _fetch_entries_page(
+        page_number: int,
+        semaphore: asyncio.Semaphore,
+        refresh_stats: usl_parser.UslParseStats
+) -> UslPage:
+    async with semaphore:
+        page_api_url = _usl_wiki_paginated_url.replace("$_page_num", str(page_number))
+        page = await _fetch_page(page_number, page_api_url)
+
+    if not page:
+        return _usl_pages[page_number]
+
+    parse_stats = usl_parser.UslParseStats()
+    page.entries = usl_parser.parse_entries_page(page.content_md, parse_stats)
+
+    if parse_stats.malformed_count:
+        logger.warning(f"USL page {page_number}: skipped {parse_stats.malformed_count} malformed lines, e.g. "
+                       f"{parse_stats.malformed_examples!r}")
+
+    refresh_stats.add(parse_stats)
+
+    # Only keep the page once it's been parsed, so that a page which fails to parse is fetched again next time.
+    # The parsed entries are all that's needed from now on.
+    page.content_md = None
+    _usl_pages[page_number] = page
+
+    return page
+
+
+def _build_index_entries(usl_pages: typing.List[UslPage]) -> typing.Dict[str, typing.List[str]]:
+    entries = {}
+
+    for usl_page in usl_pages:
+        for username, tags in usl_page.entries.items():
+            if username not in entries:
+                entries[username] = tags
+
+    return entries
+
+
+def load_usl_snapshot() -> bool:
+    """
+    Publish the USL index from the saved snapshot, so that the USL is available straight away after a restart.
+    The snapshot's page metadata is loaded too, so the next refresh only downloads pages which have changed since.
+    This blocks while the snapshot is read from the database, so it should only be used while starting up.
+    :return: True if a snapshot was loaded, otherwise False.
+    """
+    global _usl_index, _usl_page_numbers
+
+    # Don't replace an index which has already been refreshed from Reddit.
+    if _usl_index.is_loaded:
+        return False
+
+    started_at = time.perf_counter()
+
+    try:
+        snapshot = harmony_db.get_usl_snapshot_blocking()
+    except Exception as e:
+        logger.warning(f"Failed to load the USL snapshot, got exception: {type(e).__name__}: {str(e)}")
+        return False
+
+    if not snapshot:
+        logger.info("No USL snapshot has been saved yet, the USL will be available after the first refresh.")
+        return False
+
+    if snapshot.format_version != usl_models.USL_SNAPSHOT_FORMAT_VERSION:
+        logger.info(f"Ignoring USL snapshot with outdated format version {snapshot.format_version}.")
+        return False
+
+    for snapshot_page in snapshot.pages:
+        usl_page = UslPage(snapshot_page.page_number)
+        usl_page.etag = snapshot_page.etag
+        usl_page.last_modified = snapshot_page.last_modified
+        usl_page.revision_id = snapshot_page.revision_id
+        usl_page.content_md = snapshot_page.content_md
+        usl_page.entries = {username: tags for username, tags in snapshot_page.entries}
+
+        _usl_pages[usl_page.page_number] = usl_page
+
+    _usl_page_numbers = list(snapshot.page_numbers)
+    _usl_index = UslIndex(_build_index_entries([_usl_pages[page_number] for page_number in _usl_page_numbers]))
+
+    logger.info(f"Loaded {len(_usl_index.entries)} USL entries from the snapshot saved at {snapshot.saved_at} "
+                f"in {time.perf_counter() - started_at:.2f}s.")
+
+    return True
+
+
+async def _save_usl_snapshot() -> typing.NoReturn:
+    snapshot = usl_models.UslSnapshot(
+        format_version=usl_models.USL_SNAPSHOT_FORMAT_VERSION,
+        page_numbers=_usl_page_numbers,
+        pages=[
+            usl_models.UslSnapshotPage(
+                page_number=usl_page.page_number,
+                etag=usl_page.etag,
+                last_modified=usl_page.last_modified,
+                revision_id=usl_page.revision_id,
+                content_md=usl_page.content_md,
+                entries=[[username, tags] for username, tags in usl_page.entries.items()]
+            )
+            for usl_page in _usl_pages.values()
+        ]
+    )
+
+    try:
+        await harmony_db.save_usl_snapshot(snapshot)
+    except Exception as e:
+        logger.warning(f"Failed to save the USL snapshot, got exception: {type(e).__name__}: {str(e)}")
+
+
+async def update_usl() -> UslDiff:
+    """
+    Fetch the latest Universal Scammer List and publish a new index.
+    Pages are fetched concurrently, and pages which haven't changed since the last refresh aren't downloaded or parsed.
+    The new index is built off to the side, so lookups carry on using the previous index until it's ready.
+    :return: The users added to and removed from the USL by this refresh.
+    """
+    global _usl_index, _usl_page_numbers, last_usl_diff
+
+    async with _usl_refresh_lock:
+        refresh_started_at = time.perf_counter()
+        previous_pages = dict(_usl_pages)
+
         # Fetch the USL wiki index.
         logger.info("Fetching USL wiki index...")
-        usl_wiki_index = munch.munchify((await http_client.get(_usl_wiki_index_url)).json()).data.content_md
-        page_urls = []
+        index_page = await _fetch_page(0, _usl_wiki_index_url) or _usl_pages[0]
+        _usl_pages[0] = index_page
+        page_numbers = usl_parser.parse_page_numbers(index_page.content_md)
+
+        logger.info(f"Got {len(page_numbers)} pages to fetch data from.")
+
+        semaphore = asyncio.Semaphore(fetch_concurrency)
+        refresh_stats = usl_parser.UslParseStats()
+        usl_pages = await asyncio.gather(
+            *[_fetch_entries_page(page_number, semaphore, refresh_stats) for page_number in page_numbers]
+        )
 
-        # For each page link, extract the page number and convert it into an API URL
-        for page in usl_wiki_index.splitlines():
-            url_regex = re.search(_url_extract_regex, page)
+        # Forget pages which have been dropped from the wiki index.
+        for page_number in set(_usl_pages) - set(page_numbers) - {0}:
+            del _usl_pages[page_number]
 
-            if not url_regex:
-                continue
+        new_entries = _build_index_entries(usl_pages)
+        previous_entries = _usl_index.entries
+        usl_diff = UslDiff(
+            added={
+                username: tags for username, tags in new_entries.items()
+                if username not in previous_entries
+            },
+            removed={
+                username: tags for username, tags in previous_entries.items()
+                if username not in new_entries
+            }
+        )
 
-            page_urls.append(url_regex.group(1))
+        _usl_index = UslIndex(new_entries)
+        _usl_page_numbers = page_numbers
+        last_usl_diff = usl_diff
 
-        logger.info(f"Got {len(page_urls)} pages to fetch data from.")
+        logger.info(f"Got a total of {len(new_entries)} valid results in "
+                    f"{time.perf_counter() - refresh_started_at:.2f}s: "
+                    f"{len(usl_diff.added)} added, {len(usl_diff.removed)} removed. "
+                    f"Parsed changed pages: {refresh_stats}.")
 
-        if not _usl_cache:
-            await _usl_init_lock.acquire()
+        # Fetched pages are new objects, so any page that isn't the same object as before has changed.
+        if _usl_pages.keys() != previous_pages.keys() or \
+                any(usl_page is not previous_pages[page_number] for page_number, usl_page in _usl_pages.items()):
+            await _save_usl_snapshot()
 
-        try:
-            for page_url in page_urls:
-                page_number = int(re.search(_page_number_extract_regex, page_url).group(1))
-                page_api_url = _usl_wiki_paginated_url.replace("$_page_num", str(page_number))
+        return usl_diff
 
-                logger.info(f"Getting data from page {page_number}")
 
-                usl_page = munch.munchify((await http_client.get(page_api_url)).json()).data.content_md
+async def sweep_verified_users(usl_diff: UslDiff) -> typing.List[UslSweepMatch]:
+    """
+    Find verified users who have been added to the USL by a refresh.
+    The first refresh after startup without a snapshot adds every listed user, so the whole USL is checked then.
+    :param usl_diff: The users added to and removed from the USL by the refresh.
+    :return: The verified users who were added to the USL, ordered by Reddit username.
+    """
+    if not usl_diff.added:
+        return []
 
-                for entry in usl_page.splitlines():
-                    result = re.search(_data_extract_regex, entry)
+    verified_usernames = await harmony_db.get_verified_reddit_usernames(read_preference=harmony_db.scan_read_preference)
 
-                    username = result.group(1)
-                    tags = result.group(2).strip().split(" ")
+    started_at = time.perf_counter()
+    listed_usernames = verified_usernames.keys() & usl_diff.added.keys()
 
-                    if username not in _usl_cache:
-                        _usl_cache[username] = tags
-        finally:
-            _usl_init_lock.release()
+    logger.info(f"Swept {len(verified_usernames)} verified users against {len(usl_diff.added)} newly listed USL "
+                f"users in {(time.perf_counter() - started_at) * 1000:.1f}ms: {len(listed_usernames)} found.")
 
-        logger.info(f"Got a total of {len(_usl_cache)} valid results.")
+    return [
+        UslSweepMatch(*verified_usernames[username], usl_diff.added[username])
+        for username in sorted(listed_usernames)
+    ]
+
+
+def is_usl_loaded() -> bool:
+    """
+    Check if the USL has been loaded, so that a missing entry means the user isn't on the USL.
+    :return: True if the USL has been loaded, otherwise False.
+    """
+    return _usl_index.is_loaded
 
 
-async def lookup_usl(reddit_username: str) -> typing.Optional[typing.List[str]]:
+def lookup_usl(reddit_username: str) -> typing.Optional[typing.List[str]]:
     """
     Lookup a Reddit user in the Universal Scammer List.
     :param reddit_username: The Reddit username to look up.
     :return: The USL tags if a user is present in the USL, otherwise None.
     """
-    if reddit_username.startswith("u/"):
-        reddit_username = f"/{reddit_username}"
-    else:
-        reddit_username = f"/u/{reddit_username}"
+    reddit_username = reddit_username.removeprefix("/").removeprefix("u/")
 
-    async with _usl_init_lock:
-        return _usl_cache.get(reddit_username)
+    return _usl_index.entries.get(reddit_username.lower())
@@ -0,0 +1,148 @@
+import re
+import sys
+import typing
+
+# Patterns are compiled once, rather than being looked up in re's cache for every line of every page.
+_index_link_regex = re.compile(r'^\*\s+\[[^][]+]\((https?:\/\/[^()]+)\)$')
+_page_number_regex = re.compile(r'^https?:\/\/www.reddit.com\/r\/universalscammerlist\/wiki\/banlist\/(\d+)$')
+_entry_regex = re.compile(r'^\*\s\/u\/(\S+)\s+(#.*)$')
+
+
+class UslParseStats:
+    def __init__(self):
+        """
+        Create a UslParseStats (counters describing how the lines of USL wiki pages were parsed).
+        """
+        self.line_count = 0
+        self.entry_count = 0
+        self.skipped_count = 0
+        self.malformed_count = 0
+        self.malformed_examples: typing.List[str] = []
+
+    def add(self, other: "UslParseStats") -> typing.NoReturn:
+        """
+        Add another set of counters on to these ones.
+        :param other: The counters to add.
+        :return: Nothing.
+        """
+        self.line_count += other.line_count
+        self.entry_count += other.entry_count
+        self.skipped_count += other.skipped_count
+        self.malformed_count += other.malformed_count
+        remaining_examples = _max_malformed_examples - len(self.malformed_examples)
+        self.malformed_examples.extend(other.malformed_examples[:remaining_examples])
+
+    def __str__(self) -> str:
+        return f"{self.line_count} lines, {self.entry_count} entries, {self.skipped_count} skipped, " \
+               f"{self.malformed_count} malformed"
+
+
+# Only a few malformed lines are kept, so that a badly broken page can't fill up the logs.
+_max_malformed_examples = 5
+
+
+def iter_lines(content_md: str) -> typing.Iterator[str]:
+    """
+    Iterate over the lines of a wiki page without building a list of every line up front.
+    :param content_md: The markdown content of the wiki page.
+    :return: An iterator over the lines of the page, without line endings.
+    """
+    start = 0
+    content_length = len(content_md)
+
+    while start < content_length:
+        end = content_md.find("\n", start)
+
+        if end == -1:
+            end = content_length
+
+        line = content_md[start:end]
+        start = end + 1
+
+        yield line[:-1] if line.endswith("\r") else line
+
+
+def parse_page_numbers(content_md: str) -> typing.List[int]:
+    """
+    Get the numbers of the USL wiki pages linked to from the USL wiki index, in the order they're listed.
+    :param content_md: The markdown content of the USL wiki index.
+    :return: The linked page numbers. Links to anything other than a USL wiki page are ignored.
+    """
+    page_numbers = []
+
+    for line in iter_lines(content_md):
+        link_result = _index_link_regex.match(line)
+
+        if not link_result:
+            continue
+
+        page_number_result = _page_number_regex.match(link_result.group(1))
+
+        if page_number_result:
+            page_numbers.append(int(page_number_result.group(1)))
+
+    return page_numbers
+
+
+def parse_entries(
+        content_md: str,
+        stats: UslParseStats = None
+) -> typing.Iterator[typing.Tuple[str, typing.List[str]]]:
+    """
+    Parse the entries on a USL wiki page, one line at a time.
+    Lines which aren't entries (blank lines, headings, etc.) are skipped. Lines which look like entries but can't be
+    parsed are counted as malformed and skipped too, so that one bad line doesn't stop the rest of the page loading.
+    :param content_md: The markdown content of the USL wiki page.
+    :param stats: If given, counters which are updated as the page is parsed.
+    :return: An iterator over (lowercased Reddit username, USL tags) pairs, in the order they appear on the page.
+    """
+    if stats is None:
+        stats = UslParseStats()
+
+    # Most users share one of a handful of tag combinations, so each distinct combination is only stored once.
+    tag_lists: typing.Dict[str, typing.List[str]] = {}
+
+    for line in iter_lines(content_md):
+        stats.line_count += 1
+
+        if not line.startswith("*"):
+            stats.skipped_count += 1
+            continue
+
+        entry_result = _entry_regex.match(line)
+
+        if not entry_result:
+            stats.malformed_count += 1
+
+            if len(stats.malformed_examples) < _max_malformed_examples:
+                stats.malformed_examples.append(line)
+
+            continue
+
+        raw_tags = entry_result.group(2).rstrip()
+        tags = tag_lists.get(raw_tags)
+
+        if tags is None:
+            tags = [sys.intern(tag) for tag in raw_tags.split()]
+            tag_lists[raw_tags] = tags
+
+        stats.entry_count += 1
+
+        yield entry_result.group(1).lower(), tags
+
+
+def parse_entries_page(content_md: str, stats: UslParseStats = None) -> typing.Dict[str, typing.List[str]]:
+    """
+    Parse the entries on a USL wiki page into a dictionary.
+    :param content_md: The markdown content of the USL wiki page.
+    :param stats: If given, counters which are updated as the page is parsed.
+    :return: The USL tags of each user listed on the page, keyed by lowercased Reddit username. If a user is listed
+    more than once, their first entry is used.
+    """
+    entries = {}
+
+    for username, tags in parse_entries(content_md, stats):
+        if username not in entries:
+            entries[username] = tags
+
+    return entries
@@ -0,0 +1,172 @@
+import copy
+import time
+import typing
+import threading
+import collections
+import pymongo.errors
+import harmony_models.verify as verify_models
+
+from loguru import logger
+
+
+class VerifiedUserCache:
+    def __init__(self, max_size: int):
+        """
+        Create a bounded, least-recently-used cache of verified users, keyed by Discord user ID and by lowercased
+        Reddit username. The cache only answers lookups while it is being kept coherent by a change stream.
+        :param max_size: The maximum number of verified users to hold in memory.
+        """
+        self.max_size = max_size
+
+        self._lock = threading.Lock()
+        self._entries: collections.OrderedDict = collections.OrderedDict()
+        self._by_discord_user_id: typing.Dict[int, typing.Any] = {}
+        self._by_reddit_username: typing.Dict[str, typing.Any] = {}
+        self._generation = 0
+        self._is_coherent = False
+
+    @property
+    def generation(self) -> int:
+        """
+        A counter which is incremented on every invalidation.
+        Read this before querying the database, and pass it to put() so that stale reads aren't cached.
+        """
+        return self._generation
+
+    def get(
+            self,
+            discord_user_id: int = None,
+            reddit_username: str = None
+    ) -> typing.Optional[verify_models.VerifiedUser]:
+        """
+        Look up a verified user in the cache.
+        :param discord_user_id: The Discord user ID to look up.
+        :param reddit_username: The Reddit username to look up.
+        :return: A fresh copy of the verified user if cached, otherwise None.
+        """
+        with self._lock:
+            if not self._is_coherent:
+                return None
+
+            if discord_user_id:
+                document_id = self._by_discord_user_id.get(discord_user_id)
+            elif reddit_username:
+                document_id = self._by_reddit_username.get(reddit_username.lower())
+            else:
+                return None
+
+            if document_id is None:
+                return None
+
+            self._entries.move_to_end(document_id)
+            son = copy.deepcopy(self._entries[document_id])
+
+        return verify_models.VerifiedUser._from_son(son)
+
+    def put(self, verified_user: verify_models.VerifiedUser, generation: int) -> typing.NoReturn:
+        """
+        Add a verified user to the cache, evicting the least recently used entry if the cache is full.
+        :param verified_user: The verified user to cache.
+        :param generation: The cache generation read before the verified user was fetched from the database.
+        :return: Nothing.
+        """
+        son = verified_user.to_mongo()
+
+        with self._lock:
+            # If anything was invalidated while the query was in flight, the document might already be stale.
+            if not self._is_coherent or generation != self._generation:
+                return
+
+            self._remove(verified_user.id)
+
+            self._entries[verified_user.id] = son
+            self._by_discord_user_id[verified_user.discord_user.discord_user_id] = verified_user.id
+            self._by_reddit_username[verified_user.reddit_user.reddit_username.lower()] = verified_user.id
+
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, document_id: typing.Any) -> typing.NoReturn:
+        """
+        Remove a verified user from the cache.
+        :param document_id: The ID of the verified user's document.
+        :return: Nothing.
+        """
+        with self._lock:
+            self._generation += 1
+            self._remove(document_id)
+
+    def clear(self) -> typing.NoReturn:
+        """
+        Remove all verified users from the cache.
+        :return: Nothing.
+        """
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._by_discord_user_id.clear()
+            self._by_reddit_username.clear()
+
+    def _remove(self, document_id: typing.Any) -> typing.NoReturn:
+        son = self._entries.pop(document_id, None)
+
+        if son is None:
+            return
+
+        self._by_discord_user_id.pop(son["discord_user"]["discord_user_id"], None)
+        self._by_reddit_username.pop(son["reddit_user"]["reddit_username"].lower(), None)
+
+    def _set_coherent(self, is_coherent: bool) -> typing.NoReturn:
+        self.clear()
+
+        with self._lock:
+            self._is_coherent = is_coherent
+
+    def watch(self) -> typing.NoReturn:
+        """
+        Keep the cache coherent by following the change stream of the verified users collection.
+        This blocks forever, so it should be run on a dedicated thread.
+        :return: Nothing.
+        """
+        collection = verify_models.VerifiedUser._get_collection()
+        resume_token = None
+        retry_delay_seconds = 1
+
+        while True:
+            try:
+                with collection.watch(resume_after=resume_token) as change_stream:
+                    self._set_coherent(True)
+                    logger.info("Verified user cache is following the verified_users change stream.")
+                    retry_delay_seconds = 1
+
+                    for change in change_stream:
+                        resume_token = change_stream.resume_token
+
+                        if change["operationType"] in ("insert", "update", "replace", "delete"):
+                            self.invalidate(change["documentKey"]["_id"])
+                        else:
+                            # The collection was dropped, renamed or the stream was invalidated.
+                            self.clear()
+                            resume_token = None
+            except pymongo.errors.PyMongoError as e:
+                logger.warning(f"Verified user cache lost its change stream, bypassing the cache until it "
+                               f"reconnects in {retry_delay_seconds}s: {type(e).__name__}: {str(e)}")
+
+                self._set_coherent(False)
+
+                # If the stream can't be resumed from our last token, start from scratch.
+                if isinstance(e, pymongo.errors.OperationFailure):
+                    resume_token = None
+
+                time.sleep(retry_delay_seconds)
+                retry_delay_seconds = min(retry_delay_seconds * 2, 60)
+
+    def start_watching(self) -> threading.Thread:
+        """
+        Start following the change stream on a background daemon thread.
+        :return: The thread following the change stream.
+        """
+        thread = threading.Thread(target=self.watch, name="harmony-verified-user-cache", daemon=True)
+        thread.start()
+
+        return thread
@@ -5,6 +5,7 @@ import discord
 import traceback
 
 from loguru import logger
+from harmony_services.reddit_scheduler import RedditBusyError
 
 
 async def handle_error(interaction: discord.Interaction, error: Exception) -> typing.NoReturn:
@@ -14,6 +15,17 @@ async def handle_error(interaction: discord.Interaction, error: Exception) -> ty
     :param error: The raised exception.
     :return: Nothing.
     """
+    # Reddit being too busy to serve the request isn't a bug, so there's nothing worth raising a ticket about.
+    if isinstance(error, RedditBusyError):
+        logger.info(f"Interaction was turned away because Reddit is busy: {str(error)}")
+        embed = discord.Embed(
+            title="Reddit is busy",
+            description="We're making too many requests to Reddit right now. Please try again in a minute or two."
+        )
+
+        await _send_error_embed(interaction, embed)
+        return
+
     error_reference = "err_" + "".join(random.choice(string.ascii_letters + string.digits) for _ in range(12))
 
     if interaction.command:
@@ -34,6 +46,10 @@ async def handle_error(interaction: discord.Interaction, error: Exception) -> ty
         """
     )
 
+    await _send_error_embed(interaction, embed)
+
+
+async def _send_error_embed(interaction: discord.Interaction, embed: discord.Embed) -> typing.NoReturn:
     if interaction.response.is_done():
         await interaction.edit_original_response(content=None, embed=embed)
     else:
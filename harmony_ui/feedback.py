@@ -1,7 +1,6 @@
 import typing
 import discord
 import harmony_ui
-import mongoengine
 import harmony_services.db
 import harmony_models.feedback
 
@@ -54,93 +53,70 @@ class FeedbackItemView(discord.ui.View):
         :param new_vote_weight: The new vote weight.
         :return: Nothing.
         """
-        feedback_item = harmony_services.db.get_feedback_data(interaction.message.id)
+        # Most votes are new votes, so try casting one first.
+        feedback_item = await harmony_services.db.cast_feedback_vote(
+            interaction.message.id,
+            interaction.user.name,
+            new_vote_weight
+        )
 
-        # Is the user trying to vote on their own feedback?
-        if feedback_item.author_username == interaction.user.name:
+        if feedback_item:
             await interaction.response.send_message(
-                ":no_entry_sign: You can't vote on your own feedback.",
+                ":inbox_tray: Your vote has been cast.",
                 ephemeral=True
             )
 
-            return
+            await self.update_view(interaction, feedback_item)
 
-        # Has the user already voted?
-        vote = self.get_vote(interaction.user.name, feedback_item)
+            return
 
-        if vote:
-            # If they're trying to vote in the same direction as before, then don't let them.
-            if vote.vote_weight == new_vote_weight:
-                await interaction.response.send_message(
-                    ":no_entry_sign: Looks like you've already voted on this feedback - you can only vote once.",
-                    ephemeral=True
-                )
+        # If the vote couldn't be cast, they might be trying to change their vote to point the other way.
+        feedback_item = await harmony_services.db.flip_feedback_vote(
+            interaction.message.id,
+            interaction.user.name,
+            new_vote_weight
+        )
 
-                return
-            # Otherwise, update their existing vote to point the other way.
-            else:
-                vote.vote_weight = new_vote_weight
-                feedback_item.save()
+        if feedback_item:
+            await interaction.response.send_message(
+                ":inbox_tray: Your vote has been updated.",
+                ephemeral=True
+            )
 
-                await interaction.response.send_message(
-                    ":inbox_tray: Your vote has been updated.",
-                    ephemeral=True
-                )
+            await self.update_view(interaction, feedback_item)
 
-                await self.update_view(interaction, feedback_item)
+            return
 
-                return
+        # Otherwise, work out why the vote wasn't allowed.
+        feedback_item = await harmony_services.db.get_feedback_data(interaction.message.id)
 
-        feedback_item.votes.create(
-            discord_username=interaction.user.name,
-            vote_weight=new_vote_weight
-        )
+        # Is the user trying to vote on their own feedback?
+        if feedback_item.author_username == interaction.user.name:
+            await interaction.response.send_message(
+                ":no_entry_sign: You can't vote on your own feedback.",
+                ephemeral=True
+            )
 
-        feedback_item.save()
+            return
 
+        # If they're trying to vote in the same direction as before, then don't let them.
         await interaction.response.send_message(
-            ":inbox_tray: Your vote has been cast.",
+            ":no_entry_sign: Looks like you've already voted on this feedback - you can only vote once.",
             ephemeral=True
         )
 
-        await self.update_view(interaction, feedback_item)
-
     async def update_view(self, interaction: discord.Interaction, feedback_item: harmony_models.feedback.FeedbackItem):
-        upvote_count = (
-            sum([vote.vote_weight
-                 for vote in feedback_item.votes
-                 if vote.vote_weight == self.upvote_weight]))
-
-        downvote_count = (
-            abs(sum([vote.vote_weight
-                     for vote in feedback_item.votes
-                     if vote.vote_weight == self.downvote_weight])))
-
         await interaction.message.edit(
             embed=create_feedback_embed(
                 feedback_item.feedback_title,
                 feedback_item.feedback_description,
                 feedback_item.author_username,
-                upvote_count,
-                downvote_count
+                feedback_item.upvote_count,
+                feedback_item.downvote_count
             ),
             view=self
         )
 
-    @staticmethod
-    def get_vote(username: str, feedback_item: harmony_models.feedback.FeedbackItem) \
-            -> typing.Optional[harmony_models.feedback.FeedbackVote]:
-        """
-        Get a user's vote on an item.
-        :param username: The Discord username of the user to get the vote for.
-        :param feedback_item: The item to query for votes.
-        :return: The vote if a user has already voted, otherwise None.
-        """
-        try:
-            return feedback_item.votes.get(discord_username=username)
-        except mongoengine.DoesNotExist:
-            return None
-
 
 class CreateFeedbackItemModal(discord.ui.Modal):
     feedback_title_field = FeedbackTitleField()
@@ -164,7 +140,7 @@ class CreateFeedbackItemModal(discord.ui.Modal):
             discord_message_id=message.id
         )
 
-        feedback_item.save()
+        await harmony_services.db.save_document(feedback_item)
 
         await message.edit(
             content=None,
@@ -6,6 +6,8 @@ import discord
 import datetime
 import harmony_ui
 import harmony_services.usl
+import harmony_services.screening
+import harmony_services.reddit_outbox
 
 from loguru import logger
 from harmony_config import config
@@ -92,10 +94,10 @@ class UpdateRoleSelect(discord.ui.Select):
         new_response += f"- Granted the **{verify_role['role_name']}** Discord role to **{self.target_member.name}**."
         await interaction.response.send_message(new_response, ephemeral=True)
 
-        verification_data = harmony_db.get_verification_data(discord_user_id=self.target_member.id)
+        verification_data = await harmony_db.get_verification_data(discord_user_id=self.target_member.id)
 
         # Give the user their new Reddit flair.
-        harmony_reddit.update_user_flair(
+        await harmony_reddit.update_user_flair(
             verification_data.reddit_user.reddit_username,
             verify_role["reddit_flair_text"],
             verify_role["reddit_flair_css_class"]
@@ -106,7 +108,7 @@ class UpdateRoleSelect(discord.ui.Select):
 
         # Update our role ID bookkeeping.
         verification_data.discord_user.guild_roles = [role.id for role in self.target_member.roles]
-        verification_data.save()
+        await harmony_db.save_document(verification_data)
 
         new_response += f"\n- Updated verification data for u/**{verification_data.reddit_user.reddit_username}**."
         new_response += ("\n\n**All done!** Please check the subreddit if you want to verify the new flair "
@@ -148,7 +150,7 @@ class EnterRedditUsernameModal(discord.ui.Modal, title='Verify your Reddit accou
             account_type: typing.Literal["Discord", "Reddit"],
             required_age_days: int
     ) -> typing.NoReturn:
-        await interaction.response.send_message(
+        await interaction.followup.send(
             embed=harmony_ui.verify.create_account_age_requirement_not_met_embed(
                 account_type=account_type,
                 required_age_days=required_age_days
@@ -167,15 +169,25 @@ class EnterRedditUsernameModal(discord.ui.Modal, title='Verify your Reddit accou
         username_regex = re.compile(r'^([A-Za-z0-9_-])+$')
 
         if not username_regex.match(username):
-            await interaction.response.send_message('That Reddit username appears to be invalid.', ephemeral=True)
+            await interaction.followup.send('That Reddit username appears to be invalid.', ephemeral=True)
             return
 
         # Does the Reddit user even exist?
-        if not harmony_reddit.reddit_user_exists(username):
-            await interaction.response.send_message('That Reddit user doesn\'t exist.', ephemeral=True)
+        reddit_profile = await harmony_reddit.get_redditor_profile(username)
+
+        if not reddit_profile.is_active:
+            await interaction.followup.send('That Reddit user doesn\'t exist.', ephemeral=True)
             return
 
-        reddit_user = harmony_reddit.get_redditor(username)
+        # Screen the account before anything is sent to Reddit or saved.
+        screening_result = harmony_services.screening.screen_reddit_account(username)
+        screening_data = None
+
+        if screening_result.is_flagged:
+            screening_data = await self.handle_flagged_account(interaction, username, screening_result)
+
+            if not screening_data:
+                return
 
         verification_code = self.generate_verification_code(prefix=verification_token_prefix)
 
@@ -186,26 +198,33 @@ class EnterRedditUsernameModal(discord.ui.Modal, title='Verify your Reddit accou
                 guild_roles=[role.id for role in interaction.user.roles]
             ),
             reddit_user=verify_models.RedditUser(
-                reddit_user_id=reddit_user.id,
+                reddit_user_id=reddit_profile.reddit_user_id,
                 reddit_username=username
             ),
             pending_verification_data=verify_models.PendingVerificationData(
                 verification_code=verification_code
-            )
+            ),
+            screening_data=screening_data
         )
 
-        pending_verification_data.save()
+        await harmony_db.save_pending_verification(pending_verification_data)
+
+        if screening_data and screening_data.is_held:
+            await self.post_held_verification_for_review(interaction, pending_verification_data, screening_result)
+            await interaction.followup.send(embed=create_verification_held_embed(), ephemeral=True)
+            return
 
         embed = discord.Embed(
             title='Check your Reddit private messages',
-            description=f'''We've sent a message containing a verification code to your Reddit account - 
+            description=f'''We're sending a message containing a verification code to your Reddit account - 
             run `/verify` again and enter the code to finish verifying your account.
 
-            If you don't see anything from us, please check your Reddit privacy settings.
+            If you don't see anything from us within a few minutes, please check your Reddit privacy settings.
             '''
         )
 
-        harmony_reddit.send_verification_message(
+        # The message is sent in the background, so that a slow or failing Reddit doesn't hold up the interaction.
+        await harmony_services.reddit_outbox.enqueue_verification_message(
             username,
             verification_code,
             subreddit_name,
@@ -213,13 +232,106 @@ class EnterRedditUsernameModal(discord.ui.Modal, title='Verify your Reddit accou
         )
 
         # Send the user instructions on how to proceed.
-        await interaction.response.send_message(embed=embed, ephemeral=True)
+        await interaction.followup.send(embed=embed, ephemeral=True)
+
+    @staticmethod
+    async def handle_flagged_account(
+            interaction: discord.Interaction,
+            username: str,
+            screening_result: harmony_services.screening.ScreeningResult
+    ) -> typing.Optional[verify_models.ScreeningData]:
+        """
+        Carry out the configured screening action for an account which was flagged when screening it.
+        :param interaction: The interaction in which the user entered their Reddit username.
+        :param username: The Reddit username the user entered.
+        :param screening_result: What was found when screening the account.
+        :return: The screening data to save with the pending verification, or None if the verification was rejected.
+        """
+        screening_action = harmony_services.screening.screening_action
+        screening_channel = None
+
+        if harmony_services.screening.screening_channel_id:
+            screening_channel = interaction.client.get_channel(harmony_services.screening.screening_channel_id)
+
+        # Held verifications can't be reviewed without a channel to review them in.
+        if screening_action == harmony_services.screening.SCREENING_ACTION_HOLD and not screening_channel:
+            logger.error(f"Verification screening channel with ID {harmony_services.screening.screening_channel_id} "
+                         f"couldn't be found, rejecting instead of holding.")
+            screening_action = harmony_services.screening.SCREENING_ACTION_REJECT
+
+        logger.info(f"Verification of u/{username} by {interaction.user.name} was flagged when screening "
+                    f"({'; '.join(screening_result.reasons)}), action: {screening_action}")
+
+        screening_embed = create_screening_embed(interaction.user, username, screening_result, screening_action)
+        screening_data = verify_models.ScreeningData(reasons=screening_result.reasons)
+
+        # Held verifications are posted for review once they've been saved, so the review buttons always have a
+        # pending verification to act on.
+        if screening_action == harmony_services.screening.SCREENING_ACTION_HOLD:
+            screening_data.is_held = True
+            return screening_data
+
+        if screening_channel:
+            await screening_channel.send(embed=screening_embed)
+
+        if screening_action == harmony_services.screening.SCREENING_ACTION_REJECT:
+            await interaction.followup.send(embed=create_verification_rejected_embed(), ephemeral=True)
+            return None
+
+        return screening_data
+
+    @staticmethod
+    async def post_held_verification_for_review(
+            interaction: discord.Interaction,
+            pending_verification: verify_models.PendingVerification,
+            screening_result: harmony_services.screening.ScreeningResult
+    ) -> typing.NoReturn:
+        """
+        Post a saved, held verification in the screening channel for moderators to review, and attach the review
+        message to it. If the verification can't be posted for review, it's deleted rather than being left held with
+        nothing to review it from.
+        :param interaction: The interaction in which the user entered their Reddit username.
+        :param pending_verification: The held pending verification, which has already been saved.
+        :param screening_result: What was found when screening the account.
+        :return: Nothing.
+        """
+        screening_channel = interaction.client.get_channel(harmony_services.screening.screening_channel_id)
+        screening_embed = create_screening_embed(
+            interaction.user,
+            pending_verification.reddit_user.reddit_username,
+            screening_result,
+            harmony_services.screening.SCREENING_ACTION_HOLD
+        )
+
+        try:
+            review_message = await screening_channel.send(embed=screening_embed, view=VerificationReviewView())
+        except Exception:
+            await harmony_db.delete_document(pending_verification)
+            raise
+
+        try:
+            is_attached = await harmony_db.set_pending_verification_review_message(
+                pending_verification,
+                review_message.id
+            )
+        except Exception:
+            await review_message.delete()
+            await harmony_db.delete_document(pending_verification)
+            raise
+
+        # The user replaced the verification while it was being posted, so there's nothing left to review.
+        if not is_attached:
+            await review_message.delete()
 
     async def on_submit(self, interaction: discord.Interaction) -> typing.NoReturn:
+        # Checking the account with Reddit can take longer than Discord allows for a response, so the response is
+        # deferred, and everything after this is sent as a followup.
+        await interaction.response.defer(ephemeral=True, thinking=True)
+
         username = self.reddit_username_field.value.replace('u/', '')
         discord_account_age_days = (datetime.datetime.now(tz=datetime.timezone.utc) - interaction.user.created_at).days
 
-        if harmony_reddit.get_account_age_days(username) < reddit_required_account_age:
+        if await harmony_reddit.get_account_age_days(username) < reddit_required_account_age:
             await self.send_account_age_not_met_modal(
                 interaction, "Reddit", reddit_required_account_age
             )
@@ -237,19 +349,6 @@ class EnterRedditUsernameModal(discord.ui.Modal, title='Verify your Reddit accou
 class EnterVerificationTokenModal(discord.ui.Modal, title='Enter your verification code'):
     verification_token_field = VerificationTokenField()
 
-    @staticmethod
-    def update_db(pending_verification: verify_models.PendingVerification):
-        verified_user_data = verify_models.VerifiedUser(
-            discord_user=pending_verification.discord_user,
-            reddit_user=pending_verification.reddit_user,
-            user_verification_data=verify_models.UserVerificationData(
-                requested_verification_at=pending_verification.pending_verification_data.requested_verification_at
-            )
-        )
-
-        verified_user_data.save()
-        pending_verification.delete()
-
     @staticmethod
     async def update_roles(member: discord.Member) -> typing.NoReturn:
         """
@@ -263,10 +362,13 @@ class EnterVerificationTokenModal(discord.ui.Modal, title='Enter your verificati
     async def complete_verification(self, interaction: discord.Interaction) -> typing.NoReturn:
         entered_code = self.verification_token_field.value
 
-        pending_verification = harmony_db.get_pending_verification(interaction.user.id)
+        pending_verification = await harmony_db.get_pending_verification(interaction.user.id)
 
-        if pending_verification.pending_verification_data.verification_code == entered_code:
-            self.update_db(pending_verification)
+        if not pending_verification:
+            await interaction.response.send_message("Your verification code has expired. Please run `/verify` "
+                                                    "again to get a new code.", ephemeral=True)
+        elif pending_verification.pending_verification_data.verification_code == entered_code:
+            await harmony_db.complete_pending_verification(pending_verification)
             await self.update_roles(interaction.user)
 
             await interaction.response.send_message("Done! You've successfully linked your Reddit account.",
@@ -286,14 +388,14 @@ class UnverifyConfirmationModal(discord.ui.Modal, title="Enter your Reddit usern
     reddit_username_field = RedditUsernameField()
 
     async def unverify(self, interaction: discord.Interaction):
-        verification_data = harmony_db.get_verification_data(discord_user_id=interaction.user.id)
+        verification_data = await harmony_db.get_verification_data(discord_user_id=interaction.user.id)
 
         reddit_username = self.reddit_username_field.value
 
         reddit_username = reddit_username.replace('u/', '')
 
         if reddit_username == verification_data.reddit_user.reddit_username:
-            verification_data.delete()
+            await harmony_db.delete_document(verification_data)
 
             await interaction.user.remove_roles(verified_role, reason="Unverified using Harmony Bot")
             await interaction.user.add_roles(unverified_role, reason="Unverified using Harmony Bot")
@@ -320,9 +422,115 @@ class UpdateRoleView(discord.ui.View):
         await harmony_ui.handle_error(interaction, error)
 
 
+class VerificationReviewView(discord.ui.View):
+    def __init__(self):
+        """
+        Create the VerificationReviewView which allows moderators to approve or reject a held verification.
+        The view is persistent, and finds the verification it belongs to using the ID of the message it's attached to.
+        """
+        super().__init__(timeout=None)
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if not interaction.user.get_role(user_management_role.id):
+            await interaction.response.send_message(
+                ":no_entry_sign: Only moderators can review verifications.",
+                ephemeral=True
+            )
+
+            return False
+
+        return True
+
+    @discord.ui.button(label="Approve", style=discord.ButtonStyle.green, custom_id="verification_review_approve")
+    async def approve(self, interaction: discord.Interaction, _: discord.ui.Button) -> typing.NoReturn:
+        pending_verification = await harmony_db.release_held_pending_verification(interaction.message.id)
+
+        if not pending_verification:
+            await self.send_already_reviewed_message(interaction)
+            return
+
+        reddit_username = pending_verification.reddit_user.reddit_username
+        logger.info(f"Held verification of u/{reddit_username} approved by moderator {interaction.user.name}")
+
+        await harmony_services.reddit_outbox.enqueue_verification_message(
+            reddit_username,
+            pending_verification.pending_verification_data.verification_code,
+            subreddit_name,
+            interaction.guild.name
+        )
+
+        await self.complete_review(interaction, f"Approved by {interaction.user.mention}")
+        await self.notify_member(
+            interaction,
+            pending_verification,
+            create_verification_approved_embed(reddit_username, interaction.guild.name)
+        )
+
+    @discord.ui.button(label="Reject", style=discord.ButtonStyle.red, custom_id="verification_review_reject")
+    async def reject(self, interaction: discord.Interaction, _: discord.ui.Button) -> typing.NoReturn:
+        pending_verification = await harmony_db.delete_held_pending_verification(interaction.message.id)
+
+        if not pending_verification:
+            await self.send_already_reviewed_message(interaction)
+            return
+
+        logger.info(f"Held verification of u/{pending_verification.reddit_user.reddit_username} rejected by "
+                    f"moderator {interaction.user.name}")
+
+        await self.complete_review(interaction, f"Rejected by {interaction.user.mention}")
+        await self.notify_member(interaction, pending_verification, create_verification_rejected_embed())
+
+    @staticmethod
+    async def send_already_reviewed_message(interaction: discord.Interaction) -> typing.NoReturn:
+        await interaction.response.send_message(
+            ":information_source: This verification is no longer awaiting review. It may have already been "
+            "reviewed, been cancelled by the user, or expired.",
+            ephemeral=True
+        )
+
+    @staticmethod
+    async def complete_review(interaction: discord.Interaction, outcome: str) -> typing.NoReturn:
+        embed = interaction.message.embeds[0] if interaction.message.embeds else discord.Embed()
+        embed.add_field(name="Outcome", value=outcome, inline=False)
+
+        await interaction.response.edit_message(embed=embed, view=None)
+
+    @staticmethod
+    async def notify_member(
+            interaction: discord.Interaction,
+            pending_verification: verify_models.PendingVerification,
+            embed: discord.Embed
+    ) -> typing.NoReturn:
+        discord_user_id = pending_verification.discord_user.discord_user_id
+
+        try:
+            member = interaction.guild.get_member(discord_user_id) or \
+                await interaction.guild.fetch_member(discord_user_id)
+        except discord.NotFound:
+            logger.info(f"Discord user {discord_user_id} has left the server, so they weren't notified of the "
+                        f"outcome of their verification review.")
+            return
+        except discord.HTTPException as e:
+            logger.warning(f"Failed to fetch Discord user {discord_user_id} to notify them of the outcome of their "
+                           f"verification review: {type(e).__name__}: {str(e)}")
+            return
+
+        try:
+            await member.send(embed=embed)
+        except discord.HTTPException as e:
+            logger.warning(f"Failed to notify Discord user {discord_user_id} of the outcome of their verification "
+                           f"review: {type(e).__name__}: {str(e)}")
+
+    async def on_error(self, interaction: discord.Interaction, error: Exception, item: discord.ui.Item) \
+            -> typing.NoReturn:
+        await harmony_ui.handle_error(interaction, error)
+
+
 async def display_whois_result(interaction: discord.Interaction, member: discord.Member):
-    verification_data = harmony_db.get_verification_data(discord_user_id=member.id)
-    usl_data = await harmony_services.usl.lookup_usl(verification_data.reddit_user.reddit_username)
+    verification_data = await harmony_db.get_verification_data(
+        discord_user_id=member.id,
+        read_preference=harmony_db.lookup_read_preference
+    )
 
     embed = discord.Embed(
         title=f"Whois information for {member.display_name}"
@@ -342,7 +550,14 @@ async def display_whois_result(interaction: discord.Interaction, member: discord
             inline=False
         )
 
-        embed.add_field(name="On USL?", value="No" if not usl_data else f"Yes! ({', '.join(usl_data)})")
+        usl_data = harmony_services.usl.lookup_usl(verification_data.reddit_user.reddit_username)
+
+        if usl_data:
+            embed.add_field(name="On USL?", value=f"Yes! ({', '.join(usl_data)})")
+        elif harmony_services.usl.is_usl_loaded():
+            embed.add_field(name="On USL?", value="No")
+        else:
+            embed.add_field(name="On USL?", value="Unknown (the USL hasn't loaded yet)")
 
     await interaction.response.send_message(embed=embed, ephemeral=True)
 
@@ -401,6 +616,65 @@ def create_no_verification_data_embed(guild_name: str, subreddit_name: str) -> d
     )
 
 
+def create_screening_embed(
+        member: discord.Member,
+        reddit_username: str,
+        screening_result: harmony_services.screening.ScreeningResult,
+        screening_action: str
+) -> discord.Embed:
+    action_descriptions = {
+        harmony_services.screening.SCREENING_ACTION_REJECT: "The verification was rejected.",
+        harmony_services.screening.SCREENING_ACTION_FLAG: "The verification was allowed to continue.",
+        harmony_services.screening.SCREENING_ACTION_HOLD: "The verification code won't be sent until a moderator "
+                                                          "approves it."
+    }
+
+    embed = discord.Embed(
+        title=f"Verification flagged: u/{reddit_username}",
+        description=action_descriptions[screening_action]
+    )
+
+    embed.add_field(name="Discord member", value=f"{member.mention} ({member.name})", inline=False)
+    embed.add_field(name="Reddit account", value=f"u/{reddit_username}", inline=False)
+    embed.add_field(name="Reasons", value="\n".join(f"- {reason}" for reason in screening_result.reasons),
+                    inline=False)
+
+    return embed
+
+
+def create_verification_held_embed() -> discord.Embed:
+    return discord.Embed(
+        title="Your verification needs to be reviewed",
+        description="""
+        Before we can send you a verification code, your Reddit account needs to be reviewed by the moderation team.
+        
+        We'll send you a message when they've reviewed it. You don't need to do anything in the meantime.
+        """
+    )
+
+
+def create_verification_approved_embed(reddit_username: str, guild_name: str) -> discord.Embed:
+    return discord.Embed(
+        title="Your verification has been approved",
+        description=f"""
+        The moderation team has approved your request to verify **u/{reddit_username}** in {guild_name}.
+        
+        We're sending a message containing a verification code to your Reddit account - run `/verify` again and enter the code to finish verifying your account.
+        """
+    )
+
+
+def create_verification_rejected_embed() -> discord.Embed:
+    return discord.Embed(
+        title="We couldn't verify your Reddit account",
+        description="""
+        Unfortunately, we're unable to verify that Reddit account.
+        
+        If you think this is in error, please contact the moderation team.
+        """
+    )
+
+
 def create_account_age_requirement_not_met_embed(
         account_type: typing.Literal["Discord", "Reddit"],
         required_age_days: int
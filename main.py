@@ -2,12 +2,17 @@ from harmony_config import config  # DO NOT move this import, it'll break the co
 
 import os
 import typing
+import asyncio
 import discord
 import harmony_cogs
+import harmony_services.db
+import harmony_services.reddit
+import harmony_services.usl
 
 from loguru import logger
 from discord.ext import commands
 from harmony_ui.feedback import FeedbackItemView
+from harmony_ui.verify import VerificationReviewView
 
 harmony_management_role_id = config.get_configuration_key(
     "discord.harmony_management_role_id",
@@ -19,6 +24,7 @@ harmony_management_role_id = config.get_configuration_key(
 class HarmonyBot(commands.Bot):
     loaded_cogs: typing.List[typing.Type[commands.Cog]] = []
     is_starting_up: bool = True
+    migrations_task: typing.Optional[asyncio.Task] = None
 
     def __init__(self) -> typing.NoReturn:
         intents = discord.Intents.default()
@@ -28,6 +34,25 @@ class HarmonyBot(commands.Bot):
 
     async def setup_hook(self) -> typing.NoReturn:
         self.add_view(FeedbackItemView())
+        self.add_view(VerificationReviewView())
+
+        # Migrations only touch documents that need them, so they can run in the background.
+        # The task is kept so that it isn't garbage collected while it's running.
+        self.migrations_task = self.loop.create_task(harmony_services.db.run_migrations())
+        self.migrations_task.add_done_callback(self.on_migrations_done)
+
+    @staticmethod
+    def on_migrations_done(task: asyncio.Task) -> typing.NoReturn:
+        if task.cancelled():
+            logger.warning("Database migrations were cancelled before they finished.")
+        elif task.exception():
+            error = task.exception()
+            logger.error(f"Failed to run database migrations: {type(error).__name__}: {str(error)}")
+
+    async def close(self) -> typing.NoReturn:
+        await super().close()
+        await harmony_services.reddit.close()
+        await harmony_services.usl.close()
 
     async def on_ready(self):
         logger.info(f'Logged in as {self.user} (ID: {self.user.id})')